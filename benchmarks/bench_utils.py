@@ -0,0 +1,48 @@
+"""Helpers shared by the benchmark scripts in this folder."""
+import os
+import sys
+import csv
+import json
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+common_dir = os.path.join(project_root, 'common')
+if common_dir not in sys.path:
+    sys.path.append(common_dir)
+
+# one nearest-rank percentile for the benchmarks and the server's /stats reports
+from functions.tracing import percentile
+
+RESULTS_DIR = os.path.join(project_root, "benchmarks", "results")
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def load_training_pairs():
+    """anchor/positive pairs from training_data.json."""
+    with open(os.path.join(project_root, "training_data.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_report(rows, output_path, csv_output=True):
+    """Writes rows as JSON (and CSV next to it) and returns the written paths."""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=4)
+    paths = [output_path]
+    if csv_output and rows:
+        csv_path = os.path.splitext(output_path)[0] + ".csv"
+        fieldnames = []
+        for row in rows:
+            fieldnames += [key for key in row if key not in fieldnames]
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        paths.append(csv_path)
+    return paths
@@ -0,0 +1,87 @@
+"""
+Tail latency of the JSON classification stages with and without hedging.
+
+Calls polish_question, get_section_using_llm and check_need_more_context_needed
+--calls times each at --concurrency, first with hedging off, then on
+(functions/hedging.py), and reports per stage p50/p95/p99, the hedge rate and
+which model won. Meant for the stand-in server with a heavy-tailed latency:
+
+    python common/stand_in_server.py --latency-ms 300 --latency-jitter-ms 600 --latency-distribution lognormal &
+    RAG_STAND_IN_LLM=1 python benchmarks/hedging_benchmark.py --calls 300 --concurrency 8
+
+usage: python benchmarks/hedging_benchmark.py [--model gemini] [--calls 300]
+"""
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import RESULTS_DIR, percentile, write_report
+from config import MODEL_NAME
+from functions import hedging
+from functions.query_utils import polish_question, get_section_using_llm, check_need_more_context_needed
+
+QUESTION = "Which candidates have more than 3 years of python experience?"
+
+
+def stage_calls(model):
+    return {
+        "polish": lambda: polish_question(QUESTION, model_name=model),
+        "section": lambda: get_section_using_llm(QUESTION, model_name=model),
+        "need_more_context": lambda: check_need_more_context_needed(QUESTION, "schema and sql results"),
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def run_phase(name, calls, args):
+    hedging.HEDGE_ENABLED = name == "hedged"
+    rows = []
+    for stage, fn in stage_calls(args.model).items():
+        before = hedging.stats().get(stage, {})
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            latencies = list(executor.map(lambda _: timed(fn), range(calls)))
+        after = hedging.stats().get(stage, {})
+        hedged = after.get("hedged", 0) - before.get("hedged", 0)
+        rows.append({
+            "mode": name,
+            "stage": stage,
+            "calls": calls,
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+            "hedge_rate": round(hedged / calls, 4),
+            "secondary_won": after.get("secondary_won", 0) - before.get("secondary_won", 0),
+        })
+        print(json.dumps(rows[-1]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=MODEL_NAME, help="primary model; the secondary comes from MODEL_COLLECTIONS")
+    parser.add_argument("--calls", type=int, default=300, help="calls per stage and mode")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"hedging_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    print(f"Primary {args.model}, secondary {hedging.secondary_model(args.model)}")
+    baseline = run_phase("off", args.calls, args)
+    # the first HEDGE_MIN_SAMPLES calls of each stage only fill the primary's latency window
+    hedged = run_phase("hedged", args.calls, args)
+    for row, base in zip(hedged, baseline):
+        row["p99_improvement_ms"] = round(base["p99_ms"] - row["p99_ms"], 1)
+        print(f"{row['stage']:<18} hedge rate {row['hedge_rate']:.1%}   p99 {base['p99_ms']} -> {row['p99_ms']} ms")
+
+    for path in write_report(baseline + hedged, args.output):
+        print(f"Saved report to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+/history latency as the questions table grows.
+
+For each --sizes N a scratch database with N synthetic questions is built through
+create_qa_tables (so it has the timestamp index and the FTS5 search table), then
+timed over --repeats runs:
+  first_page   get_qa_history, newest page
+  deep_page    get_qa_history, the page after following --deep-pages cursors
+  search       get_qa_history with a search term
+  full_scan    the previous /history query: every row, ORDER BY timestamp DESC
+
+With the index, first_page / deep_page / search should stay flat while full_scan
+grows with N.
+
+usage: python benchmarks/history_benchmark.py [--sizes 10000 100000 1000000]
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from bench_utils import RESULTS_DIR, percentile, write_report
+from config import HISTORY_PAGE_SIZE
+import functions.database_utils as db_utils
+
+WORDS = ["python", "java", "flutter", "react", "aws", "docker", "kubernetes", "sql", "machine", "learning",
+         "developer", "senior", "experience", "years", "candidates", "skills", "projects", "backend", "frontend", "lead"]
+TEMPLATES = [
+    "Who has more than {n} years of {a} experience?",
+    "List candidates with {a} and {b} skills",
+    "Which {a} developer worked on {b} projects?",
+    "Find a senior {a} engineer who knows {b}",
+]
+
+
+def build_db(path, rows, seed=0, batch=10000):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    db_utils.create_qa_tables(conn)
+    start = datetime(2024, 1, 1)
+    sql = "INSERT INTO questions (question, answer, timestamp) VALUES (?, ?, ?)"
+    for offset in range(0, rows, batch):
+        items = []
+        for i in range(offset, min(rows, offset + batch)):
+            question = rng.choice(TEMPLATES).format(n=rng.randint(1, 10), a=rng.choice(WORDS), b=rng.choice(WORDS))
+            # a few rows share a second, so the id tie-breaker is exercised
+            timestamp = (start + timedelta(seconds=i // 3)).strftime("%Y-%m-%d %H:%M:%S")
+            items.append((question, "answer", timestamp))
+        with conn:
+            conn.executemany(sql, items)
+    return conn
+
+
+def timed(fn, repeats):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def deep_cursor(conn, pages, limit):
+    cursor = None
+    for _ in range(pages):
+        page = db_utils.get_qa_history(conn, limit=limit, cursor=cursor)
+        if not page["next_cursor"]:
+            break
+        cursor = page["next_cursor"]
+    return cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--limit", type=int, default=HISTORY_PAGE_SIZE)
+    parser.add_argument("--deep-pages", type=int, default=100, help="cursors followed before timing deep_page")
+    parser.add_argument("--search", default="kubernetes senior")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--full-scan-repeats", type=int, default=3, help="the unpaginated scan is slow on large tables")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"history_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, f"history_{size}.db")
+            print(f"Building {size} questions...")
+            build_start = time.perf_counter()
+            conn = build_db(path, size)
+            print(f"  built in {time.perf_counter() - build_start:.1f}s")
+            try:
+                cursor = deep_cursor(conn, args.deep_pages, args.limit)
+                cases = {
+                    "first_page": (lambda: db_utils.get_qa_history(conn, limit=args.limit), args.repeats),
+                    "deep_page": (lambda: db_utils.get_qa_history(conn, limit=args.limit, cursor=cursor), args.repeats),
+                    "search": (lambda: db_utils.get_qa_history(conn, limit=args.limit, search=args.search), args.repeats),
+                    "full_scan": (lambda: conn.execute("SELECT id, question, timestamp FROM questions ORDER BY timestamp DESC").fetchall(),
+                                  args.full_scan_repeats),
+                }
+                for name, (fn, repeats) in cases.items():
+                    latencies = timed(fn, repeats)
+                    row = {
+                        "rows": size,
+                        "query": name,
+                        "p50_ms": round(percentile(latencies, 50), 2),
+                        "p95_ms": round(percentile(latencies, 95), 2),
+                    }
+                    print(f"  {name:<11} p50 {row['p50_ms']:>9.2f} ms   p95 {row['p95_ms']:>9.2f} ms")
+                    report.append(row)
+            finally:
+                conn.close()
+
+    for path in write_report(report, args.output):
+        print(f"Saved report to {path}")
+
+
+if __name__ == "__main__":
+    main()
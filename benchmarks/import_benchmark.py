@@ -0,0 +1,132 @@
+"""
+Cold-start import time of the server and CLI entry points.
+
+Each target module is imported --runs times in a fresh interpreter under
+`python -X importtime` from the project root, the way it is started. Reported per
+target: median total import time, median wall time of the interpreter, and the
+packages that took longest to import (self time summed per top-level package), so
+a heavy dependency that sneaks back into an entry point's import graph stands out.
+
+--compare-rev checks the given git revision out into a temporary worktree and
+measures it the same way, e.g. to see what the lazy imports in query_utils and
+server/app.py save:
+
+    python benchmarks/import_benchmark.py --compare-rev HEAD~1
+
+usage: python benchmarks/import_benchmark.py [--targets server/app.py common/query.py] [--runs 5]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+from bench_utils import project_root, RESULTS_DIR, write_report
+
+TARGETS = ["server/app.py", "common/query.py", "common/ingest_new.py"]
+
+
+def parse_importtime(stderr):
+    """:return: (total seconds, {top-level package: self seconds}) from -X importtime output"""
+    total_us = 0
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not name[1:].startswith(" "):
+            # top level of the import tree: its cumulative time covers everything below it
+            total_us += int(cumulative_us)
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    return total_us / 1e6, {name: us / 1e6 for name, us in packages.items()}
+
+
+def import_once(root, target):
+    directory, filename = os.path.split(target)
+    module = os.path.splitext(filename)[0]
+    # sys.path[0] is the script's folder when an entry point is run as `python <target>`
+    code = f"import sys; sys.path.insert(0, {os.path.join(root, directory)!r}); import {module}"
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=root, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        return None, wall, {}, error
+    total, packages = parse_importtime(result.stderr)
+    return total, wall, packages, None
+
+
+def measure(root, target, runs, top):
+    totals, walls, packages, error = [], [], {}, None
+    for _ in range(runs):
+        total, wall, run_packages, error = import_once(root, target)
+        if error:
+            break
+        totals.append(total)
+        walls.append(wall)
+        for name, seconds in run_packages.items():
+            packages.setdefault(name, []).append(seconds)
+    if error:
+        return {"target": target, "error": error}
+    heaviest = sorted(((statistics.median(v), name) for name, v in packages.items()), reverse=True)[:top]
+    return {
+        "target": target,
+        "import_ms": round(statistics.median(totals) * 1000, 1),
+        "wall_ms": round(statistics.median(walls) * 1000, 1),
+        "heaviest": ", ".join(f"{name} {seconds * 1000:.0f}ms" for seconds, name in heaviest),
+    }
+
+
+def checkout(rev):
+    path = tempfile.mkdtemp(prefix="import_benchmark_")
+    subprocess.run(["git", "worktree", "add", "--detach", path, rev], cwd=project_root, check=True, capture_output=True)
+    return path
+
+
+def remove_checkout(path):
+    subprocess.run(["git", "worktree", "remove", "--force", path], cwd=project_root, capture_output=True)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", default=TARGETS, help="entry points relative to the project root")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per target; medians are reported")
+    parser.add_argument("--top", type=int, default=5, help="heaviest packages listed per target")
+    parser.add_argument("--compare-rev", help="git revision to measure as the baseline, e.g. HEAD~1")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"import_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    roots = [("working tree", project_root)]
+    baseline = checkout(args.compare_rev) if args.compare_rev else None
+    if baseline:
+        roots.insert(0, (args.compare_rev, baseline))
+    report = []
+    try:
+        for label, root in roots:
+            for target in args.targets:
+                row = {"revision": label, **measure(root, target, args.runs, args.top)}
+                print(json.dumps(row))
+                report.append(row)
+    finally:
+        if baseline:
+            remove_checkout(baseline)
+
+    if baseline:
+        for target in args.targets:
+            before, after = [row for row in report if row["target"] == target]
+            if "import_ms" in before and "import_ms" in after:
+                print(f"{target:<22} import {before['import_ms']:>8.1f} -> {after['import_ms']:>8.1f} ms   "
+                      f"wall {before['wall_ms']:>8.1f} -> {after['wall_ms']:>8.1f} ms")
+    for path in write_report(report, args.output):
+        print(f"Saved report to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Replay load test for the Flask / Socket.IO server (server/app.py).
+
+Questions come from the `questions` table of a QA database or from a JSONL file
+(one {"question": ...} object or plain string per line). They are sent at a target
+rate (open loop: latency is measured from the scheduled send time, so a saturated
+server shows up as queueing instead of silently lowering the offered load) with at
+most --concurrency requests in flight. Requests rotate over --endpoints.
+
+--listeners opens that many Socket.IO clients that count log events and bytes.
+The server streams a request's logs only to the session named in its "sid", so
+requests are spread round-robin over the listeners' sids, the way each browser tab
+asks its own questions. With --compare-listeners the run is done twice, without
+and with listeners, and the latency difference per endpoint is reported as the
+log-emission overhead. Log events are not tagged with the request that produced
+them, so the per-request log counters cover the whole phase; run one endpoint at
+a time to attribute them to an endpoint.
+
+Reported per endpoint: requests, errors, error rate, throughput, latency p50/p90/p95/p99.
+With --sample-server the server's /metrics is polled during the phase for the peak
+number of requests in flight per endpoint, and with --server-pid also the peak thread
+count of that process, e.g. for hundreds of concurrent questions:
+
+    RAG_LLM_MAX_IN_FLIGHT=1000 RAG_LLM_MAX_IN_FLIGHT_PER_MODEL='{}' RAG_LLM_MAX_QUEUE=2000 RAG_STAND_IN_LLM=1 python server/app.py &
+    python benchmarks/load_test.py --endpoints /chat --qps 60 --concurrency 600 --sample-server --server-pid <pid>
+
+For a hermetic run, pair it with the stand-in LLM server:
+    python common/stand_in_server.py --latency-ms 200 &
+    RAG_STAND_IN_LLM=1 python server/app.py &
+    python benchmarks/load_test.py --qps 5 --concurrency 16 --duration 60 --listeners 4 --compare-listeners
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import itertools
+import urllib.request
+import urllib.error
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import project_root, RESULTS_DIR, percentile, write_report
+
+DEFAULT_ENDPOINTS = ["/chat"]
+LOG_EVENTS = ["log_message", "log_batch"]
+
+
+def load_questions(questions_file=None, questions_db=None, limit=None):
+    questions = []
+    if questions_file:
+        with open(questions_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                questions.append(item["question"] if isinstance(item, dict) else str(item))
+    else:
+        conn = sqlite3.connect(questions_db)
+        try:
+            rows = conn.execute("SELECT question FROM questions ORDER BY id").fetchall()
+        finally:
+            conn.close()
+        questions = [row[0] for row in rows if row[0]]
+    if limit:
+        questions = questions[:limit]
+    if not questions:
+        raise ValueError("No questions to replay.")
+    return questions
+
+
+class LogListeners:
+    """Socket.IO clients counting the log events the server pushes to every tab."""
+
+    def __init__(self, base_url, count):
+        try:
+            import socketio
+        except ImportError:
+            raise ImportError("python-socketio is not installed. Please install it with `pip install \"python-socketio[client]\"`.")
+        self.lock = threading.Lock()
+        self.events = 0
+        self.records = 0
+        self.bytes = 0
+        self.clients = []
+        for _ in range(count):
+            client = socketio.Client(reconnection=False)
+            for event in LOG_EVENTS:
+                client.on(event, self.on_log)
+            # WebSocket only, like the browser client (server/static/script.js)
+            client.connect(base_url, transports=["websocket"], wait_timeout=10)
+            self.clients.append(client)
+        self.sids = [client.get_sid() for client in self.clients]
+
+    def on_log(self, payload):
+        size = len(json.dumps(payload))
+        # log_batch carries a list of records, log_message a single one
+        records = len(payload.get("records", [])) if isinstance(payload, dict) and "records" in payload else 1
+        with self.lock:
+            self.events += 1
+            self.records += records
+            self.bytes += size
+
+    def close(self):
+        for client in self.clients:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+
+
+class ServerSampler:
+    """Polls the server while a phase runs: peak requests in flight per endpoint (/metrics), peak threads of server_pid."""
+
+    IN_FLIGHT = re.compile(r'^rag_http_requests_in_flight\{endpoint="([^"]*)"\} ([0-9.e+-]+)$', re.MULTILINE)
+
+    def __init__(self, base_url, server_pid=None, interval=0.2):
+        self.base_url = base_url
+        self.server_pid = server_pid
+        self.interval = interval
+        self.peak_in_flight = {}
+        self.peak_threads = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        with urllib.request.urlopen(self.base_url + "/metrics", timeout=5) as response:
+            text = response.read().decode("utf-8")
+        for endpoint, value in self.IN_FLIGHT.findall(text):
+            self.peak_in_flight[endpoint] = max(self.peak_in_flight.get(endpoint, 0), int(float(value)))
+        if self.server_pid:
+            with open(f"/proc/{self.server_pid}/status") as f:
+                threads = int(next(line for line in f if line.startswith("Threads:")).split()[1])
+            self.peak_threads = max(self.peak_threads or 0, threads)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def send_request(base_url, endpoint, question, options, timeout, sid=None):
+    if endpoint.startswith("/history"):
+        request = urllib.request.Request(base_url + endpoint, method="GET")
+    else:
+        body = {"question": question, **options}
+        if sid:
+            body["sid"] = sid
+        request = urllib.request.Request(
+            base_url + endpoint,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception:
+        return 0
+
+
+def run_phase(args, questions, listeners_count):
+    options = {k: v for k, v in {
+        "model": args.model,
+        "embedding_model": args.embedding_model,
+        "parser": args.parser,
+        "db_name": args.db_name,
+    }.items() if v}
+
+    listeners = LogListeners(args.base_url, listeners_count) if listeners_count else None
+    sampler = ServerSampler(args.base_url, getattr(args, "server_pid", None)) if getattr(args, "sample_server", False) else None
+    results = []
+    results_lock = threading.Lock()
+    endpoints = itertools.cycle(args.endpoints)
+    question_cycle = itertools.cycle(questions)
+    sid_cycle = itertools.cycle(listeners.sids) if listeners else itertools.repeat(None)
+    total = args.requests or int(args.qps * args.duration)
+    interval = 1.0 / args.qps
+
+    def task(endpoint, question, scheduled, sid):
+        status = send_request(args.base_url, endpoint, question, options, args.timeout, sid)
+        finished = time.perf_counter()
+        with results_lock:
+            results.append((endpoint, status, (finished - scheduled) * 1000))
+
+    phase_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for i in range(total):
+            scheduled = phase_start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(task, next(endpoints), next(question_cycle), scheduled, next(sid_cycle))
+    elapsed = time.perf_counter() - phase_start
+    # let trailing log events arrive before reading the counters
+    time.sleep(0.5)
+    if sampler:
+        sampler.stop()
+
+    rows = []
+    for endpoint in args.endpoints:
+        latencies = [ms for ep, _, ms in results if ep == endpoint]
+        errors = sum(1 for ep, status, _ in results if ep == endpoint and not (200 <= status < 300))
+        rows.append({
+            "endpoint": endpoint,
+            "listeners": listeners_count,
+            "requests": len(latencies),
+            "errors": errors,
+            "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+            "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p90_ms": round(percentile(latencies, 90), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+        })
+        if sampler:
+            rows[-1]["peak_in_flight"] = sampler.peak_in_flight.get(endpoint, 0)
+            rows[-1]["peak_server_threads"] = sampler.peak_threads
+    if listeners:
+        listeners.close()
+        total_requests = len(results) or 1
+        for row in rows:
+            row["log_events_per_request"] = round(listeners.events / total_requests, 2)
+            row["log_records_per_request"] = round(listeners.records / total_requests, 2)
+            row["log_bytes_per_request"] = round(listeners.bytes / total_requests, 1)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS, help="e.g. /chat /chat/cv_agent /history")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--questions-file", help="JSONL file of questions")
+    source.add_argument("--questions-db", default=os.path.join(project_root, "db.db"), help="SQLite db with a questions table")
+    parser.add_argument("--limit", type=int, help="use only the first N questions")
+    parser.add_argument("--qps", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds, ignored when --requests is set")
+    parser.add_argument("--requests", type=int, help="total requests per phase")
+    parser.add_argument("--timeout", type=float, default=480.0)
+    parser.add_argument("--listeners", type=int, default=0, help="Socket.IO log listeners to attach")
+    parser.add_argument("--compare-listeners", action="store_true", help="also run without listeners and report the overhead")
+    parser.add_argument("--sample-server", action="store_true", help="record peak requests in flight from the server's /metrics")
+    parser.add_argument("--server-pid", type=int, help="with --sample-server, also record the peak thread count of this process")
+    parser.add_argument("--model")
+    parser.add_argument("--embedding-model")
+    parser.add_argument("--parser")
+    parser.add_argument("--db-name")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions_file, args.questions_db, args.limit)
+    print(f"Replaying {len(questions)} questions at {args.qps} qps, concurrency {args.concurrency}, endpoints {args.endpoints}")
+
+    report = []
+    baseline = None
+    if args.compare_listeners and args.listeners:
+        baseline = run_phase(args, questions, 0)
+        report += baseline
+    rows = run_phase(args, questions, args.listeners)
+    if baseline:
+        for row, base in zip(rows, baseline):
+            row["log_overhead_p50_ms"] = round(row["p50_ms"] - base["p50_ms"], 1)
+            row["log_overhead_p95_ms"] = round(row["p95_ms"] - base["p95_ms"], 1)
+    report += rows
+
+    for row in report:
+        print(json.dumps(row))
+    for path in write_report(report, args.output):
+        print(f"Saved report to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares gemini-embedding-001 collections truncated to different output sizes.
+
+For every size in GEMINI_EMBEDDING_DIMENSIONS the CV corpus is embedded into its own
+temporary Chroma directory and the anchors from training_data.json are replayed as
+queries. Reported per size:
+    - index size on disk
+    - query latency (embedding call and vector search measured separately)
+    - recall@k against the full-size collection's top-k
+
+usage: python benchmarks/matryoshka_benchmark.py [--k 5] [--output benchmarks/results/matryoshka.json]
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+from bench_utils import project_root, RESULTS_DIR, percentile, dir_size, load_training_pairs, write_report
+from langchain_chroma import Chroma
+from config import PARSER, MODEL_NAME, GEMINI_EMBEDDING_DIMENSIONS, get_collection_name
+from functions.embedding_utils import get_embedding_function, GEMINI_FULL_DIMENSIONALITY
+from functions.ingestion_utils import create_and_persist_db
+from ingest_new import load_section_chunks, get_processed_json_path
+
+GEMINI_EMBEDDING_MODEL = "gemini-embedding-001"
+
+
+def build_collection(db_path, dims):
+    collection_name = get_collection_name(PARSER, GEMINI_EMBEDDING_MODEL, dims)
+    path = os.path.join(project_root, get_processed_json_path(PARSER, MODEL_NAME))
+    for _, chunks, chunk_ids in load_section_chunks(path):
+        create_and_persist_db(chunks, db_path, collection_name, GEMINI_EMBEDDING_MODEL, chunk_ids, output_dimensionality=dims)
+    return collection_name
+
+
+def run_queries(db_path, collection_name, dims, queries, k):
+    embeddings = get_embedding_function(GEMINI_EMBEDDING_MODEL, output_dimensionality=dims)
+    db = Chroma(persist_directory=db_path, embedding_function=embeddings, collection_name=collection_name)
+    embed_ms, search_ms, results = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        vector = embeddings.embed_query(query)
+        embed_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        docs = db.similarity_search_by_vector_with_relevance_scores(vector, k=k)
+        search_ms.append((time.perf_counter() - start) * 1000)
+        results.append([doc.id for doc, _ in docs])
+    return embed_ms, search_ms, results
+
+
+def recall_against(reference, results):
+    """Mean fraction of the reference top-k that the candidate top-k also returns."""
+    scores = []
+    for ref_ids, ids in zip(reference, results):
+        if ref_ids:
+            scores.append(len(set(ref_ids) & set(ids)) / len(ref_ids))
+    return statistics.mean(scores) if scores else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "matryoshka.json"))
+    args = parser.parse_args()
+
+    queries = [pair["anchor"] for pair in load_training_pairs()]
+    # full size first so the smaller sizes have a reference to score against
+    dimensions = sorted(GEMINI_EMBEDDING_DIMENSIONS, key=lambda d: d or GEMINI_FULL_DIMENSIONALITY, reverse=True)
+
+    report = []
+    reference = None
+    for dims in dimensions:
+        label = dims or GEMINI_FULL_DIMENSIONALITY
+        print(f"\n=== {GEMINI_EMBEDDING_MODEL} @ {label} dims ===")
+        db_path = tempfile.mkdtemp(prefix=f"matryoshka_{label}_")
+        try:
+            collection_name = build_collection(db_path, dims)
+            embed_ms, search_ms, results = run_queries(db_path, collection_name, dims, queries, args.k)
+            if reference is None:
+                reference = results
+            row = {
+                "dimensions": label,
+                "collection": collection_name,
+                "index_size_bytes": dir_size(db_path),
+                "queries": len(queries),
+                "embed_p50_ms": round(percentile(embed_ms, 50), 2),
+                "embed_p95_ms": round(percentile(embed_ms, 95), 2),
+                "search_p50_ms": round(percentile(search_ms, 50), 2),
+                "search_p95_ms": round(percentile(search_ms, 95), 2),
+                f"recall@{args.k}_vs_full": round(recall_against(reference, results), 4),
+            }
+            print(json.dumps(row, indent=4))
+            report.append(row)
+        finally:
+            shutil.rmtree(db_path, ignore_errors=True)
+
+    for path in write_report(report, args.output):
+        print(f"Saved report to {path}")
+
+
+if __name__ == "__main__":
+    main()
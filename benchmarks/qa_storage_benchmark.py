@@ -0,0 +1,154 @@
+"""
+DB size and /history/<id> read latency with plain vs compressed QA storage.
+
+Builds a QA database (copied from --source-db if it has questions, otherwise
+synthesized from the processed CV json files: candidate JSON contexts as
+generate_answer builds them, plus pipeline-style logs), then measures it as plain
+TEXT and after compress_qa_rows + VACUUM for each codec. Latency is
+get_qa_details + JSON serialization, i.e. what the /history/<id> view does.
+
+usage: python benchmarks/qa_storage_benchmark.py [--rows 2000] [--source-db db.db]
+"""
+import os
+import json
+import time
+import glob
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime
+
+from bench_utils import project_root, RESULTS_DIR, percentile, write_report
+from config import PROJECT
+import functions.database_utils as db_utils
+from functions.text_codec import resolve_codec, zstandard
+
+LOG_LINES = [
+    "Starting RAG query for: {q}",
+    "LLM Model: gemini",
+    "Used PARSER: marker",
+    "Embedding Model: bge-m3",
+    "Polished question: {q}",
+    "Identified sections: ['skills', 'experience']",
+    "SQL Query: SELECT * FROM users WHERE skills LIKE '%python%'",
+    "Need more context: True",
+    "Vector docs id: ['a@x.com_skills', 'b@y.com_experience']",
+    "Answer generated successfully.",
+]
+
+
+def load_cv_sections():
+    sections = []
+    for path in glob.glob(os.path.join(project_root, "processed", PROJECT, "json", "**", "*.json"), recursive=True):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+        if isinstance(data, dict):
+            for key, value in data.items():
+                sections.append({"section": key, "content": json.dumps(value) if not isinstance(value, str) else value})
+    return sections or [{"section": "skills", "content": "python, java, flutter " * 20}]
+
+
+def synthesize(conn, rows, seed=0):
+    rng = random.Random(seed)
+    sections = load_cv_sections()
+    sql = "INSERT INTO questions (question, answer, context) VALUES (?, ?, ?)"
+    log_sql = "INSERT INTO logs (question_id, log_entry) VALUES (?, ?)"
+    cur = conn.cursor()
+    for i in range(rows):
+        question = f"question {i}: who has experience with {rng.choice(['python', 'flutter', 'sql', 'react'])}?"
+        candidates = [{
+            "personal_information": {"name": f"candidate {j}", "email": f"c{j}@example.com"},
+            "sections": rng.sample(sections, min(3, len(sections)))
+        } for j in range(rng.randint(1, 6))]
+        context = "\n\nToday's date is 2026-01-01\n\n" + json.dumps({"candidate_list": candidates}, indent=4)
+        logs = "\n".join(line.format(q=question) for line in LOG_LINES * rng.randint(1, 4))
+        cur.execute(sql, (question, "answer " * rng.randint(20, 200), context))
+        cur.execute(log_sql, (cur.lastrowid, logs))
+    conn.commit()
+
+
+def decode_to_plain(path, table, column):
+    """Sets every encoded value back to plain TEXT so a copied production DB starts uncompressed."""
+    conn = sqlite3.connect(path)
+    rows = conn.execute(f"SELECT id, {column} FROM {table} WHERE typeof({column}) = 'blob'").fetchall()
+    conn.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ?",
+                     [(db_utils.decode_text(value), row_id) for row_id, value in rows])
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def measure(path, ids, repeats):
+    latencies = []
+    with db_utils.get_db_connection(path) as conn:
+        for _ in range(repeats):
+            for question_id in ids:
+                start = time.perf_counter()
+                json.dumps(db_utils.get_qa_details(conn, question_id))
+                latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "db_size_kb": round(os.path.getsize(path) / 1024, 1),
+        "details_p50_ms": round(percentile(latencies, 50), 3),
+        "details_p95_ms": round(percentile(latencies, 95), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="synthetic rows when no source db is used")
+    parser.add_argument("--source-db", help="existing QA database to copy")
+    parser.add_argument("--samples", type=int, default=200, help="question ids to read back")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"qa_storage_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    # silence the per-connection INFO lines of database_utils during the timing loops
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+
+    work_dir = tempfile.mkdtemp(prefix="qa_storage_")
+    try:
+        plain_path = os.path.join(work_dir, "plain.db")
+        if args.source_db:
+            shutil.copy(args.source_db, plain_path)
+            decode_to_plain(plain_path, "questions", "context")
+            decode_to_plain(plain_path, "logs", "log_entry")
+        else:
+            with db_utils.get_db_connection(plain_path) as conn:
+                db_utils.create_qa_tables(conn)
+                synthesize(conn, args.rows)
+
+        with db_utils.get_db_connection(plain_path) as conn:
+            ids = [row[0] for row in db_utils.read_records(conn, "SELECT id FROM questions")]
+        ids = random.Random(1).sample(ids, min(args.samples, len(ids)))
+
+        report = [{"codec": "none", "sampled_ids": len(ids), **measure(plain_path, ids, args.repeats)}]
+        codecs = ["zlib"] + (["zstd"] if zstandard is not None else [])
+        for codec in codecs:
+            path = os.path.join(work_dir, f"{codec}.db")
+            shutil.copy(plain_path, path)
+            with db_utils.get_db_connection(path) as conn:
+                start = time.perf_counter()
+                db_utils.compress_qa_rows(conn, codec=codec)
+                migration_s = time.perf_counter() - start
+                conn.execute("VACUUM")
+            report.append({"codec": resolve_codec(codec), "sampled_ids": len(ids), **measure(path, ids, args.repeats),
+                           "migration_s": round(migration_s, 2)})
+        if zstandard is None:
+            print("zstandard not installed, zstd skipped (pip install zstandard).")
+
+        for row in report:
+            print(json.dumps(row))
+        for path in write_report(report, args.output):
+            print(f"Saved report to {path}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
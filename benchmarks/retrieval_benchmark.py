@@ -0,0 +1,207 @@
+"""
+Retrieval quality and speed for every parser x embedding model x retrieval mode.
+
+The anchors in training_data.json are the queries. For each anchor the relevant chunk
+is the CV section whose tokens best cover its "positive" passage. Modes:
+    vector    Chroma similarity search over the section chunks
+    bm25      get_bm25_results over the same chunks (embedding model independent)
+    hybrid    merge_and_deduplicate(bm25, vector)
+    reranked  rerank_documents over the hybrid candidates
+
+Reported per combination: recall@k, MRR, p50/p95 latency and peak Python memory.
+Results are written as JSON and CSV to benchmarks/results/.
+
+--offline swaps every embedding model for a DeterministicHashEmbeddings seeded with
+the model name, and the cross-encoder for a cosine scorer on the same vectors, so the
+whole suite runs without Ollama, Gemini or a model download and gives identical
+numbers on every run.
+
+usage: python benchmarks/retrieval_benchmark.py --offline [--k 5] [--modes vector bm25]
+"""
+import os
+import re
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import statistics
+from datetime import datetime
+
+import numpy as np
+from bench_utils import project_root, RESULTS_DIR, percentile, load_training_pairs, write_report
+from langchain_chroma import Chroma
+from config import PARSER_LIST, EMBEDDING_MODELS, MODEL_NAME
+from functions.embedding_utils import get_embedding_function, DeterministicHashEmbeddings
+from functions.query_utils import get_bm25_results, merge_and_deduplicate, rerank_documents
+from ingest_new import load_section_chunks, get_processed_json_path
+
+MODES = ["vector", "bm25", "hybrid", "reranked"]
+# a section is relevant if it covers at least this share of the best section's token overlap
+GOLD_RELATIVE_OVERLAP = 0.8
+GOLD_MIN_OVERLAP = 0.2
+
+
+class HashCrossEncoder:
+    """Offline stand-in for CrossEncoder.predict: cosine of hash embeddings."""
+
+    def __init__(self):
+        self.embeddings = DeterministicHashEmbeddings(seed="reranker")
+
+    def predict(self, pairs):
+        queries = np.asarray(self.embeddings.embed_documents([q for q, _ in pairs]))
+        docs = np.asarray(self.embeddings.embed_documents([d for _, d in pairs]))
+        return (queries * docs).sum(axis=1)
+
+
+def tokens(text):
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def load_corpus(parser):
+    path = os.path.join(project_root, get_processed_json_path(parser, MODEL_NAME))
+    if not os.path.isdir(path):
+        return None
+    chunks, ids = [], []
+    for _, cv_chunks, cv_ids in load_section_chunks(path):
+        for chunk, chunk_id in zip(cv_chunks, cv_ids):
+            if chunk.page_content and chunk.page_content.strip():
+                chunk.id = chunk_id
+                chunks.append(chunk)
+                ids.append(chunk_id)
+    return chunks, ids
+
+
+def build_queries(pairs, chunks):
+    """(anchor, gold ids) for every training pair whose positive can be located in the corpus."""
+    chunk_tokens = [tokens(chunk.page_content) for chunk in chunks]
+    queries = []
+    for pair in pairs:
+        positive = tokens(pair["positive"])
+        if not positive:
+            continue
+        overlaps = [len(positive & ct) / len(positive) for ct in chunk_tokens]
+        best = max(overlaps)
+        if best < GOLD_MIN_OVERLAP:
+            continue
+        gold = {chunks[i].id for i, o in enumerate(overlaps) if o >= best * GOLD_RELATIVE_OVERLAP}
+        queries.append((pair["anchor"], gold))
+    return queries
+
+
+def score(ranked_ids, gold, k):
+    top = ranked_ids[:k]
+    recall = len(gold & set(top)) / len(gold)
+    reciprocal_rank = 0.0
+    for rank, doc_id in enumerate(ranked_ids, start=1):
+        if doc_id in gold:
+            reciprocal_rank = 1.0 / rank
+            break
+    return recall, reciprocal_rank
+
+
+def make_retriever(mode, chunks, db, k, reranker):
+    def vector(query):
+        return db.similarity_search(query, k=k)
+
+    def bm25(query):
+        return get_bm25_results(chunks, query)[:k]
+
+    def hybrid(query):
+        return merge_and_deduplicate(bm25(query), vector(query))
+
+    def reranked(query):
+        return rerank_documents(query, hybrid(query), reranker=reranker, top_n=k)
+
+    return {"vector": vector, "bm25": bm25, "hybrid": hybrid, "reranked": reranked}[mode]
+
+
+def run_mode(retrieve, queries, k):
+    latencies, recalls, reciprocal_ranks = [], [], []
+    for query, gold in queries:
+        start = time.perf_counter()
+        docs = retrieve(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recall, rr = score([doc.id for doc in docs], gold, k)
+        recalls.append(recall)
+        reciprocal_ranks.append(rr)
+
+    # second pass under tracemalloc so its overhead doesn't skew the latencies
+    tracemalloc.start()
+    for query, _ in queries:
+        retrieve(query)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        f"recall@{k}": round(statistics.mean(recalls), 4),
+        "mrr": round(statistics.mean(reciprocal_ranks), 4),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--offline", action="store_true", help="deterministic stand-in embeddings and reranker")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--parsers", nargs="+", default=PARSER_LIST)
+    parser.add_argument("--embedding-models", nargs="+", default=EMBEDDING_MODELS)
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"retrieval_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    pairs = load_training_pairs()
+    reranker = HashCrossEncoder() if args.offline else None
+    report = []
+
+    for parser_name in args.parsers:
+        corpus = load_corpus(parser_name)
+        if corpus is None:
+            print(f"Skipping parser '{parser_name}': no processed json for it.")
+            continue
+        chunks, _ = corpus
+        queries = build_queries(pairs, chunks)
+        print(f"\n=== parser: {parser_name} | {len(chunks)} chunks | {len(queries)}/{len(pairs)} queries with a relevant chunk ===")
+
+        for embedding_model in args.embedding_models:
+            vector_modes = [m for m in args.modes if m != "bm25"]
+            # bm25 does not depend on the embedding model, run it once per parser
+            modes = vector_modes + (["bm25"] if "bm25" in args.modes and embedding_model == args.embedding_models[0] else [])
+            if not modes:
+                continue
+
+            db_path = tempfile.mkdtemp(prefix="retrieval_bench_")
+            try:
+                db = None
+                if vector_modes:
+                    embeddings = DeterministicHashEmbeddings(seed=embedding_model) if args.offline else get_embedding_function(embedding_model)
+                    db = Chroma.from_documents(
+                        documents=chunks,
+                        embedding=embeddings,
+                        persist_directory=db_path,
+                        collection_name="retrieval_benchmark",
+                        ids=[chunk.id for chunk in chunks]
+                    )
+                for mode in modes:
+                    row = {
+                        "parser": parser_name,
+                        "embedding_model": embedding_model if mode != "bm25" else "-",
+                        "mode": mode,
+                        "offline": args.offline,
+                        "queries": len(queries),
+                    }
+                    row.update(run_mode(make_retriever(mode, chunks, db, args.k, reranker), queries, args.k))
+                    print(row)
+                    report.append(row)
+            except Exception as e:
+                print(f"Skipping {parser_name}/{embedding_model}: {e}")
+            finally:
+                shutil.rmtree(db_path, ignore_errors=True)
+
+    for path in write_report(report, args.output):
+        print(f"Saved report to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Startup and throughput of the dev server vs. the preloaded multi-worker server.
+
+For each configuration (--modes dev and prod, prod once per --workers count) the
+server is started on --port and measured for:
+  time_to_ready_s  from spawning it until GET /ready answers 200 (startup warm-up
+                   finished, functions/warmup.py; with several workers, the first
+                   worker to answer)
+  first_request_ms latency of the first request after that (compare RAG_WARMUP=0 / 1)
+  pss_mb           proportional set size of the server's process tree once ready
+                   (memory the workers share copy-on-write is split between them,
+                   so it shows what the preloading saves; Linux only)
+  throughput_rps   and latency percentiles of a load_test.py phase against --endpoints
+
+prod runs `gunicorn -c server/gunicorn.conf.py`. Pair it with the stand-in LLM server
+for a hermetic run:
+
+    python common/stand_in_server.py --latency-ms 200 &
+    RAG_STAND_IN_LLM=1 python benchmarks/server_benchmark.py --workers 1 2 4 --qps 20 --duration 30
+
+usage: python benchmarks/server_benchmark.py [--modes dev prod] [--workers 1 2 4] [--endpoints /chat]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.request
+from datetime import datetime
+
+from bench_utils import project_root, RESULTS_DIR, write_report
+from load_test import load_questions, run_phase, send_request
+
+
+def server_command(mode):
+    if mode == "dev":
+        return [sys.executable, os.path.join(project_root, "server", "app.py")]
+    return ["gunicorn", "-c", os.path.join(project_root, "server", "gunicorn.conf.py")]
+
+
+def wait_ready(process, base_url, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before it was ready")
+        try:
+            with urllib.request.urlopen(base_url + "/ready", timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except Exception:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"Server not ready after {timeout}s")
+
+
+def process_tree(pid):
+    pids = [pid]
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                for child in f.read().split():
+                    pids += process_tree(int(child))
+        except OSError:
+            pass
+    return pids
+
+
+def pss_mb(pid):
+    """Summed PSS of pid and its descendants in MB, None where /proc has no smaps_rollup."""
+    total_kb = 0
+    try:
+        for member in process_tree(pid):
+            with open(f"/proc/{member}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total_kb += int(line.split()[1])
+    except OSError:
+        return None
+    return round(total_kb / 1024, 1)
+
+
+def run_config(mode, workers, args, questions):
+    env = dict(os.environ, RAG_PORT=str(args.port), RAG_WORKERS=str(workers))
+    log_path = os.path.join(RESULTS_DIR, f"server_benchmark_{mode}_{workers}.log")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(server_command(mode), cwd=project_root, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            ready_s = wait_ready(process, args.base_url, args.ready_timeout)
+            memory = pss_mb(process.pid)
+            start = time.perf_counter()
+            send_request(args.base_url, args.endpoints[0], questions[0], {}, args.timeout)
+            first_ms = (time.perf_counter() - start) * 1000
+            rows = run_phase(args, questions, args.listeners)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    for row in rows:
+        row.update({"mode": mode, "workers": workers, "time_to_ready_s": round(ready_s, 2),
+                    "first_request_ms": round(first_ms, 1), "pss_mb": memory})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["dev", "prod"], choices=["dev", "prod"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4], help="worker counts for prod")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--endpoints", nargs="+", default=["/chat"], help="e.g. /chat /history")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--questions-file", help="JSONL file of questions")
+    source.add_argument("--questions-db", default=os.path.join(project_root, "db.db"), help="SQLite db with a questions table")
+    parser.add_argument("--limit", type=int, help="use only the first N questions")
+    parser.add_argument("--qps", type=float, default=20.0, help="offered load; set it above what the server sustains to measure max RPS")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--listeners", type=int, default=0, help="Socket.IO log listeners to attach")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"server_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+    # run_phase options
+    args.base_url = f"http://127.0.0.1:{args.port}"
+    args.requests = None
+    args.model = args.embedding_model = args.parser = args.db_name = None
+
+    questions = load_questions(args.questions_file, args.questions_db, args.limit)
+    configs = [(mode, workers) for mode in args.modes for workers in ([1] if mode == "dev" else args.workers)]
+    report = []
+    for mode, workers in configs:
+        rows = run_config(mode, workers, args, questions)
+        for row in rows:
+            print(json.dumps(row))
+        report += rows
+
+    for row in report:
+        print(f"{row['mode']:<5} workers {row['workers']:<3} ready {row['time_to_ready_s']:>6.2f}s   first {row['first_request_ms']} ms   "
+              f"pss {row['pss_mb']} MB   {row['endpoint']} {row['throughput_rps']} rps   p99 {row['p99_ms']} ms")
+    for path in write_report(report, args.output):
+        print(f"Saved report to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Per-stage latency report from the spans saved by server/app.py.
+
+Every /chat and /chat/cv_agent request stores one span per pipeline stage (polish,
+section, sql_gen, sql_exec, need_more_context, embed, vector_search, answer; ner,
+plan, tool:<name>, synthesis for the agent) in the `spans` table. This groups them
+by stage over the most recent questions and reports count, errors, p50/p90/p95/p99,
+mean latency and mean token counts.
+
+usage: python benchmarks/span_report.py [--db db.db] [--last 500]
+"""
+import os
+import argparse
+from datetime import datetime
+
+from bench_utils import project_root, RESULTS_DIR, write_report
+import functions.database_utils as db_utils
+from functions.tracing import summarize_spans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.path.join(project_root, "db.db"))
+    parser.add_argument("--last", type=int, default=500, help="number of most recent questions to include")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"spans_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    with db_utils.get_db_connection(args.db) as conn:
+        spans = db_utils.get_spans(conn, last_questions=args.last)
+    report = summarize_spans(spans)
+    if not report:
+        print("No spans recorded yet.")
+        return
+
+    print(f"{'stage':<28}{'count':>7}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'in tok':>9}{'out tok':>9}  models")
+    for row in report:
+        print(f"{row['stage']:<28}{row['count']:>7}{row['errors']:>5}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+              f"{row['p99_ms']:>9}{row['mean_input_tokens']:>9}{row['mean_output_tokens']:>9}  {row['models']}")
+    for path in write_report(report, args.output):
+        print(f"Saved report to {path}")
+
+
+if __name__ == "__main__":
+    main()
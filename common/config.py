@@ -1,4 +1,5 @@
 import os
+import json
 
 PROJECT="CV_APP"
 
@@ -28,7 +29,174 @@ DB_NAME="db.db"
 SQL_MODEL="gemini"
 
 
-collections=["marker_bge-m3_"+PROJECT,"marker_gemini-embedding-001_"+PROJECT]
-COLLECTION_NAME=PARSER+"_"+EMBEDDING_MODEL_NAME+"_"+PROJECT
+# Stand-in Ollama server (common/stand_in_server.py) for hermetic load tests.
+# When enabled every Ollama chat/embedding call and every Gemini call is routed to it.
+USE_STAND_IN_LLM=os.getenv("RAG_STAND_IN_LLM","0")=="1"
+STAND_IN_HOST=os.getenv("RAG_STAND_IN_HOST","127.0.0.1")
+STAND_IN_PORT=int(os.getenv("RAG_STAND_IN_PORT","11435"))
+STAND_IN_BASE_URL=f"http://{STAND_IN_HOST}:{STAND_IN_PORT}"
+# Embedding size the stand-in returns per model: the real model's, so it can query collections
+# ingested with Ollama / Gemini. RAG_STAND_IN_EMBEDDING_DIMENSIONS (json) adds or overrides models
+STAND_IN_EMBEDDING_DIMENSIONS={"llama3.2:3b":3072,"nomic-embed-text":768,"bge-m3":1024,"gemini-embedding-001":3072,
+                               **json.loads(os.getenv("RAG_STAND_IN_EMBEDDING_DIMENSIONS","{}"))}
+
+# Matryoshka output sizes for gemini-embedding-001 (None keeps the full 3072 dims)
+GEMINI_EMBEDDING_DIMENSIONS=[256,768,None]
+GEMINI_OUTPUT_DIMENSIONALITY=None
+
+
+def get_collection_name(parser=PARSER, embedding_model_name=EMBEDDING_MODEL_NAME, output_dimensionality=None):
+    """Each parser x embedding model (x gemini dimension) pair lives in its own collection."""
+    name=parser+"_"+embedding_model_name+"_"+PROJECT
+    if output_dimensionality and "gemini" in embedding_model_name:
+        name+="_"+str(output_dimensionality)
+    return name
+
+
+def get_summary_collection_name(collection_name):
+    """One aggregate vector per candidate, stored next to its section collection."""
+    return collection_name+"_summary"
+
+
+# vector: plain top-k over all section chunks
+# two_stage: top candidates by summary vector, then section scoring restricted to them
+# mmr: maximal marginal relevance over MMR_FETCH_K candidates, k picked from score gaps
+# fanout: query every FANOUT_TARGETS collection in parallel and merge normalized scores
+RETRIEVAL_MODES=["vector","two_stage","mmr","fanout"]
+RETRIEVAL_MODE=RETRIEVAL_MODES[0]
+TWO_STAGE_CANDIDATES=5
+TWO_STAGE_SECTIONS_PER_CANDIDATE=3
+VECTOR_SEARCH_K=10
+MMR_FETCH_K=30
+MMR_LAMBDA=0.7  # 1.0 = pure relevance, 0.0 = pure diversity
+# adaptive k: cut the ranked list at the biggest score drop between ADAPTIVE_K_MIN and VECTOR_SEARCH_K
+ADAPTIVE_K_MIN=3
+ADAPTIVE_K_GAP_RATIO=0.25  # drop must be at least this fraction of the score spread
+
+
+# (parser, embedding model) pairs served side by side by the fanout retrieval mode
+FANOUT_TARGETS=[("marker","bge-m3"),("marker","gemini-embedding-001")]
+FANOUT_MAX_WORKERS=4
+
+# per-request log capture saved with each QA row; older lines are dropped past this
+LOG_CAPTURE_MAX_LINES=2000
+LOG_CAPTURE_MAX_CHARS=200_000
+
+# Socket.IO log streaming: records go only to the requesting session, batched every
+# LOG_EMIT_INTERVAL_MS. Past half of LOG_EMIT_MAX_QUEUE only 1 in LOG_EMIT_SAMPLE_EVERY
+# INFO records is kept; past LOG_EMIT_MAX_QUEUE everything new is dropped.
+LOG_EMIT_INTERVAL_MS=200
+LOG_EMIT_MAX_BATCH=200
+LOG_EMIT_MAX_QUEUE=5000
+LOG_EMIT_SAMPLE_EVERY=10
+
+# background QA-log writer: one transaction per QA_WRITER_BATCH_SIZE rows or per
+# QA_WRITER_FLUSH_INTERVAL_MS; rows past QA_WRITER_MAX_QUEUE are dropped, never waited on
+QA_WRITER_BATCH_SIZE=50
+QA_WRITER_FLUSH_INTERVAL_MS=500
+QA_WRITER_MAX_QUEUE=1000
+
+# questions.context / logs.log_entry storage: a context longer than its cap loses its tail, a
+# log its head (the latest lines are kept, like the log capture buffer); then anything over
+# QA_COMPRESSION_MIN_CHARS is compressed ("zstd" needs the zstandard package and falls back
+# to "zlib"; "none" stores plain TEXT)
+QA_COMPRESSION="zstd"
+QA_COMPRESSION_MIN_CHARS=512
+QA_CONTEXT_MAX_CHARS=500_000
+QA_LOG_MAX_CHARS=200_000
+
+# LLM admission control (functions/llm_scheduler.py): at most LLM_MAX_IN_FLIGHT calls run
+# at once per model (overrides in LLM_MAX_IN_FLIGHT_PER_MODEL), up to LLM_MAX_QUEUE more
+# wait at most LLM_QUEUE_TIMEOUT_S each; past that the call fails and /chat answers 503
+LLM_MAX_IN_FLIGHT=int(os.getenv("RAG_LLM_MAX_IN_FLIGHT","2"))
+LLM_MAX_IN_FLIGHT_PER_MODEL=json.loads(os.getenv("RAG_LLM_MAX_IN_FLIGHT_PER_MODEL",'{"gemini-2.0-flash":8}'))
+LLM_MAX_QUEUE=int(os.getenv("RAG_LLM_MAX_QUEUE","32"))
+LLM_QUEUE_TIMEOUT_S=30
+# waiting calls are served by class, highest first (functions/llm_scheduler.priority), and
+# a full queue sheds its lowest-class waiter to admit a higher-class call; batch calls
+# hold at most LLM_BATCH_MAX_IN_FLIGHT of a model's slots. A batch script that defers to
+# the server polls LLM_SCHEDULER_URL/stats/llm every LLM_BATCH_POLL_S while chat is busy
+# on its model, for at most LLM_BATCH_MAX_DEFER_S per call
+LLM_PRIORITY_CLASSES=["interactive","agent","batch"]
+LLM_BATCH_MAX_IN_FLIGHT=1
+LLM_SCHEDULER_URL=os.getenv("RAG_SCHEDULER_URL","http://127.0.0.1:5000")
+LLM_BATCH_POLL_S=1.0
+LLM_BATCH_MAX_DEFER_S=300
+
+# per-request latency budget (functions/deadline.py): /chat gets CHAT_BUDGET_S (or "budget_s"
+# in the request). Optional LLM stages (section, SQL, need-more-context, two-stage / mmr /
+# fanout retrieval) only start while more than DEADLINE_ANSWER_RESERVE_S is left for the answer;
+# with less than DEADLINE_MIN_ANSWER_S left the answer is built without the LLM
+CHAT_BUDGET_S=90
+DEADLINE_ANSWER_RESERVE_S=20
+DEADLINE_MIN_ANSWER_S=3
+
+# circuit breakers per backend (gemini / ollama, functions/circuit_breaker.py): a backend opens
+# when at least BREAKER_MIN_CALLS calls in the last BREAKER_WINDOW_S seconds failed at a rate of
+# BREAKER_ERROR_RATE or more; after BREAKER_OPEN_S, BREAKER_HALF_OPEN_PROBES calls probe it and
+# the first success closes it. While open, LLM calls move to LLM_FALLBACK_MODELS[model] (default:
+# the MODEL_COLLECTIONS models on the other backend) or fail fast
+BREAKER_WINDOW_S=60
+BREAKER_MIN_CALLS=5
+BREAKER_ERROR_RATE=0.5
+BREAKER_OPEN_S=30
+BREAKER_HALF_OPEN_PROBES=1
+LLM_FALLBACK_MODELS={}
+
+# hedged JSON classification calls (polish / section / need_more_context, functions/hedging.py):
+# when the primary model has not answered by its HEDGE_PERCENTILE latency over the last
+# HEDGE_WINDOW calls (HEDGE_INITIAL_DELAY_MS until HEDGE_MIN_SAMPLES are seen, never less
+# than HEDGE_MIN_DELAY_MS) the call is repeated on HEDGE_SECONDARY_MODEL (None: the first
+# MODEL_COLLECTIONS model on another backend, no hedge if there is none) and the first
+# valid JSON wins
+HEDGE_ENABLED=os.getenv("RAG_HEDGE","0")=="1"
+HEDGE_SECONDARY_MODEL=None
+HEDGE_PERCENTILE=95
+HEDGE_WINDOW=200
+HEDGE_MIN_SAMPLES=20
+HEDGE_INITIAL_DELAY_MS=3000
+HEDGE_MIN_DELAY_MS=200
+HEDGE_MAX_WORKERS=32
+
+# /history page size (?limit= is capped at HISTORY_MAX_PAGE_SIZE)
+HISTORY_PAGE_SIZE=50
+HISTORY_MAX_PAGE_SIZE=500
+
+# production server (server/gunicorn.conf.py): SERVER_WORKERS processes forked from one
+# parent that imported the app (and, if SERVER_PRELOAD_RERANKER, loaded the reranker)
+# once, so they share those pages copy-on-write. With more than one worker, Socket.IO
+# events go through SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0) so logs from
+# the worker answering /chat reach a client connected to another worker. Admission
+# limits (LLM_MAX_IN_FLIGHT...) and the /stats endpoints are per worker.
+SERVER_HOST=os.getenv("RAG_HOST","127.0.0.1")
+SERVER_PORT=int(os.getenv("RAG_PORT","5000"))
+SERVER_WORKERS=int(os.getenv("RAG_WORKERS","4"))
+SERVER_THREADS=int(os.getenv("RAG_THREADS","32"))
+SERVER_PRELOAD_RERANKER=os.getenv("RAG_PRELOAD_RERANKER","0")=="1"
+SOCKETIO_MESSAGE_QUEUE=os.getenv("RAG_SOCKETIO_MESSAGE_QUEUE")
+RERANKER_MODEL="cross-encoder/ms-marco-MiniLM-L6-v2"
+
+# how long Ollama keeps a model loaded after a call (seconds, None: Ollama's default of 5 min)
+OLLAMA_KEEP_ALIVE_S=1800
+
+# startup warm-up (functions/warmup.py), run by each server process before GET /ready
+# answers 200: one short call per WARMUP_CHAT_MODELS / WARMUP_EMBEDDING_MODELS model so
+# Ollama loads it (Gemini has nothing to load, so it is left out by default), one query
+# per WARMUP_COLLECTIONS (parser, embedding model) collection so Chroma loads its index,
+# and the prompt templates parsed. Each call gets WARMUP_TIMEOUT_S
+WARMUP_ENABLED=os.getenv("RAG_WARMUP","1")=="1"
+WARMUP_CHAT_MODELS=[model for model in dict.fromkeys([MODEL_NAME,SQL_MODEL]) if not model.startswith("gemini")]
+WARMUP_EMBEDDING_MODELS=[EMBEDDING_MODEL_NAME]
+WARMUP_COLLECTIONS=[(PARSER,EMBEDDING_MODEL_NAME)]
+WARMUP_TIMEOUT_S=120
+
+# /chat/batch (functions/batch.py): at most BATCH_MAX_QUESTIONS per request, BATCH_MAX_PARALLEL
+# answered at once. Its LLM calls run in the "batch" priority class, so they also hold at
+# most LLM_BATCH_MAX_IN_FLIGHT slots per model and never hold up /chat
+BATCH_MAX_QUESTIONS=200
+BATCH_MAX_PARALLEL=4
+
+collections=[get_collection_name(parser,embedding_model) for parser,embedding_model in FANOUT_TARGETS]
+COLLECTION_NAME=get_collection_name(PARSER,EMBEDDING_MODEL_NAME,GEMINI_OUTPUT_DIMENSIONALITY)
 
 print("COLLECTION_NAME: ",COLLECTION_NAME)
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+Work shared by the questions of one /chat/batch request.
+
+query.prepare_batch creates one BatchCache per batch and server/app.py passes it to query_rag
+for every question. query_rag runs the polish, section classification and schema
+steps through `shared_step`, so the questions of a batch that need the same result
+(same question, same polished question, same database) compute it once: the first
+question to ask runs the step, questions asking for the same key meanwhile wait for
+its result. Query embeddings are computed up front for the whole batch in one call
+and `put` in the cache. Hits and misses are counted per step in metrics
+(rag_cache_requests_total{cache="batch_<step>"}).
+
+`run_parallel` runs the questions with at most BATCH_MAX_PARALLEL at once and hands
+each result to a callback as soon as it is done.
+"""
+import os
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import BATCH_MAX_PARALLEL
+from functions import metrics
+from functions import tracing
+
+
+def normalize_question(question):
+    return " ".join(question.lower().split())
+
+
+class BatchCache:
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def do(self, step, key, fn):
+        """
+        fn() once per (step, key) for the batch. Callers waiting on a failed fn() get its
+        exception; the failure is not kept, so a later caller tries again.
+        """
+        with self._lock:
+            future = self._results.get((step, key))
+            owner = future is None
+            if owner:
+                future = self._results[(step, key)] = Future()
+        metrics.record_cache(f"batch_{step}", not owner)
+        if owner:
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                with self._lock:
+                    self._results.pop((step, key), None)
+                future.set_exception(e)
+        return future.result()
+
+    def put(self, step, key, value):
+        future = Future()
+        future.set_result(value)
+        with self._lock:
+            self._results[(step, key)] = future
+
+    def get(self, step, key):
+        """A value stored with put / computed by do, None if there is none (yet)."""
+        with self._lock:
+            future = self._results.get((step, key))
+        return future.result() if future is not None and future.done() and future.exception() is None else None
+
+
+def shared_step(shared, step, key, fn):
+    """fn() through the batch cache, or just fn() outside a batch (shared=None)."""
+    if shared is None:
+        return fn()
+    return shared.do(step, key, fn)
+
+
+def run_parallel(items, fn, on_result=None, max_parallel=None):
+    """
+    fn(index, item) for every item, at most max_parallel (BATCH_MAX_PARALLEL) at once.
+    :param on_result: called with (index, result, error) in completion order
+    :return: [(result, error)] in input order
+    """
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max_parallel or BATCH_MAX_PARALLEL, thread_name_prefix="batch") as executor:
+        futures = {executor.submit(tracing.bind(fn), index, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            index = futures[future]
+            error = future.exception()
+            result = None if error else future.result()
+            results[index] = (result, error)
+            if on_result:
+                on_result(index, result, error)
+    return results
@@ -0,0 +1,221 @@
+"""
+Circuit breakers for the LLM and embedding backends (gemini / ollama).
+
+Every Ollama chat call (functions/llm_utils), Gemini call (functions/gemini_utils)
+and embedding call (functions/embedding_utils) runs inside `guard(backend)`. A
+backend's breaker opens when, over the last BREAKER_WINDOW_S seconds, at least
+BREAKER_MIN_CALLS calls were made and BREAKER_ERROR_RATE of them failed. While
+open, calls fail at once with CircuitOpen instead of each waiting for its own
+timeout. After BREAKER_OPEN_S the breaker is half-open: BREAKER_HALF_OPEN_PROBES
+calls go through as probes, the first success closes it, a failure re-opens it.
+Overload rejections (LLMOverloaded) and calls that fail once their request's time
+budget is spent (functions/deadline.py, raised as DeadlineExceeded) are not backend
+failures and are not counted.
+
+The pipeline picks its model through `pick_model`, which moves a call to a
+fallback model (LLM_FALLBACK_MODELS, or MODEL_COLLECTIONS models on another
+backend) while the requested model's backend is open.
+
+Import as `functions.circuit_breaker` (see functions/tracing.py for why).
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (MODEL_COLLECTIONS, LLM_FALLBACK_MODELS, BREAKER_WINDOW_S, BREAKER_MIN_CALLS,
+                    BREAKER_ERROR_RATE, BREAKER_OPEN_S, BREAKER_HALF_OPEN_PROBES)
+from functions import metrics
+from functions import tracing
+from functions.llm_scheduler import LLMOverloaded
+from functions.deadline import DeadlineExceeded, budget_spent
+
+logger = logging.getLogger('rag_logger')
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(LLMOverloaded):
+    """Raised instead of calling a backend whose breaker is open; the server answers 503 like an overload."""
+
+    def __init__(self, backend, model=None):
+        super().__init__(model or backend, "circuit_open", f"{backend} backend is unavailable (circuit open), failing fast")
+        self.backend = backend
+
+
+def backend_of(model_name):
+    return "gemini" if model_name and model_name.startswith("gemini") else "ollama"
+
+
+class _Call:
+    """Handle yielded by guard(); code that swallows its own exceptions marks the call failed through it."""
+
+    def __init__(self):
+        self.error = None
+
+    def failed(self, error):
+        self.error = error
+
+
+class CircuitBreaker:
+    def __init__(self, name, window_s=None, min_calls=None, error_rate=None, open_s=None, half_open_probes=None):
+        self.name = name
+        self.window_s = window_s or BREAKER_WINDOW_S
+        self.min_calls = min_calls or BREAKER_MIN_CALLS
+        self.error_rate = error_rate or BREAKER_ERROR_RATE
+        self.open_s = open_s or BREAKER_OPEN_S
+        self.half_open_probes = half_open_probes or BREAKER_HALF_OPEN_PROBES
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        # (time, ok) of recent calls while closed, and how many of them failed
+        self.events = deque()
+        self.errors = 0
+        self._lock = threading.Lock()
+        metrics.BREAKER_STATE.set(STATE_VALUES[CLOSED], backend=name)
+
+    def _transition(self, state):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.time()
+        self.events.clear()
+        self.errors = 0
+        metrics.BREAKER_STATE.set(STATE_VALUES[state], backend=self.name)
+        metrics.BREAKER_TRANSITIONS.inc(backend=self.name, state=state)
+
+    def _refresh(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.open_s:
+            self._transition(HALF_OPEN)
+            self.probes = 0
+
+    def available(self):
+        """True if a call would currently be let through (does not reserve a probe)."""
+        with self._lock:
+            self._refresh(time.time())
+            return self.state == CLOSED or (self.state == HALF_OPEN and self.probes < self.half_open_probes)
+
+    def before_call(self):
+        """:return: True if the call is a half-open probe; raises CircuitOpen if it may not run"""
+        with self._lock:
+            self._refresh(time.time())
+            if self.state == CLOSED:
+                return False
+            if self.state == HALF_OPEN and self.probes < self.half_open_probes:
+                self.probes += 1
+                return True
+        metrics.BREAKER_REJECTED.inc(backend=self.name)
+        raise CircuitOpen(self.name)
+
+    def after_call(self, probe, ok):
+        now = time.time()
+        with self._lock:
+            if probe:
+                self.probes -= 1
+                if self.state == HALF_OPEN:
+                    self._transition(CLOSED if ok else OPEN)
+                return
+            if self.state != CLOSED:
+                return
+            self.events.append((now, ok))
+            self.errors += not ok
+            while self.events and now - self.events[0][0] > self.window_s:
+                self.errors -= not self.events.popleft()[1]
+            if len(self.events) >= self.min_calls and self.errors / len(self.events) >= self.error_rate:
+                self._transition(OPEN)
+
+    def release_probe(self, probe):
+        if probe:
+            with self._lock:
+                self.probes -= 1
+
+    @contextmanager
+    def guard(self):
+        """
+        Runs the enclosed backend call; an exception, or call.failed(e) for code that
+        handles its own errors, counts as a failure. Overload rejections and failures
+        past the request's budget count as neither.
+        """
+        probe = self.before_call()
+        call = _Call()
+        try:
+            yield call
+        except (LLMOverloaded, DeadlineExceeded):
+            self.release_probe(probe)
+            raise
+        except Exception as e:
+            if budget_spent():
+                # the call's timeout was cut to fit the request's budget (deadline.timeout_of)
+                self.release_probe(probe)
+                raise DeadlineExceeded(f"{self.name} call ran out of the request's time budget: {e}") from e
+            self.after_call(probe, ok=False)
+            raise
+        except BaseException:
+            # interrupted: no outcome, but the probe must be freed
+            self.release_probe(probe)
+            raise
+        if call.error is not None and budget_spent():
+            self.release_probe(probe)
+        else:
+            self.after_call(probe, ok=call.error is None)
+
+    def stats(self):
+        with self._lock:
+            self._refresh(time.time())
+            return {
+                "state": self.state,
+                "recent_calls": len(self.events),
+                "recent_errors": self.errors,
+                "open_for_s": round(max(0.0, self.open_s - (time.time() - self.opened_at)), 1) if self.state == OPEN else 0.0,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(backend):
+    with _breakers_lock:
+        breaker = _breakers.get(backend)
+        if breaker is None:
+            breaker = _breakers[backend] = CircuitBreaker(backend)
+        return breaker
+
+
+def guard(backend):
+    return get_breaker(backend).guard()
+
+
+def fallback_models(model_name):
+    if model_name in LLM_FALLBACK_MODELS:
+        return list(LLM_FALLBACK_MODELS[model_name])
+    return [m for m in MODEL_COLLECTIONS if backend_of(m) != backend_of(model_name)]
+
+
+def pick_model(model_name):
+    """
+    model_name if its backend is available, else the first available fallback.
+    :raises CircuitOpen: when no candidate's backend is available
+    """
+    if get_breaker(backend_of(model_name)).available():
+        return model_name
+    for candidate in fallback_models(model_name):
+        if get_breaker(backend_of(candidate)).available():
+            logger.warning(f"{backend_of(model_name)} circuit open, using {candidate} instead of {model_name}")
+            tracing.set_attribute("fallback_from", model_name)
+            metrics.BREAKER_FALLBACKS.inc(model=model_name, fallback=candidate)
+            return candidate
+    metrics.BREAKER_REJECTED.inc(backend=backend_of(model_name))
+    raise CircuitOpen(backend_of(model_name), model_name)
+
+
+def stats():
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.stats() for name, breaker in breakers.items()}
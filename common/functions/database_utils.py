@@ -1,12 +1,21 @@
+import os
+import sys
 import sqlite3
 from sqlite3 import Error
 import logging
 import json
+import base64
 from contextlib import contextmanager
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import QA_CONTEXT_MAX_CHARS, QA_LOG_MAX_CHARS
+from functions.text_codec import encode_text, decode_text
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# QA history and telemetry tables (create_qa_tables); not resume data, so not in the text-to-SQL schema
+QA_TABLES = ("questions", "logs", "spans")
+
 def create_connection(db_file):
     """ 
     Create a database connection to the SQLite database specified by db_file.
@@ -29,10 +38,12 @@ def get_schema(conn):
     try:
         cursor = conn.cursor()
 
-        cursor.execute("""
+        # the QA tables, the FTS5 index and its shadow tables are not for the text-to-SQL prompt
+        cursor.execute(f"""
             SELECT name FROM sqlite_master
-            WHERE type='table' AND name NOT LIKE 'sqlite_%';
-        """)
+            WHERE type='table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'questions_fts%'
+            AND name NOT IN ({",".join("?" * len(QA_TABLES))});
+        """, QA_TABLES)
 
         schema = {}
         for (table,) in cursor.fetchall():
@@ -433,8 +444,70 @@ def create_qa_tables(conn):
     );
     """
     
+    # one row per timed pipeline stage, see functions/tracing.py
+    spans_sql = """
+    CREATE TABLE IF NOT EXISTS spans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        question_id INTEGER,
+        span_id INTEGER,
+        parent_id INTEGER,
+        name TEXT NOT NULL,
+        start_ms REAL,
+        duration_ms REAL,
+        status TEXT,
+        model TEXT,
+        input_tokens INTEGER,
+        output_tokens INTEGER,
+        llm_calls INTEGER,
+        attributes TEXT,
+        FOREIGN KEY (question_id) REFERENCES questions (id)
+    );
+    """
+    
     create_table(conn, questions_sql)
     create_table(conn, logs_sql)
+    create_table(conn, spans_sql)
+    create_table(conn, "CREATE INDEX IF NOT EXISTS idx_spans_question_id ON spans (question_id);")
+    # /history pages by (timestamp, id) and /history/<id> looks logs up by question
+    create_table(conn, "CREATE INDEX IF NOT EXISTS idx_questions_timestamp ON questions (timestamp, id);")
+    create_table(conn, "CREATE INDEX IF NOT EXISTS idx_logs_question_id ON logs (question_id);")
+    create_question_search(conn)
+
+def has_question_search(conn):
+    rows = read_records(conn, "SELECT name FROM sqlite_master WHERE type='table' AND name='questions_fts'")
+    return bool(rows)
+
+def create_question_search(conn):
+    """
+    FTS5 index over questions.question, kept in sync by triggers.
+    Skipped (search falls back to LIKE) when SQLite is built without FTS5.
+    """
+    if has_question_search(conn):
+        return
+    statements = [
+        "CREATE VIRTUAL TABLE questions_fts USING fts5(question, content='questions', content_rowid='id');",
+        """CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+            INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+        END;""",
+        """CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, question) VALUES ('delete', old.id, old.question);
+        END;""",
+        """CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF question ON questions BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, question) VALUES ('delete', old.id, old.question);
+            INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+        END;""",
+        # index the rows saved before the table existed
+        "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild');",
+    ]
+    try:
+        cur = conn.cursor()
+        for statement in statements:
+            cur.execute(statement)
+        conn.commit()
+        logging.info("Created FTS5 search over questions")
+    except Error as e:
+        conn.rollback()
+        logging.warning(f"FTS5 not available, history search will use LIKE: {e}")
 
 def save_qa_log(conn, question, answer, logs, context=None):
     """
@@ -449,35 +522,194 @@ def save_qa_log(conn, question, answer, logs, context=None):
     """
     try:
         q_sql = "INSERT INTO questions (question, answer, context) VALUES (?, ?, ?)"
-        q_id = create_record(conn, q_sql, (question, answer, context))
+        q_id = create_record(conn, q_sql, (question, answer, encode_text(context, QA_CONTEXT_MAX_CHARS)))
         
         if q_id:
             l_sql = "INSERT INTO logs (question_id, log_entry) VALUES (?, ?)"
-            create_record(conn, l_sql, (q_id, logs))
+            create_record(conn, l_sql, (q_id, encode_text(logs, QA_LOG_MAX_CHARS, keep="tail")))
             logging.info(f"Saved QA and logs for question ID: {q_id}")
             return q_id
     except Error as e:
         logging.error(f"Error saving QA logs: {e}")
         return None
 
-def get_qa_history(conn):
+SPAN_INSERT_SQL = """
+INSERT INTO spans (question_id, span_id, parent_id, name, start_ms, duration_ms, status,
+                   model, input_tokens, output_tokens, llm_calls, attributes)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+def span_rows(question_id, spans):
+    return [(
+        question_id,
+        s.get("span_id"),
+        s.get("parent_id"),
+        s["name"],
+        s.get("start_ms"),
+        s.get("duration_ms"),
+        s.get("status"),
+        s.get("model"),
+        s.get("input_tokens"),
+        s.get("output_tokens"),
+        s.get("llm_calls"),
+        json.dumps(s.get("attributes") or {}, default=str)
+    ) for s in spans]
+
+def save_spans(conn, question_id, spans):
     """
-    Get the history of asked questions.
+    Save the timing spans of one question.
     
     :param conn: Connection object
-    :return: List of dicts with id, question, timestamp
+    :param question_id: ID returned by save_qa_log
+    :param spans: span records from tracing.Trace.spans
+    :return: number of spans saved
+    """
+    if not spans:
+        return 0
+    rows = span_rows(question_id, spans)
+    try:
+        cur = conn.cursor()
+        cur.executemany(SPAN_INSERT_SQL, rows)
+        conn.commit()
+        return len(rows)
+    except Error as e:
+        logging.error(f"Error saving spans: {e}")
+        return 0
+
+def save_qa_batch(conn, items):
     """
-    sql = "SELECT id, question, timestamp FROM questions ORDER BY timestamp DESC"
-    rows = read_records(conn, sql)
+    Save several questions with their logs and spans in one transaction.
+    Used by the background QA writer instead of one save_qa_log per request.
     
-    history = []
+    :param conn: Connection object
+    :param items: list of dicts with question, answer, logs, context and spans (optional)
+    :return: list of saved question IDs, empty if the transaction failed
+    """
+    q_sql = "INSERT INTO questions (question, answer, context) VALUES (?, ?, ?)"
+    l_sql = "INSERT INTO logs (question_id, log_entry) VALUES (?, ?)"
+    try:
+        cur = conn.cursor()
+        ids = []
+        for item in items:
+            cur.execute(q_sql, (item["question"], item["answer"], encode_text(item.get("context"), QA_CONTEXT_MAX_CHARS)))
+            q_id = cur.lastrowid
+            cur.execute(l_sql, (q_id, encode_text(item.get("logs"), QA_LOG_MAX_CHARS, keep="tail")))
+            if item.get("spans"):
+                cur.executemany(SPAN_INSERT_SQL, span_rows(q_id, item["spans"]))
+            ids.append(q_id)
+        conn.commit()
+        return ids
+    except Error as e:
+        conn.rollback()
+        logging.error(f"Error saving QA batch: {e}")
+        return []
+
+def get_spans(conn, question_id=None, last_questions=None):
+    """
+    Get saved spans, for one question or for the most recent questions.
+    
+    :param conn: Connection object
+    :param question_id: only spans of this question (optional)
+    :param last_questions: only spans of the N most recent questions (optional)
+    :return: list of span dicts ordered by question and span id
+    """
+    sql = """
+    SELECT question_id, span_id, parent_id, name, start_ms, duration_ms, status,
+           model, input_tokens, output_tokens, llm_calls, attributes
+    FROM spans
+    """
+    params = ()
+    if question_id is not None:
+        sql += " WHERE question_id = ?"
+        params = (question_id,)
+    elif last_questions:
+        sql += " WHERE question_id IN (SELECT id FROM questions ORDER BY id DESC LIMIT ?)"
+        params = (last_questions,)
+    sql += " ORDER BY question_id, span_id"
+    rows = read_records(conn, sql, params)
+    
+    spans = []
     for row in rows:
+        try:
+            attributes = json.loads(row[11]) if row[11] else {}
+        except json.JSONDecodeError:
+            attributes = {}
+        spans.append({
+            "question_id": row[0],
+            "span_id": row[1],
+            "parent_id": row[2],
+            "name": row[3],
+            "start_ms": row[4],
+            "duration_ms": row[5],
+            "status": row[6],
+            "model": row[7],
+            "input_tokens": row[8],
+            "output_tokens": row[9],
+            "llm_calls": row[10],
+            "attributes": attributes
+        })
+    return spans
+
+def encode_history_cursor(timestamp, question_id):
+    return base64.urlsafe_b64encode(f"{timestamp}|{question_id}".encode("utf-8")).decode("ascii")
+
+def decode_history_cursor(cursor):
+    """:return: (timestamp, id) of the last row of the previous page; raises ValueError if malformed"""
+    try:
+        timestamp, question_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        return timestamp, int(question_id)
+    except Exception:
+        raise ValueError("Invalid history cursor")
+
+def fts_query(text):
+    """Each word as a quoted prefix term, so user input can't break the MATCH syntax."""
+    terms = [word.replace('"', '""') for word in text.split()]
+    return " ".join(f'"{term}"*' for term in terms if term)
+
+def get_qa_history(conn, limit=50, cursor=None, search=None):
+    """
+    Get one page of asked questions, newest first.
+    Keyset pagination on (timestamp, id), so every page is an index range scan
+    no matter how deep it is or how large the table grows.
+    
+    :param conn: Connection object
+    :param limit: page size
+    :param cursor: next_cursor of the previous page (optional)
+    :param search: words to look for in the question, FTS5 prefix match (optional)
+    :return: dict with items (list of dicts with id, question, timestamp) and next_cursor (None on the last page)
+    """
+    where = []
+    params = []
+    if cursor:
+        timestamp, question_id = decode_history_cursor(cursor)
+        where.append("(timestamp, id) < (?, ?)")
+        params += [timestamp, question_id]
+    if search and search.strip():
+        if has_question_search(conn):
+            where.append("id IN (SELECT rowid FROM questions_fts WHERE questions_fts MATCH ?)")
+            params.append(fts_query(search))
+        else:
+            where.append("question LIKE ?")
+            params.append(f"%{search.strip()}%")
+    sql = "SELECT id, question, timestamp FROM questions"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    # one extra row tells whether there is a next page
+    sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+    rows = read_records(conn, sql, tuple(params))
+    
+    history = []
+    for row in rows[:limit]:
         history.append({
             "id": row[0],
             "question": row[1],
             "timestamp": row[2]
         })
-    return history
+    next_cursor = None
+    if len(rows) > limit and history:
+        next_cursor = encode_history_cursor(history[-1]["timestamp"], history[-1]["id"])
+    return {"items": history, "next_cursor": next_cursor}
 
 def get_qa_details(conn, question_id):
     """
@@ -499,13 +731,51 @@ def get_qa_details(conn, question_id):
     logs = ""
     if l_rows:
         # Concatenate all log entries
-        logs = "\n".join([row[0] for row in l_rows])
+        logs = "\n".join([decode_text(row[0]) or "" for row in l_rows])
         
     return {
         "id": q_rows[0][0],
         "question": q_rows[0][1],
         "answer": q_rows[0][2],
-        "context": q_rows[0][3],
+        "context": decode_text(q_rows[0][3]),
         "timestamp": q_rows[0][4],
-        "logs": logs
+        "logs": logs,
+        "spans": get_spans(conn, question_id)
     }
+
+def compress_qa_rows(conn, batch_size=500, codec=None):
+    """
+    Migration: rewrites plain TEXT questions.context and logs.log_entry values with
+    encode_text (size cap + compression). Already-encoded BLOB rows are skipped, so it
+    can be re-run safely. Run VACUUM afterwards to give the space back to the file.
+    
+    :param conn: Connection object
+    :param batch_size: rows per transaction
+    :param codec: "zstd", "zlib" or None for QA_COMPRESSION
+    :return: dict of rewritten row counts per table
+    """
+    targets = [("questions", "context", QA_CONTEXT_MAX_CHARS, "head"), ("logs", "log_entry", QA_LOG_MAX_CHARS, "tail")]
+    rewritten = {}
+    for table, column, max_chars, keep in targets:
+        rewritten[table] = 0
+        last_id = 0
+        while True:
+            rows = read_records(
+                conn,
+                f"SELECT id, {column} FROM {table} WHERE id > ? AND typeof({column}) = 'text' ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            )
+            if not rows:
+                break
+            updates = [(encode_text(value, max_chars, codec, keep), row_id) for row_id, value in rows]
+            try:
+                cur = conn.cursor()
+                cur.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ?", updates)
+                conn.commit()
+            except Error as e:
+                logging.error(f"Error compressing {table}.{column}: {e}")
+                break
+            rewritten[table] += sum(1 for value, _ in updates if isinstance(value, bytes))
+            last_id = rows[-1][0]
+    logging.info(f"Compressed QA rows: {rewritten}")
+    return rewritten
@@ -0,0 +1,113 @@
+"""
+Per-request latency budget.
+
+A Deadline is created once per /chat request (server/app.py) and passed down
+query_rag -> polish / section / SQL / retrieval / answer. LLM helpers turn the
+remaining budget into their HTTP timeout. query_rag runs each stage through
+`run_stage`, which skips optional stages when too little budget is left and
+returns the stage's fallback when the stage ran out of time, so a slow backend
+degrades the answer instead of timing out the request.
+
+A call cut short by its budget-sized timeout says nothing about the backend, so
+while a stage runs its deadline is the context's current one, and the circuit
+breakers (functions/circuit_breaker.py) check `budget_spent()` before counting a
+failure: such calls raise DeadlineExceeded and are not counted. The same deadline
+caps how long a call waits in the LLM admission queue (functions/llm_scheduler.py).
+"""
+import os
+import sys
+import time
+import logging
+import contextvars
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import CHAT_BUDGET_S
+from functions import metrics
+from functions import tracing
+
+logger = logging.getLogger('rag_logger')
+
+# HTTP timeouts never go below this, so a nearly spent budget still gets a real attempt
+MIN_TIMEOUT_S = 0.5
+
+# Deadline of the stage running in this context, set by run_stage
+_current = contextvars.ContextVar("rag_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """A backend call failed once its request's budget was spent, i.e. on the budget-sized timeout."""
+
+
+class Deadline:
+    def __init__(self, budget_s=None):
+        self.budget_s = float(budget_s or CHAT_BUDGET_S)
+        self.expires_at = time.perf_counter() + self.budget_s
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.perf_counter())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows(self, seconds):
+        """True if more than `seconds` of budget is left."""
+        return self.remaining() > seconds
+
+    def timeout(self, cap=None):
+        """Remaining budget as a timeout for one backend call, optionally capped."""
+        remaining = max(self.remaining(), MIN_TIMEOUT_S)
+        return min(remaining, cap) if cap else remaining
+
+    def __repr__(self):
+        return f"Deadline({self.remaining():.1f}s of {self.budget_s:.1f}s left)"
+
+
+def timeout_of(deadline, cap=None):
+    """HTTP timeout for a call made under `deadline` (None: no deadline, keep the client default)."""
+    return deadline.timeout(cap) if deadline is not None else cap
+
+
+def current_deadline():
+    """Deadline of the stage running in this context, None outside run_stage."""
+    return _current.get()
+
+
+def budget_spent():
+    """True if the stage running in this context is past its request's budget."""
+    deadline = _current.get()
+    return deadline is not None and deadline.expired()
+
+
+def run_stage(deadline, name, fn, fallback, reserve_s=0.0):
+    """
+    Runs fn() within the request budget.
+    :param deadline: Deadline, or None to just run fn()
+    :param name: stage name for logs and metrics
+    :param fn: the stage
+    :param fallback: value used instead when the stage is skipped or runs out of budget
+    :param reserve_s: skip the stage unless more than this much budget is left
+    """
+    if deadline is None:
+        return fn()
+    if not deadline.allows(reserve_s):
+        logger.warning(f"Skipping {name}: {deadline.remaining():.1f}s of budget left")
+        return _degraded(name, "skipped", fallback)
+    token = _current.set(deadline)
+    try:
+        result = fn()
+    except Exception as e:
+        if not deadline.expired():
+            raise
+        logger.warning(f"{name} ran out of budget: {e}")
+        return _degraded(name, "timed_out", fallback)
+    finally:
+        _current.reset(token)
+    if result is None and deadline.expired():
+        logger.warning(f"{name} ran out of budget")
+        return _degraded(name, "timed_out", fallback)
+    return result
+
+
+def _degraded(name, reason, fallback):
+    tracing.set_attribute("degraded", reason)
+    metrics.DEADLINE_DEGRADED.inc(stage=name, reason=reason)
+    return fallback
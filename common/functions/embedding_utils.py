@@ -0,0 +1,146 @@
+import os
+import re
+import hashlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+from config import OLLAMA_KEEP_ALIVE_S
+from functions.llm_utils import get_ollama_base_url, http_client_kwargs
+from functions import circuit_breaker
+
+# gemini-embedding-001 returns 3072 dims; smaller sizes are Matryoshka prefixes
+GEMINI_FULL_DIMENSIONALITY = 3072
+
+
+def normalize_vectors(vectors):
+    """L2-normalizes a list of vectors (truncated Gemini vectors are not unit length)."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).tolist()
+
+
+class GeminiMatryoshkaEmbeddings(Embeddings):
+    """
+    Gemini embeddings with an optional output dimensionality.
+
+    gemini-embedding-001 is trained with Matryoshka representation learning, so the
+    first N dimensions are a usable embedding on their own. Anything below the full
+    size is re-normalized so cosine / l2 distances in Chroma stay comparable.
+    """
+
+    def __init__(self, model_name: str, output_dimensionality: int = None, api_key: str = None):
+        try:
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        except ImportError:
+            raise ImportError("langchain_google_genai is not installed. Please install it with `pip install langchain-google-genai`.")
+
+        api_key = api_key or os.getenv("GEMINI_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_KEY not found in environment variables.")
+
+        self.model_name = model_name
+        if output_dimensionality == GEMINI_FULL_DIMENSIONALITY:
+            output_dimensionality = None
+        self.output_dimensionality = output_dimensionality
+        self.client = GoogleGenerativeAIEmbeddings(model=model_name, google_api_key=api_key)
+
+    def embed_documents(self, texts):
+        if self.output_dimensionality is None:
+            return self.client.embed_documents(texts)
+        vectors = self.client.embed_documents(texts, output_dimensionality=self.output_dimensionality)
+        return normalize_vectors(vectors)
+
+    def embed_query(self, text):
+        if self.output_dimensionality is None:
+            return self.client.embed_query(text)
+        vector = self.client.embed_query(text, output_dimensionality=self.output_dimensionality)
+        return normalize_vectors([vector])[0]
+
+    def embed_queries(self, texts):
+        """embed_query for many texts in one request (query task type, unlike embed_documents)."""
+        if self.output_dimensionality is None:
+            return self.client.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+        vectors = self.client.embed_documents(texts, task_type="RETRIEVAL_QUERY", output_dimensionality=self.output_dimensionality)
+        return normalize_vectors(vectors)
+
+
+class BreakerEmbeddings(Embeddings):
+    """Runs every embedding call of the wrapped client through its backend's circuit breaker."""
+
+    def __init__(self, client: Embeddings, backend: str):
+        self.client = client
+        self.backend = backend
+
+    def embed_documents(self, texts):
+        with circuit_breaker.guard(self.backend):
+            return self.client.embed_documents(texts)
+
+    def embed_query(self, text):
+        with circuit_breaker.guard(self.backend):
+            return self.client.embed_query(text)
+
+    def embed_queries(self, texts):
+        """Query vectors for many texts in one call; Ollama and the stand-in embed queries and documents alike."""
+        embed = getattr(self.client, "embed_queries", self.client.embed_documents)
+        with circuit_breaker.guard(self.backend):
+            return embed(texts)
+
+
+class DeterministicHashEmbeddings(Embeddings):
+    """
+    Offline stand-in embedding: hashed word and character-trigram counts, L2 normalized.
+    Same text + seed always gives the same vector, across processes and machines, so
+    benchmarks and load tests can run without Ollama or Gemini. Different seeds act
+    like different embedding models.
+    """
+
+    def __init__(self, dimensions: int = 384, seed: str = ""):
+        self.dimensions = dimensions
+        self.seed = seed
+
+    def _bucket(self, token):
+        digest = hashlib.md5((self.seed + token).encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % self.dimensions
+        sign = 1.0 if digest[4] & 1 else -1.0
+        return index, sign
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = re.findall(r"[a-z0-9]+", text.lower())
+        for word in words:
+            index, sign = self._bucket("w:" + word)
+            vector[index] += sign
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                index, sign = self._bucket("c:" + padded[i:i + 3])
+                vector[index] += 0.5 * sign
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def get_embedding_function(model_name: str, output_dimensionality: int = None, timeout: float = None) -> Embeddings:
+    """
+    Returns the embedding client for a model name from EMBEDDING_MODELS.
+    output_dimensionality only applies to Gemini models; None keeps the full size.
+    With USE_STAND_IN_LLM every model, Gemini included, is served by the stand-in server.
+    Calls go through the model's backend circuit breaker; timeout (seconds) bounds each Ollama call.
+    """
+    backend = circuit_breaker.backend_of(model_name)
+    client_kwargs = http_client_kwargs(timeout)
+    base_url = get_ollama_base_url()
+    if base_url:
+        # the stand-in serves Gemini models too, at the requested Matryoshka size
+        dimensions = output_dimensionality if "gemini" in model_name else None
+        return BreakerEmbeddings(OllamaEmbeddings(model=model_name, base_url=base_url, dimensions=dimensions, client_kwargs=client_kwargs, keep_alive=OLLAMA_KEEP_ALIVE_S), backend)
+    if "gemini" in model_name:
+        return BreakerEmbeddings(GeminiMatryoshkaEmbeddings(model_name, output_dimensionality=output_dimensionality), backend)
+    return BreakerEmbeddings(OllamaEmbeddings(model=model_name, client_kwargs=client_kwargs, keep_alive=OLLAMA_KEEP_ALIVE_S), backend)
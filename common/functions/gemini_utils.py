@@ -1,11 +1,64 @@
 import os
-from google import genai
+import sys
+import json
+import urllib.request
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 from PIL import Image
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import USE_STAND_IN_LLM, STAND_IN_BASE_URL
+from functions import tracing
+from functions.llm_scheduler import llm_scheduler
+from functions import circuit_breaker
+
+
+def record_usage(model_name: str, response) -> None:
+    """Adds the token counts of a Gemini response to the open tracing span."""
+    usage = getattr(response, "usage_metadata", None)
+    tracing.record_llm_usage(
+        model_name,
+        getattr(usage, "prompt_token_count", 0) or 0,
+        getattr(usage, "candidates_token_count", 0) or 0
+    )
+
+
+def get_client(api_key: str, timeout: float = None):
+    """genai client; timeout in seconds (the SDK takes milliseconds)."""
+    # imported on first use: the SDK takes a good part of a second to import
+    from google import genai
+    if timeout:
+        return genai.Client(api_key=api_key, http_options={"timeout": int(timeout * 1000)})
+    return genai.Client(api_key=api_key)
+
+
+def get_stand_in_response(prompt: str, model_name: str, is_json: bool = False, timeout: float = 120) -> str:
+    """
+    Sends a Gemini call to the stand-in server (Ollama /api/generate) instead of the real API.
+    Used when USE_STAND_IN_LLM is set so load tests never leave the machine.
+    """
+    body = {"model": model_name, "prompt": prompt, "stream": False}
+    if is_json:
+        body["format"] = "json"
+    request = urllib.request.Request(
+        STAND_IN_BASE_URL + "/api/generate",
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    # outside the try: LLMOverloaded / CircuitOpen must reach the caller, not turn into ""
+    with circuit_breaker.guard(circuit_breaker.backend_of(model_name)) as call, llm_scheduler.slot(model_name):
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                data = json.loads(response.read().decode("utf-8"))
+                tracing.record_llm_usage(model_name, data.get("prompt_eval_count", 0), data.get("eval_count", 0))
+                return data.get("response", "")
+        except Exception as e:
+            call.failed(e)
+            print(f"Error calling stand-in server: {e}")
+            return ""
 
 def analyze_image_with_gemini(image: Image.Image, prompt: str, model_name: str = "gemini-2.0-flash") -> str:
     """
@@ -19,93 +72,110 @@ def analyze_image_with_gemini(image: Image.Image, prompt: str, model_name: str =
     Returns:
         str: The analysis text from the API.
     """
+    if USE_STAND_IN_LLM:
+        return get_stand_in_response(prompt, model_name)
     api_key = os.getenv("GEMINI_KEY")
     if not api_key:
         raise ValueError("GEMINI_KEY not found in environment variables.")
     
-    client = genai.Client(api_key=api_key)
+    client = get_client(api_key)
     
-    try:
-        from google.genai import types
-        import io
+    with circuit_breaker.guard("gemini") as call, llm_scheduler.slot(model_name):
+        try:
+            from google.genai import types
+            import io
         
-        # Convert PIL Image to bytes
-        img_byte_arr = io.BytesIO()
-        # default to PNG if format is not available
-        fmt = image.format if image.format else 'PNG'
-        image.save(img_byte_arr, format=fmt)
-        img_byte_arr = img_byte_arr.getvalue()
-
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[
-                types.Part.from_text(text=prompt),
-                types.Part.from_bytes(data=img_byte_arr, mime_type=f"image/{fmt.lower()}")
-            ]
-        )
-        return response.text
-    except Exception as e:
-        print(f"Error calling Gemini API for image analysis: {e}")
-        return ""
-
-
-def get_gemini_response(prompt: str, model_name: str = "gemini-2.0-flash") -> str:
+            # Convert PIL Image to bytes
+            img_byte_arr = io.BytesIO()
+            # default to PNG if format is not available
+            fmt = image.format if image.format else 'PNG'
+            image.save(img_byte_arr, format=fmt)
+            img_byte_arr = img_byte_arr.getvalue()
+
+            response = client.models.generate_content(
+                model=model_name,
+                contents=[
+                    types.Part.from_text(text=prompt),
+                    types.Part.from_bytes(data=img_byte_arr, mime_type=f"image/{fmt.lower()}")
+                ]
+            )
+            record_usage(model_name, response)
+            return response.text
+        except Exception as e:
+            call.failed(e)
+            print(f"Error calling Gemini API for image analysis: {e}")
+            return ""
+
+
+def get_gemini_response(prompt: str, model_name: str = "gemini-2.0-flash", timeout: float = None) -> str:
     """
     Calls the Gemini API with the given prompt.
     
     Args:
         prompt (str): The prompt to send to the API.
         model_name (str): The model to use. Defaults to "gemini-2.0-flash".
+        timeout (float): Seconds before the call is abandoned (None: client default).
         
     Returns:
         str: The text response from the API.
     """
+    if USE_STAND_IN_LLM:
+        return get_stand_in_response(prompt, model_name, timeout=timeout or 120)
     api_key = os.getenv("GEMINI_KEY")
     if not api_key:
         raise ValueError("GEMINI_KEY not found in environment variables.")
     
-    client = genai.Client(api_key=api_key)
+    client = get_client(api_key, timeout)
     
-    try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt
-        )
-        return response.text
-    except Exception as e:
-        # Log the error or handle it as appropriate for the application
-        print(f"Error calling Gemini API: {e}")
-        return ""
-
-def get_gemini_json_response(prompt: str, model_name: str = "gemini-2.0-flash") -> str:
+    with circuit_breaker.guard("gemini") as call, llm_scheduler.slot(model_name):
+        try:
+            response = client.models.generate_content(
+                model=model_name,
+                contents=prompt
+            )
+            record_usage(model_name, response)
+            return response.text
+        except Exception as e:
+            # Log the error or handle it as appropriate for the application
+            call.failed(e)
+            print(f"Error calling Gemini API: {e}")
+            return ""
+
+def get_gemini_json_response(prompt: str, model_name: str = "gemini-2.0-flash", timeout: float = None) -> str:
     """
     Calls the Gemini API with the given prompt and requests JSON output.
     
     Args:
         prompt (str): The prompt to send to the API.
         model_name (str): The model to use. Defaults to "gemini-2.0-flash".
+        timeout (float): Seconds before the call is abandoned (None: client default).
         
     Returns:
         str: The JSON text response from the API.
     """
+    if USE_STAND_IN_LLM:
+        return get_stand_in_response(prompt, model_name, is_json=True, timeout=timeout or 120)
     api_key = os.getenv("GEMINI_KEY")
     if not api_key:
         raise ValueError("GEMINI_KEY not found in environment variables.")
     
-    client = genai.Client(api_key=api_key)
+    client = get_client(api_key, timeout)
     
-    try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config={
-                'response_mime_type': 'application/json'
-            }
-        )
-        return response.text
-    except Exception as e:
-        print(f"Error calling Gemini API (JSON): {e}")
-        return ""
+    with circuit_breaker.guard("gemini") as call, llm_scheduler.slot(model_name):
+        try:
+            response = client.models.generate_content(
+                model=model_name,
+                contents=prompt,
+                config={
+                    'response_mime_type': 'application/json'
+                }
+            )
+            record_usage(model_name, response)
+            return response.text
+        except Exception as e:
+            call.failed(e)
+            print(f"Error calling Gemini API (JSON): {e}")
+            return ""
 
 
 
@@ -0,0 +1,157 @@
+"""
+Hedged LLM calls for the small JSON classification stages.
+
+`hedged_call(stage, fn, model_name, validate)` runs fn(model_name). If it has not
+returned a valid result by the primary's recent p95 latency for that stage, the same
+call is also sent to a secondary model on another backend (a second Ollama model would
+queue behind the same server and make it swap models) and the first valid result
+wins. Without a model on another backend the call is not hedged. The loser's result
+is discarded; a request already sent to Ollama / Gemini can't be aborted, so it
+finishes in the background (still under its llm_scheduler slot) and its latency
+keeps the primary's p95 window honest.
+
+Off unless HEDGE_ENABLED (RAG_HEDGE=1). `stats()` reports per stage the hedge rate,
+who won, and p99 of the primary alone vs. the hedged result.
+
+Import as `functions.hedging` (see functions/tracing.py for why).
+"""
+import os
+import sys
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (MODEL_COLLECTIONS, HEDGE_ENABLED, HEDGE_SECONDARY_MODEL, HEDGE_PERCENTILE, HEDGE_WINDOW,
+                    HEDGE_MIN_SAMPLES, HEDGE_INITIAL_DELAY_MS, HEDGE_MIN_DELAY_MS, HEDGE_MAX_WORKERS)
+from functions import metrics
+from functions import tracing
+from functions import circuit_breaker
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+_lock = threading.Lock()
+# (stage, model) -> recent primary latencies in seconds
+_primary_latency = {}
+# stage -> counters and recent latencies of the result the caller got
+_stages = {}
+
+
+def has_keys(*keys):
+    """Validator: result is a dict containing every key."""
+    return lambda result: isinstance(result, dict) and all(key in result for key in keys)
+
+
+def secondary_model(primary):
+    """HEDGE_SECONDARY_MODEL, or the first MODEL_COLLECTIONS model on another backend than primary; None: don't hedge."""
+    if HEDGE_SECONDARY_MODEL and HEDGE_SECONDARY_MODEL != primary:
+        return HEDGE_SECONDARY_MODEL
+    backend = circuit_breaker.backend_of(primary)
+    return next((model for model in MODEL_COLLECTIONS if circuit_breaker.backend_of(model) != backend), None)
+
+
+def hedge_delay(stage, model):
+    """Seconds to wait for the primary before hedging: its p95 over the window, once there are enough samples."""
+    with _lock:
+        samples = list(_primary_latency.get((stage, model), ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_INITIAL_DELAY_MS / 1000
+    return max(tracing.percentile(samples, HEDGE_PERCENTILE), HEDGE_MIN_DELAY_MS / 1000)
+
+
+def _stage(stage):
+    state = _stages.get(stage)
+    if state is None:
+        state = _stages[stage] = {"calls": 0, "hedged": 0, "primary_won": 0, "secondary_won": 0, "failed": 0,
+                                  "latency": deque(maxlen=HEDGE_WINDOW)}
+    return state
+
+
+def _record_primary(stage, model, seconds):
+    with _lock:
+        _primary_latency.setdefault((stage, model), deque(maxlen=HEDGE_WINDOW)).append(seconds)
+
+
+def _record_result(stage, outcome, seconds):
+    with _lock:
+        state = _stage(stage)
+        state["calls"] += 1
+        state["latency"].append(seconds)
+        if outcome != "not_hedged":
+            state["hedged"] += 1
+        if outcome in ("primary_won", "secondary_won", "failed"):
+            state[outcome] += 1
+    metrics.HEDGE_CALLS.inc(stage=stage, outcome=outcome)
+
+
+def _run(stage, fn, model, validate, is_primary):
+    start = time.perf_counter()
+    try:
+        result = fn(model)
+    finally:
+        if is_primary:
+            _record_primary(stage, model, time.perf_counter() - start)
+    return result if validate(result) else None
+
+
+def hedged_call(stage, fn, model_name, validate):
+    """
+    :param stage: name used for the latency window and stats (polish, section, ...)
+    :param fn: fn(model_name) -> parsed JSON (or None on failure)
+    :param model_name: primary model
+    :param validate: result -> bool, e.g. has_keys("sections")
+    :return: first valid result, otherwise the primary's result
+    """
+    secondary = secondary_model(model_name)
+    if not HEDGE_ENABLED or not secondary:
+        return fn(model_name)
+
+    start = time.perf_counter()
+    primary = _executor.submit(tracing.bind(_run), stage, fn, model_name, validate, True)
+    done, _ = wait([primary], timeout=hedge_delay(stage, model_name))
+    if done and primary.exception() is None and primary.result() is not None:
+        _record_result(stage, "not_hedged", time.perf_counter() - start)
+        return primary.result()
+
+    tracing.set_attribute("hedged_to", secondary)
+    backup = _executor.submit(tracing.bind(_run), stage, fn, secondary, validate, False)
+    pending = {primary, backup}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None and future.result() is not None:
+                for loser in pending:
+                    # only helps if it has not started; a running HTTP call finishes on its own
+                    loser.cancel()
+                outcome = "primary_won" if future is primary else "secondary_won"
+                tracing.set_attribute("hedge_winner", model_name if future is primary else secondary)
+                _record_result(stage, outcome, time.perf_counter() - start)
+                return future.result()
+
+    _record_result(stage, "failed", time.perf_counter() - start)
+    # neither gave valid JSON: behave like the unhedged call (raise or return its value)
+    return primary.result()
+
+
+def stats():
+    """Per stage: calls, hedge rate, winners, and p50/p99 of the primary alone vs. what callers got."""
+    with _lock:
+        report = {}
+        for stage, state in _stages.items():
+            primary = [s for (name, _), window in _primary_latency.items() if name == stage for s in window]
+            hedged = list(state["latency"])
+            p99_primary = tracing.percentile(primary, 99) * 1000
+            p99_hedged = tracing.percentile(hedged, 99) * 1000
+            report[stage] = {
+                "calls": state["calls"],
+                "hedged": state["hedged"],
+                "hedge_rate": round(state["hedged"] / state["calls"], 4) if state["calls"] else 0.0,
+                "primary_won": state["primary_won"],
+                "secondary_won": state["secondary_won"],
+                "failed": state["failed"],
+                "p50_primary_ms": round(tracing.percentile(primary, 50) * 1000, 1),
+                "p50_hedged_ms": round(tracing.percentile(hedged, 50) * 1000, 1),
+                "p99_primary_ms": round(p99_primary, 1),
+                "p99_hedged_ms": round(p99_hedged, 1),
+                "p99_improvement_ms": round(p99_primary - p99_hedged, 1),
+            }
+        return report
@@ -6,16 +6,15 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import re
 import pickle
 import shutil
-from typing import List
+import numpy as np
+from typing import List, Dict
 
-from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain_core.documents import Document
-from langchain_ollama import OllamaEmbeddings
 from langchain_chroma import Chroma
 from config import DATA_PATH, DB_PATH, EMBEDDING_MODEL_NAME, COLLECTION_NAME
 
 from functions.gemini_utils import analyze_image_with_gemini
+from functions.embedding_utils import get_embedding_function
 from PIL import Image
 import io
 import time
@@ -46,6 +45,8 @@ def ensure_directory_exists(path: str) -> bool:
 def load_documents(data_path: str) -> List[Document]:
     """Loads PDF documents from the specified directory."""
     print(f"Loading PDFs from '{data_path}'...")
+    # imported on first use, the JSON ingestion (ingest_new.py) never loads PDFs here
+    from langchain_community.document_loaders import PyPDFDirectoryLoader
     loader = PyPDFDirectoryLoader(data_path)
     documents = loader.load()
     if not documents:
@@ -386,13 +387,13 @@ def reset_vector_db(db_path: str):
         shutil.rmtree(db_path)
     os.makedirs(db_path, exist_ok=True)
 
-def create_and_persist_db(chunks: List[Document], db_path: str, collection_name: str, model_name: str,ids:List[str]):
+def create_and_persist_db(chunks: List[Document], db_path: str, collection_name: str, model_name: str,ids:List[str], output_dimensionality: int = None):
     """Initializes the embedding model and creates the Chroma vector store."""
     if "gemini" in model_name:
-        create_and_persist_db_gemini(chunks, db_path, collection_name, model_name, ids)
+        create_and_persist_db_gemini(chunks, db_path, collection_name, model_name, ids, output_dimensionality)
         return
     print(f"Initializing embedding model '{model_name}'...")
-    embeddings = OllamaEmbeddings(model=model_name)
+    embeddings = get_embedding_function(model_name)
 
     print(f"Creating vector store in '{db_path}'...")
     Chroma.from_documents(
@@ -405,22 +406,13 @@ def create_and_persist_db(chunks: List[Document], db_path: str, collection_name:
 
     print("Vector store created successfully.")
 
-def create_and_persist_db_gemini(chunks: List[Document], db_path: str, collection_name: str, model_name: str, ids: List[str]):
-    try:
-        from langchain_google_genai import GoogleGenerativeAIEmbeddings
-    except ImportError:
-        GoogleGenerativeAIEmbeddings = None
-    
-    """Initializes the Gemini embedding model and creates the Chroma vector store."""
-    print(f"Initializing Gemini embedding model '{model_name}'...")
-    
-    if GoogleGenerativeAIEmbeddings is None:
-         raise ImportError("langchain_google_genai is not installed. Please install it with `pip install langchain-google-genai`.")
-
-    # Ensure GEMINI_KEY is loaded
-    api_key = os.getenv("GEMINI_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_KEY not found in environment variables.")
+def create_and_persist_db_gemini(chunks: List[Document], db_path: str, collection_name: str, model_name: str, ids: List[str], output_dimensionality: int = None):
+    """
+    Initializes the Gemini embedding model and creates the Chroma vector store.
+    output_dimensionality truncates the Matryoshka embedding (None keeps the full size),
+    so each size must be stored in its own collection (see config.get_collection_name).
+    """
+    print(f"Initializing Gemini embedding model '{model_name}' (dims: {output_dimensionality or 'full'})...")
 
     # Filter out empty documents to avoid API errors
     valid_chunks = []
@@ -435,7 +427,7 @@ def create_and_persist_db_gemini(chunks: List[Document], db_path: str, collectio
         print("No valid content to embed. Skipping.")
         return
 
-    embeddings = GoogleGenerativeAIEmbeddings(model=model_name, google_api_key=api_key)
+    embeddings = get_embedding_function(model_name, output_dimensionality=output_dimensionality)
 
     print(f"Creating vector store in '{db_path}'...")
     Chroma.from_documents(
@@ -448,6 +440,38 @@ def create_and_persist_db_gemini(chunks: List[Document], db_path: str, collectio
 
     print("Vector store created successfully.")
 
+def create_and_persist_summary(db_path: str, collection_name: str, summary_collection_name: str, ids: List[str], metadata: Dict):
+    """
+    Stores one aggregate vector per candidate in the summary collection.
+    The vector is the normalized mean of the candidate's (already embedded) section
+    vectors, so no extra embedding calls are made. metadata must contain "email",
+    which is also used as the id.
+    """
+    section_db = Chroma(persist_directory=db_path, collection_name=collection_name)
+    stored = section_db.get(ids=ids, include=["embeddings"])
+    if len(stored["ids"]) == 0:
+        print(f"No section vectors found for '{metadata.get('email')}'. Skipping summary vector.")
+        return
+
+    vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    summary = (vectors / norms).mean(axis=0)
+    summary /= (np.linalg.norm(summary) or 1.0)
+
+    summary_db = Chroma(
+        persist_directory=db_path,
+        collection_name=summary_collection_name,
+        collection_metadata={"hnsw:space": "cosine"}
+    )
+    summary_db._collection.upsert(
+        ids=[metadata["email"]],
+        embeddings=[summary.tolist()],
+        metadatas=[{**metadata, "sections": len(stored["ids"])}],
+        documents=[metadata.get("name") or metadata["email"]]
+    )
+    print(f"Summary vector stored for '{metadata['email']}' from {len(stored['ids'])} sections.")
+
 # --- Improved Section Extraction (Ported from JS) ---
 
 CV_HEADING_PATTERNS = {
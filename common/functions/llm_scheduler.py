@@ -0,0 +1,277 @@
+"""
+Admission control and priority scheduling for LLM calls.
+
+Every Ollama (functions/llm_utils.get_chat_model) and Gemini (functions/gemini_utils)
+call runs inside `llm_scheduler.slot(model)`. At most LLM_MAX_IN_FLIGHT calls per
+model run at once; the rest wait, at most LLM_QUEUE_TIMEOUT_S each. When
+LLM_MAX_QUEUE calls are already waiting, or the wait times out, the call raises
+LLMOverloaded instead of piling more work on a saturated backend, and the server
+turns that into a 503. A call inside a budgeted stage (functions/deadline.py) waits
+no longer than its request's remaining budget; then it raises DeadlineExceeded and
+the stage falls back.
+
+Waiting calls are served by priority class (LLM_PRIORITY_CLASSES, highest first:
+interactive, agent, batch), FIFO within a class. Shedding follows the same order: a
+call arriving at a full queue evicts the newest waiter of a lower class (which raises
+LLMOverloaded), and is itself rejected only when nothing lower is waiting. The class
+comes from the `priority(name)` context, "interactive" when unset. Batch calls also
+never hold more than LLM_BATCH_MAX_IN_FLIGHT of a model's slots, so chat keeps
+headroom while an extraction run is going. A running call is never interrupted.
+
+Limits are per process. A batch job running as its own script (md_parser) calls
+`llm_scheduler.defer_to_server()`: before each batch call it polls the server's
+/stats/llm and waits while the server has interactive or agent calls running or
+queued on the same model.
+
+Import as `functions.llm_scheduler` (see functions/tracing.py for why).
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (LLM_MAX_IN_FLIGHT, LLM_MAX_IN_FLIGHT_PER_MODEL, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT_S,
+                    LLM_PRIORITY_CLASSES, LLM_BATCH_MAX_IN_FLIGHT, LLM_SCHEDULER_URL, LLM_BATCH_POLL_S, LLM_BATCH_MAX_DEFER_S)
+from functions import metrics
+from functions.deadline import DeadlineExceeded, current_deadline
+from functions import tracing
+
+BATCH = "batch"
+_priority = contextvars.ContextVar("rag_llm_priority", default=LLM_PRIORITY_CLASSES[0])
+
+
+@contextmanager
+def priority(name):
+    """LLM calls made inside run in class `name`; also usable as a function decorator."""
+    if name not in LLM_PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class {name}, expected one of {LLM_PRIORITY_CLASSES}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class LLMOverloaded(RuntimeError):
+    """Raised when an LLM call is shed: the model's queue is full or the wait timed out."""
+
+    def __init__(self, model, reason, message):
+        super().__init__(message)
+        self.model = model
+        self.reason = reason
+
+
+class _ModelQueue:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.batch_in_flight = 0
+        # running calls per class
+        self.running = {}
+        # heap of (class rank, arrival number, class name)
+        self.waiting = []
+        # entries shed from waiting for a higher-class call; their waiters raise LLMOverloaded
+        self.evicted = set()
+
+
+class _ClassStats:
+    def __init__(self):
+        self.calls = 0
+        self.rejected = 0
+        self.wait_s = 0.0
+        self.max_wait_s = 0.0
+
+
+class LLMScheduler:
+    def __init__(self, max_in_flight=None, per_model=None, max_queue=None, queue_timeout_s=None, batch_max_in_flight=None):
+        self.max_in_flight = max_in_flight or LLM_MAX_IN_FLIGHT
+        self.per_model = per_model if per_model is not None else LLM_MAX_IN_FLIGHT_PER_MODEL
+        self.max_queue = max_queue if max_queue is not None else LLM_MAX_QUEUE
+        self.queue_timeout_s = queue_timeout_s or LLM_QUEUE_TIMEOUT_S
+        self.batch_max_in_flight = batch_max_in_flight or LLM_BATCH_MAX_IN_FLIGHT
+        self.server_url = None
+        self.started = time.time()
+        self._queues = {}
+        self._classes = {name: _ClassStats() for name in LLM_PRIORITY_CLASSES}
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def _queue(self, model):
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = self._queues[model] = _ModelQueue(self.per_model.get(model, self.max_in_flight))
+        return queue
+
+    def _can_run(self, queue, entry):
+        if queue.waiting[0] is not entry or queue.in_flight >= queue.limit:
+            return False
+        return entry[2] != BATCH or queue.batch_in_flight < min(self.batch_max_in_flight, queue.limit)
+
+    def _reject(self, model, name, reason, message):
+        self._classes[name].rejected += 1
+        metrics.LLM_REJECTED.inc(model=model, priority=name, reason=reason)
+        raise LLMOverloaded(model, reason, message)
+
+    def _enqueue(self, model, name):
+        """
+        Adds a waiting entry for model; call with self._cond held. A full queue makes room
+        by evicting its lowest-class, newest entry if that is of a lower class than name.
+        :raises LLMOverloaded: queue full of calls of this class or higher
+        """
+        queue = self._queue(model)
+        rank = LLM_PRIORITY_CLASSES.index(name)
+        if len(queue.waiting) >= self.max_queue:
+            victim = max(queue.waiting) if queue.waiting else None
+            if victim is None or victim[0] <= rank:
+                self._reject(model, name, "queue_full", f"{model} is overloaded: {len(queue.waiting)} calls already waiting")
+            queue.waiting.remove(victim)
+            heapq.heapify(queue.waiting)
+            queue.evicted.add(victim)
+            self._cond.notify_all()
+        entry = (rank, next(self._arrivals), name)
+        heapq.heappush(queue.waiting, entry)
+        metrics.LLM_QUEUE_DEPTH.set(len(queue.waiting), model=model)
+        return queue, entry
+
+    def _check_evicted(self, model, queue, entry):
+        """Raises LLMOverloaded if entry was shed for a higher-class call; call with self._cond held."""
+        if entry in queue.evicted:
+            queue.evicted.discard(entry)
+            self._reject(model, entry[2], "evicted", f"{model} is overloaded: call shed for higher-priority work")
+
+    def acquire(self, model):
+        """
+        Blocks until model has a free slot for the current priority class.
+        :return: seconds spent waiting
+        :raises LLMOverloaded: queue full, shed for a higher-class call, or no slot within queue_timeout_s
+        :raises DeadlineExceeded: the request's budget (deadline.current_deadline) ran out first
+        """
+        name = current_priority()
+        if name == BATCH and self.server_url:
+            self.defer_to_interactive(model)
+
+        start = time.perf_counter()
+        budget = current_deadline()
+        with self._cond:
+            queue, entry = self._enqueue(model, name)
+            timeout_at = start + self.queue_timeout_s
+            try:
+                while True:
+                    self._check_evicted(model, queue, entry)
+                    if self._can_run(queue, entry):
+                        break
+                    remaining = timeout_at - time.perf_counter()
+                    if remaining <= 0:
+                        self._reject(model, name, "timeout", f"{model} is overloaded: no free slot after {self.queue_timeout_s}s")
+                    if budget is not None:
+                        if budget.expired():
+                            # not an overload: the stage falls back (deadline.run_stage)
+                            raise DeadlineExceeded(f"{model}: request budget ran out after {time.perf_counter() - start:.1f}s waiting for a slot")
+                        remaining = min(remaining, budget.remaining())
+                    self._cond.wait(remaining)
+                queue.in_flight += 1
+                queue.running[name] = queue.running.get(name, 0) + 1
+                if name == BATCH:
+                    queue.batch_in_flight += 1
+                metrics.LLM_IN_FLIGHT.inc(model=model)
+            finally:
+                if entry in queue.waiting:
+                    queue.waiting.remove(entry)
+                    heapq.heapify(queue.waiting)
+                metrics.LLM_QUEUE_DEPTH.set(len(queue.waiting), model=model)
+                # the head may have changed (timeout) or a slot may still be free
+                self._cond.notify_all()
+
+            waited = time.perf_counter() - start
+            stats = self._classes[name]
+            stats.calls += 1
+            stats.wait_s += waited
+            stats.max_wait_s = max(stats.max_wait_s, waited)
+        metrics.LLM_QUEUE_WAIT.observe(waited, model=model, priority=name)
+        metrics.LLM_SCHEDULED.inc(model=model, priority=name)
+        return waited
+
+    def release(self, model, name=None):
+        name = name or current_priority()
+        with self._cond:
+            queue = self._queue(model)
+            queue.in_flight -= 1
+            queue.running[name] -= 1
+            if name == BATCH:
+                queue.batch_in_flight -= 1
+            metrics.LLM_IN_FLIGHT.dec(model=model)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, model):
+        """Runs the enclosed LLM call under model's concurrency limit; the wait is added to the open span."""
+        name = current_priority()
+        waited = self.acquire(model)
+        if waited >= 0.001:
+            tracing.set_attribute("queue_wait_ms", round(waited * 1000, 1))
+        try:
+            yield
+        finally:
+            self.release(model, name)
+
+    def defer_to_server(self, url=None):
+        """Makes batch calls of this process wait for the server's interactive and agent calls (see module doc)."""
+        self.server_url = (url or LLM_SCHEDULER_URL).rstrip("/")
+
+    def defer_to_interactive(self, model):
+        """Polls the server until it has no interactive / agent call on model, or LLM_BATCH_MAX_DEFER_S passed."""
+        deadline = time.time() + LLM_BATCH_MAX_DEFER_S
+        while time.time() < deadline:
+            try:
+                with urllib.request.urlopen(self.server_url + "/stats/llm", timeout=5) as response:
+                    server = json.loads(response.read().decode("utf-8"))
+            except Exception:
+                # server not running: nothing to yield to
+                return
+            state = server.get("models", {}).get(model, {})
+            busy = sum(n for name, n in state.get("in_flight_by_class", {}).items() if name != BATCH)
+            busy += sum(n for name, n in state.get("waiting_by_class", {}).items() if name != BATCH)
+            if not busy:
+                return
+            time.sleep(LLM_BATCH_POLL_S)
+
+    def stats(self):
+        """Per model: limit, running and waiting calls by class; per class: calls, throughput and wait times."""
+        with self._cond:
+            uptime = max(time.time() - self.started, 1e-9)
+            models = {}
+            for model, q in self._queues.items():
+                waiting_by_class = {}
+                for _, _, name in q.waiting:
+                    waiting_by_class[name] = waiting_by_class.get(name, 0) + 1
+                models[model] = {
+                    "limit": q.limit,
+                    "in_flight": q.in_flight,
+                    "waiting": len(q.waiting),
+                    "in_flight_by_class": {name: n for name, n in q.running.items() if n},
+                    "waiting_by_class": waiting_by_class,
+                }
+            classes = {
+                name: {
+                    "calls": s.calls,
+                    "rejected": s.rejected,
+                    "calls_per_min": round(s.calls / uptime * 60, 2),
+                    "mean_wait_ms": round(s.wait_s / s.calls * 1000, 1) if s.calls else 0.0,
+                    "max_wait_ms": round(s.max_wait_s * 1000, 1),
+                }
+                for name, s in self._classes.items()
+            }
+            return {"models": models, "classes": classes}
+
+
+llm_scheduler = LLMScheduler()
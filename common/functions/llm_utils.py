@@ -0,0 +1,71 @@
+import os
+import sys
+import functools
+import httpx
+from langchain_ollama import ChatOllama
+from langchain_core.callbacks import BaseCallbackHandler
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import USE_STAND_IN_LLM, STAND_IN_BASE_URL, OLLAMA_KEEP_ALIVE_S
+from functions import tracing
+from functions.llm_scheduler import llm_scheduler
+from functions import circuit_breaker
+
+
+class SpanUsageHandler(BaseCallbackHandler):
+    """Adds model name and token counts of every ChatOllama call to the open tracing span."""
+    run_inline = True
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def on_llm_end(self, response, **kwargs):
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        tracing.record_llm_usage(self.model_name, input_tokens, output_tokens)
+
+
+class ScheduledChatOllama(ChatOllama):
+    """ChatOllama whose calls go through the ollama circuit breaker and wait for a slot of the model in functions/llm_scheduler.py."""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with circuit_breaker.guard(circuit_breaker.backend_of(self.model)), llm_scheduler.slot(self.model):
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def get_ollama_base_url():
+    """Base url for Ollama clients; None lets langchain_ollama use its default / OLLAMA_HOST."""
+    if USE_STAND_IN_LLM:
+        return STAND_IN_BASE_URL
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def shared_ssl_context():
+    """One SSL context for all HTTP clients; httpx otherwise loads the CA bundle again for every client (~30 ms of CPU)."""
+    return httpx.create_ssl_context()
+
+
+def http_client_kwargs(timeout=None, **kwargs):
+    """httpx / ollama client kwargs sharing shared_ssl_context(); timeout in seconds."""
+    kwargs["verify"] = shared_ssl_context()
+    if timeout:
+        kwargs["timeout"] = timeout
+    return kwargs
+
+
+def get_chat_model(model_name, timeout=None, **kwargs):
+    """
+    ChatOllama for model_name, admission-controlled, routed to the stand-in server when USE_STAND_IN_LLM is set.
+    timeout (seconds) bounds each HTTP call, see functions/deadline.py.
+    """
+    base_url = get_ollama_base_url()
+    if base_url:
+        kwargs["base_url"] = base_url
+    kwargs["client_kwargs"] = http_client_kwargs(timeout, **kwargs.get("client_kwargs", {}))
+    kwargs.setdefault("callbacks", [SpanUsageHandler(model_name)])
+    kwargs.setdefault("keep_alive", OLLAMA_KEEP_ALIVE_S)
+    return ScheduledChatOllama(model=model_name, **kwargs)
@@ -0,0 +1,80 @@
+"""
+Request-scoped log capture.
+
+One ContextLogHandler is attached to rag_logger at startup and never removed.
+It appends each record to the LogBuffer of the current context, so a request
+only captures its own lines even when several requests log at once, and the
+logger's handler list is not touched per request.
+
+Import as `functions.log_capture` (see functions/tracing.py for why).
+"""
+import os
+import sys
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import LOG_CAPTURE_MAX_LINES, LOG_CAPTURE_MAX_CHARS
+
+_current_buffer = contextvars.ContextVar("rag_log_buffer", default=None)
+
+
+class LogBuffer:
+    """Keeps the most recent lines within max_lines / max_chars and counts what it dropped."""
+
+    def __init__(self, max_lines=None, max_chars=None):
+        self.max_lines = max_lines or LOG_CAPTURE_MAX_LINES
+        self.max_chars = max_chars or LOG_CAPTURE_MAX_CHARS
+        self.lines = deque()
+        self.chars = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def append(self, line):
+        with self._lock:
+            self.lines.append(line)
+            self.chars += len(line) + 1
+            while self.lines and (len(self.lines) > self.max_lines or self.chars > self.max_chars):
+                self.chars -= len(self.lines.popleft()) + 1
+                self.dropped += 1
+
+    def getvalue(self):
+        with self._lock:
+            text = "\n".join(self.lines)
+            if self.lines:
+                text += "\n"
+            if self.dropped:
+                text = f"[{self.dropped} earlier log lines dropped]\n" + text
+            return text
+
+
+class ContextLogHandler(logging.Handler):
+    """Routes records to the LogBuffer of the current context; no-op outside capture_logs()."""
+
+    def emit(self, record):
+        buffer = _current_buffer.get()
+        if buffer is None:
+            return
+        try:
+            buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+def install(logger):
+    """Attaches the handler once; safe to call again."""
+    if not any(isinstance(h, ContextLogHandler) for h in logger.handlers):
+        logger.addHandler(ContextLogHandler(level=logging.INFO))
+
+
+@contextmanager
+def capture_logs(max_lines=None, max_chars=None):
+    """Collects this context's rag_logger lines into a fresh LogBuffer."""
+    buffer = LogBuffer(max_lines, max_chars)
+    token = _current_buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _current_buffer.reset(token)
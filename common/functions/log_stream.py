@@ -0,0 +1,151 @@
+"""
+Batched, per-session Socket.IO log streaming.
+
+The request handler names the Socket.IO session that asked the question with
+`stream_to(sid)`; records logged in that context are queued for that session's
+room only. A background task sends each room's queued records as one
+'log_batch' event every LOG_EMIT_INTERVAL_MS, so the request thread only
+appends to a list and emit cost no longer scales with connected clients.
+
+Under backpressure (queue past half of LOG_EMIT_MAX_QUEUE) INFO records are
+sampled 1 in LOG_EMIT_SAMPLE_EVERY; past LOG_EMIT_MAX_QUEUE new records are
+dropped. Each batch carries the number of records dropped for that room.
+
+Import as `functions.log_stream` (see functions/tracing.py for why).
+"""
+import os
+import sys
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import LOG_EMIT_INTERVAL_MS, LOG_EMIT_MAX_BATCH, LOG_EMIT_MAX_QUEUE, LOG_EMIT_SAMPLE_EVERY
+from functions import metrics
+
+_current_room = contextvars.ContextVar("rag_log_room", default=None)
+
+
+@contextmanager
+def stream_to(room):
+    """Sends this context's log records to `room` (a Socket.IO sid); None disables streaming."""
+    token = _current_room.set(room)
+    try:
+        yield
+    finally:
+        _current_room.reset(token)
+
+
+class BatchedLogEmitter:
+    """
+    Per-room queues drained by one background task.
+    :param emit: callable(event, payload, room) doing the actual Socket.IO emit
+    :param start_background_task: e.g. socketio.start_background_task, so the loop fits the async mode
+    :param sleep: e.g. socketio.sleep
+    """
+
+    def __init__(self, emit, start_background_task=None, sleep=None, interval_ms=None,
+                 max_batch=None, max_queue=None, sample_every=None):
+        self.emit = emit
+        self.start_background_task = start_background_task or self._start_thread
+        self.sleep = sleep or time.sleep
+        self.interval = (interval_ms or LOG_EMIT_INTERVAL_MS) / 1000
+        self.max_batch = max_batch or LOG_EMIT_MAX_BATCH
+        self.max_queue = max_queue or LOG_EMIT_MAX_QUEUE
+        self.sample_every = sample_every or LOG_EMIT_SAMPLE_EVERY
+        self.pending = {}
+        self.dropped = {}
+        self.depth = 0
+        self._sample_counter = 0
+        self._lock = threading.Lock()
+        self._started = False
+
+    @staticmethod
+    def _start_thread(target):
+        thread = threading.Thread(target=target, name="log-emitter", daemon=True)
+        thread.start()
+        return thread
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.start_background_task(self._run)
+
+    def push(self, room, line, levelno=logging.INFO):
+        """Queues one formatted record for room; returns False if it was sampled out or dropped."""
+        with self._lock:
+            if self.depth >= self.max_queue:
+                self.dropped[room] = self.dropped.get(room, 0) + 1
+                result = "dropped"
+            elif self.depth >= self.max_queue // 2 and levelno < logging.WARNING:
+                self._sample_counter += 1
+                if self._sample_counter % self.sample_every:
+                    self.dropped[room] = self.dropped.get(room, 0) + 1
+                    result = "sampled_out"
+                else:
+                    result = None
+            else:
+                result = None
+            if result is None:
+                self.pending.setdefault(room, deque()).append(line)
+                self.depth += 1
+            depth = self.depth
+        metrics.LOG_QUEUE_DEPTH.set(depth)
+        if result:
+            metrics.LOG_RECORDS.inc(result=result)
+            return False
+        return True
+
+    def flush(self):
+        """Sends at most max_batch queued records per room; returns how many were sent."""
+        batches = []
+        with self._lock:
+            for room in list(self.pending):
+                queue = self.pending[room]
+                records = [queue.popleft() for _ in range(min(self.max_batch, len(queue)))]
+                if not queue:
+                    del self.pending[room]
+                dropped = self.dropped.pop(room, 0)
+                self.depth -= len(records)
+                batches.append((room, records, dropped))
+            for room in list(self.dropped):
+                # every record for this room was dropped, still tell the client
+                batches.append((room, [], self.dropped.pop(room)))
+            depth = self.depth
+        metrics.LOG_QUEUE_DEPTH.set(depth)
+
+        sent = 0
+        for room, records, dropped in batches:
+            try:
+                self.emit("log_batch", {"records": records, "dropped": dropped}, room)
+                sent += len(records)
+            except Exception:
+                pass  # session gone or socket not ready
+        metrics.LOG_RECORDS.inc(sent, result="emitted")
+        return sent
+
+    def _run(self):
+        while True:
+            self.sleep(self.interval)
+            self.flush()
+
+
+class SessionLogHandler(logging.Handler):
+    """Queues records on the emitter for the room named by stream_to(); no-op outside it."""
+
+    def __init__(self, emitter, level=logging.NOTSET):
+        super().__init__(level)
+        self.emitter = emitter
+
+    def emit(self, record):
+        room = _current_room.get()
+        if room is None:
+            return
+        try:
+            self.emitter.push(room, self.format(record), record.levelno)
+        except Exception:
+            self.handleError(record)
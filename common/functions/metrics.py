@@ -0,0 +1,205 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms live in one module-level registry and are rendered
+by `render()` for the server's /metrics endpoint. Pipeline stages are observed
+through functions/tracing.py (every finished span), LLM calls through
+tracing.record_llm_usage, and HTTP requests by server/app.py.
+
+Like tracing, always import this module as `functions.metrics` so there is a
+single registry per process. Values are per process: with several workers each
+one exposes its own numbers and the scraper sums them.
+"""
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines += self._render_sample(key, value)
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with _lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with _lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+def render():
+    """All registered metrics in the Prometheus text format (version 0.0.4)."""
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = Counter("rag_http_requests_total", "HTTP requests by endpoint, method and status.", ("endpoint", "method", "status"))
+HTTP_IN_FLIGHT = Gauge("rag_http_requests_in_flight", "HTTP requests currently being served.", ("endpoint",))
+HTTP_LATENCY = Histogram("rag_http_request_duration_seconds", "HTTP request latency.", ("endpoint",))
+STAGE_LATENCY = Histogram("rag_stage_duration_seconds", "Pipeline stage latency, one observation per tracing span.", ("stage",))
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Pipeline stages that ended with an error.", ("stage",))
+BACKEND_LATENCY = Histogram("rag_backend_duration_seconds", "SQLite and Chroma operation latency.", ("backend", "operation"))
+LLM_CALLS = Counter("rag_llm_calls_total", "LLM calls by model.", ("model",))
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM tokens by model and direction (input / output).", ("model", "direction"))
+LOG_RECORDS = Counter("rag_log_records_total", "Socket.IO log records by outcome (emitted / sampled_out / dropped).", ("result",))
+LOG_QUEUE_DEPTH = Gauge("rag_log_queue_depth", "Log records waiting for the Socket.IO emitter.")
+QA_WRITER_QUEUE_DEPTH = Gauge("rag_qa_writer_queue_depth", "QA rows waiting for the background writer.")
+QA_WRITER_ROWS = Counter("rag_qa_writer_rows_total", "QA rows by outcome (written / dropped / failed).", ("result",))
+LLM_IN_FLIGHT = Gauge("rag_llm_in_flight", "LLM calls currently running, per model.", ("model",))
+LLM_QUEUE_DEPTH = Gauge("rag_llm_queue_depth", "LLM calls waiting for a slot, per model.", ("model",))
+LLM_QUEUE_WAIT = Histogram("rag_llm_queue_wait_seconds", "Time LLM calls waited for a slot, per model and priority class.", ("model", "priority"))
+LLM_SCHEDULED = Counter("rag_llm_scheduled_total", "LLM calls admitted, per model and priority class.", ("model", "priority"))
+LLM_REJECTED = Counter("rag_llm_rejected_total", "LLM calls shed by admission control (queue_full / evicted / timeout).", ("model", "priority", "reason"))
+HEDGE_CALLS = Counter("rag_hedge_calls_total", "Hedgeable LLM calls by stage and outcome (not_hedged / primary_won / secondary_won / failed).", ("stage", "outcome"))
+BREAKER_STATE = Gauge("rag_circuit_breaker_state", "Circuit breaker state per backend (0 closed, 1 half-open, 2 open).", ("backend",))
+BREAKER_TRANSITIONS = Counter("rag_circuit_breaker_transitions_total", "Circuit breaker state changes per backend and new state.", ("backend", "state"))
+BREAKER_REJECTED = Counter("rag_circuit_breaker_rejected_total", "Calls failed fast because the backend's breaker was open.", ("backend",))
+BREAKER_FALLBACKS = Counter("rag_circuit_breaker_fallbacks_total", "LLM calls moved to a fallback model by an open breaker.", ("model", "fallback"))
+DEADLINE_DEGRADED = Counter("rag_deadline_degraded_total", "Pipeline stages skipped or cut short by the request budget (skipped / timed_out).", ("stage", "reason"))
+CACHE_REQUESTS = Counter("rag_cache_requests_total", "Cache lookups by cache and result (hit / miss).", ("cache", "result"))
+WARMUP_STEP_SECONDS = Gauge("rag_warmup_step_seconds", "Duration of each startup warm-up step in this process.", ("step",))
+
+
+def observe_span(record):
+    """Feeds a finished tracing span into the stage and backend histograms."""
+    seconds = (record.get("duration_ms") or 0) / 1000
+    STAGE_LATENCY.observe(seconds, stage=record["name"])
+    if record.get("status") == "error":
+        STAGE_ERRORS.inc(stage=record["name"])
+    backend = record.get("attributes", {}).get("backend")
+    if backend:
+        BACKEND_LATENCY.observe(seconds, backend=backend, operation=record["name"])
+
+
+def record_llm_call(model, input_tokens=0, output_tokens=0):
+    LLM_CALLS.inc(model=model)
+    LLM_TOKENS.inc(input_tokens or 0, model=model, direction="input")
+    LLM_TOKENS.inc(output_tokens or 0, model=model, direction="output")
+
+
+@contextmanager
+def time_backend(backend, operation):
+    """Times a SQLite / Chroma call made outside a tracing span (e.g. the QA log writes)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        BACKEND_LATENCY.observe(time.perf_counter() - start, backend=backend, operation=operation)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
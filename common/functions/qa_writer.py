@@ -0,0 +1,125 @@
+"""
+Background writer for the QA log (questions, logs and spans tables).
+
+The request thread only calls `submit`, which puts the row on a bounded queue
+and returns at once. One writer thread owns a single SQLite connection and saves
+queued rows with save_qa_batch, one transaction per QA_WRITER_BATCH_SIZE rows or
+per QA_WRITER_FLUSH_INTERVAL_MS, whichever comes first. A full queue drops the
+row instead of blocking the response; `close` (registered with atexit) drains
+what is left.
+
+Import as `functions.qa_writer` (see functions/tracing.py for why).
+"""
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DB_NAME, QA_WRITER_BATCH_SIZE, QA_WRITER_FLUSH_INTERVAL_MS, QA_WRITER_MAX_QUEUE
+import functions.database_utils as db_utils
+from functions import metrics
+
+_STOP = object()
+
+
+class QALogWriter:
+    def __init__(self, db_name=None, batch_size=None, flush_interval_ms=None, max_queue=None):
+        self.db_name = db_name or DB_NAME
+        self.batch_size = batch_size or QA_WRITER_BATCH_SIZE
+        self.flush_interval = (flush_interval_ms or QA_WRITER_FLUSH_INTERVAL_MS) / 1000
+        self.queue = queue.Queue(maxsize=max_queue or QA_WRITER_MAX_QUEUE)
+        self.dropped = 0
+        self.written = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="qa-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def submit(self, question, answer, logs, context=None, spans=None):
+        """Queues one QA row; returns False (and counts a drop) if the queue is full."""
+        self.start()
+        try:
+            self.queue.put_nowait({
+                "question": question,
+                "answer": answer,
+                "logs": logs,
+                "context": context,
+                "spans": spans,
+            })
+        except queue.Full:
+            self.dropped += 1
+            metrics.QA_WRITER_ROWS.inc(result="dropped")
+            logging.warning(f"QA writer queue full, dropped row for: {question[:80]}")
+            return False
+        metrics.QA_WRITER_QUEUE_DEPTH.set(self.queue.qsize())
+        return True
+
+    def stats(self):
+        return {"queue_depth": self.queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+    def close(self, timeout=10):
+        """Writes everything still queued, then stops the thread."""
+        with self._lock:
+            thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        thread.join(timeout)
+
+    def _next_batch(self):
+        """Blocks for the first row, then collects more until batch_size or the flush interval."""
+        batch = [self.queue.get()]
+        if batch[0] is _STOP:
+            return [], True
+        stop = False
+        deadline = time.monotonic() + self.flush_interval
+        try:
+            while len(batch) < self.batch_size:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+        except queue.Empty:
+            pass
+        return batch, stop
+
+    def _write(self, conn, batch):
+        with metrics.time_backend("sqlite", "save_qa_batch"):
+            ids = db_utils.save_qa_batch(conn, batch)
+        if ids:
+            self.written += len(ids)
+            metrics.QA_WRITER_ROWS.inc(len(ids), result="written")
+        else:
+            metrics.QA_WRITER_ROWS.inc(len(batch), result="failed")
+        metrics.QA_WRITER_QUEUE_DEPTH.set(self.queue.qsize())
+
+    def _run(self):
+        with db_utils.get_db_connection(self.db_name) as conn:
+            stop = False
+            while not stop:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._write(conn, batch)
+            # drain whatever arrived while stopping
+            rest = []
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    rest.append(item)
+            if rest:
+                self._write(conn, rest)
+
+
+qa_writer = QALogWriter()
@@ -2,23 +2,43 @@ import pickle
 import os
 import sys
 import re
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings, ChatOllama
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import numpy as np
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_community.retrievers import BM25Retriever
-from sentence_transformers import CrossEncoder
+from langchain_core.documents import Document
 # Ensure 'common' directory is in sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DATA_PATH, DB_PATH, EMBEDDING_MODEL_NAME, MODEL_NAME,COLLECTION_NAME,DB_NAME,SQL_MODEL   
+from config import DATA_PATH, DB_PATH, EMBEDDING_MODEL_NAME, MODEL_NAME,COLLECTION_NAME,DB_NAME,SQL_MODEL,PARSER,GEMINI_OUTPUT_DIMENSIONALITY,get_collection_name,get_summary_collection_name
+from config import RETRIEVAL_MODE,TWO_STAGE_CANDIDATES,TWO_STAGE_SECTIONS_PER_CANDIDATE,VECTOR_SEARCH_K
+from config import MMR_FETCH_K,MMR_LAMBDA,ADAPTIVE_K_MIN,ADAPTIVE_K_GAP_RATIO,FANOUT_TARGETS,FANOUT_MAX_WORKERS
+from config import DEADLINE_ANSWER_RESERVE_S,RERANKER_MODEL
 import functions.database_utils as db_utils
+from functions.embedding_utils import get_embedding_function
+from functions.llm_utils import get_chat_model
 from functions.gemini_utils import get_gemini_json_response,get_gemini_response
+from functions import tracing
+from functions import metrics
+from functions.hedging import hedged_call, has_keys
+from functions.circuit_breaker import pick_model
+from functions.deadline import timeout_of
 import json
+import logging
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
+logger = logging.getLogger('rag_logger')
 
 CHUNKS_FILE = os.path.join(DB_PATH, "chunks.pkl")
 
+# (collection, embedding model, dimensionality) -> Chroma handle, see get_vector_store
+_vector_stores = {}
+_vector_stores_lock = threading.Lock()
+# template string -> ChatPromptTemplate, see get_prompt
+_prompts = {}
+# the RERANKER_MODEL CrossEncoder once loaded, see get_reranker
+_reranker = None
+_reranker_lock = threading.Lock()
+
 PROMPT_TEMPLATE = """
 Answer the question based only on the following context.
 If the answer cannot be found, say "I cannot find this information in the provided resumes."
@@ -32,6 +52,15 @@ Question: {question}
 Answer:
 """
 
+def get_prompt(template):
+    """ChatPromptTemplate for a template string, parsed once per process."""
+    prompt = _prompts.get(template)
+    metrics.record_cache("prompt", prompt is not None)
+    if prompt is None:
+        # a concurrent first parse of the same template just builds an equal object
+        prompt = _prompts[template] = ChatPromptTemplate.from_template(template)
+    return prompt
+
 def load_bm25_chunks():
     """Lengths and loads chunks for BM25 retrieval."""
     if not os.path.exists(CHUNKS_FILE):
@@ -45,19 +74,13 @@ def get_bm25_results(chunks, query_text):
     """Retrieves documents using BM25."""
     if not chunks: 
         return []
+    # imported on first use, BM25 is not part of the /chat pipeline
+    from langchain_community.retrievers import BM25Retriever
     retriever = BM25Retriever.from_documents(chunks)
     retriever.k = 10
     return retriever.invoke(query_text)
 
-def get_vector_results(query_text,section_list=[],chunk_ids=[], embedding_model_name=None,context=""):
-    target_embedding_model = embedding_model_name or EMBEDDING_MODEL_NAME
-    if "gemini" in target_embedding_model:
-        return get_vector_results_gemini(query_text,section_list,chunk_ids, embedding_model_name=target_embedding_model)
-
-    """Retrieves documents using vector similarity."""
-    embeddings = OllamaEmbeddings(model=target_embedding_model)
-    # use NER to get the section
-    db = Chroma(persist_directory=DB_PATH, embedding_function=embeddings, collection_name=COLLECTION_NAME)
+def build_section_filter(section_list):
     lst=[{"section": x} for x in section_list]
     filter=None
     if len(section_list)==1:
@@ -66,45 +89,291 @@ def get_vector_results(query_text,section_list=[],chunk_ids=[], embedding_model_
         filter={
             "$or": lst
         }
+    return filter
+
+def get_vector_store(collection_name, embedding_model_name=None, output_dimensionality=None, **kwargs):
+    """
+    Chroma handle for a collection, opened once per process and reused by later requests.
+    kwargs (e.g. create_collection_if_not_exists) only apply when the handle is first opened.
+    Handles hold SQLite connections, so they are never shared across fork(): a server
+    worker (server/gunicorn.conf.py) starts with an empty cache and opens its own.
+    """
+    key = (collection_name, embedding_model_name, output_dimensionality)
+    with _vector_stores_lock:
+        db = _vector_stores.get(key)
+        metrics.record_cache("vector_store", db is not None)
+        if db is None:
+            embeddings = get_embedding_function(embedding_model_name, output_dimensionality=output_dimensionality) if embedding_model_name else None
+            # imported on first use: chromadb takes a good part of a second to import
+            from langchain_chroma import Chroma
+            db = Chroma(persist_directory=DB_PATH, embedding_function=embeddings, collection_name=collection_name, **kwargs)
+            _vector_stores[key] = db
+        return db
+
+os.register_at_fork(after_in_child=_vector_stores.clear)
+
+def get_vector_results(query_text,section_list=[],chunk_ids=[], embedding_model_name=None,context="",collection_name=None,output_dimensionality=None,retrieval_mode=None,deadline=None,query_vector=None):
+    """
+    Retrieves documents using vector similarity. Low on budget (deadline), the slower modes fall back to plain vector search.
+    query_vector: query_text's embedding if already computed (e.g. embedded with the rest of a /chat/batch)
+    """
+    target_embedding_model = embedding_model_name or EMBEDDING_MODEL_NAME
+    target_dimensionality = output_dimensionality or GEMINI_OUTPUT_DIMENSIONALITY
+    target_collection = collection_name or get_collection_name(PARSER, target_embedding_model, target_dimensionality)
+    target_mode = retrieval_mode or RETRIEVAL_MODE
+    if target_mode!="vector" and deadline is not None and not deadline.allows(DEADLINE_ANSWER_RESERVE_S):
+        print(f"Low on time budget ({deadline.remaining():.1f}s left), using vector search instead of {target_mode}")
+        tracing.set_attribute("degraded", f"{target_mode}->vector")
+        target_mode="vector"
+    with tracing.span("open_collection", backend="chroma", collection=target_collection):
+        # the query is embedded with a client bounded by the deadline; the cached handle's own client is not used for it
+        embeddings = get_embedding_function(target_embedding_model, output_dimensionality=target_dimensionality, timeout=timeout_of(deadline))
+        # use NER to get the section
+        db = get_vector_store(target_collection, target_embedding_model, target_dimensionality)
+    filter=build_section_filter(section_list)
     
     results = []
     if(len(chunk_ids)>0):
-        return db.get_by_ids(chunk_ids)
-    else:
-        results=db.similarity_search_with_score(
-            query_text,
-            k=10,
+        with tracing.span("vector_search", backend="chroma", collection=target_collection, mode="by_id"):
+            return db.get_by_ids(chunk_ids)
+    if target_mode=="fanout":
+        return get_fanout_results(query_text,section_list,output_dimensionality=target_dimensionality)
+    if query_vector is None:
+        with tracing.span("embed", model=target_embedding_model):
+            query_vector=embeddings.embed_query(query_text)
+    with tracing.span("vector_search", backend="chroma", collection=target_collection, mode=target_mode):
+        if target_mode=="two_stage":
+            docs=get_two_stage_results(query_text,db,embeddings,target_collection,section_list,query_vector=query_vector)
+            if docs is not None:
+                return docs
+            print(f"Summary collection for '{target_collection}' is empty. Falling back to vector search.")
+        if target_mode=="mmr":
+            return get_mmr_results(query_text,db,embeddings,filter,query_vector=query_vector)
+        results=db.similarity_search_by_vector_with_relevance_scores(
+            query_vector,
+            k=VECTOR_SEARCH_K,
             filter=filter
-        )  
-    return [doc for doc, score in results]
+        )
+        return [doc for doc, score in results]
+
+def cosine_scores(query_vector, vectors):
+    """Cosine similarity of one query vector against a matrix of vectors."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    query = np.asarray(query_vector, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+    norms[norms == 0] = 1.0
+    return (matrix @ query) / norms
+
+def get_two_stage_results(query_text, db, embeddings, collection_name, section_list=[],
+                          top_candidates=None, sections_per_candidate=None, k=None, query_vector=None):
+    """
+    Candidate-then-section retrieval.
+    Stage 1 picks the top candidates by their summary vector, stage 2 scores only
+    those candidates' section vectors in one matrix product and keeps the best
+    sections per candidate, so one verbose CV can't fill the whole result list.
+    Returns None when the summary collection has not been built.
+    """
+    top_candidates = top_candidates or TWO_STAGE_CANDIDATES
+    sections_per_candidate = sections_per_candidate or TWO_STAGE_SECTIONS_PER_CANDIDATE
+    k = k or VECTOR_SEARCH_K
+
+    summary_db = get_vector_store(
+        get_summary_collection_name(collection_name),
+        collection_metadata={"hnsw:space": "cosine"}
+    )
+    summary_count = summary_db._collection.count()
+    if summary_count == 0:
+        return None
+
+    if query_vector is None:
+        query_vector = embeddings.embed_query(query_text)
+    # Stage 1: coarse candidate selection
+    coarse = summary_db._collection.query(
+        query_embeddings=[query_vector],
+        n_results=min(top_candidates, summary_count),
+        include=["metadatas"]
+    )
+    emails = [metadata["email"] for metadata in coarse["metadatas"][0]]
+    if not emails:
+        return []
+
+    # Stage 2: section scoring restricted to those candidates
+    email_filter = {"email": {"$in": emails}}
+    section_filter = build_section_filter(section_list)
+    where = {"$and": [email_filter, section_filter]} if section_filter else email_filter
+    stored = db.get(where=where, include=["embeddings", "documents", "metadatas"])
+    if len(stored["ids"]) == 0:
+        return []
 
-def get_vector_results_gemini(query_text,section_list=[],chunk_ids=[], embedding_model_name=None):
+    scores = cosine_scores(query_vector, stored["embeddings"])
+    per_candidate = {}
+    selected = []
+    for index in np.argsort(-scores):
+        email = stored["metadatas"][index].get("email", "Unknown")
+        if per_candidate.get(email, 0) >= sections_per_candidate:
+            continue
+        per_candidate[email] = per_candidate.get(email, 0) + 1
+        selected.append(Document(
+            id=stored["ids"][index],
+            page_content=stored["documents"][index],
+            metadata=stored["metadatas"][index]
+        ))
+        if len(selected) >= k:
+            break
+    return selected
+
+def adaptive_k(scores, min_k=None, max_k=None, gap_ratio=None):
+    """
+    Picks how many results to keep from relevance scores sorted high to low.
+    The list is cut at the largest drop between positions min_k and max_k, if
+    that drop is at least gap_ratio of the total score spread; otherwise max_k.
+    """
+    min_k = min_k or ADAPTIVE_K_MIN
+    max_k = max_k or VECTOR_SEARCH_K
+    gap_ratio = ADAPTIVE_K_GAP_RATIO if gap_ratio is None else gap_ratio
+    scores = np.asarray(scores, dtype=np.float32)
+    if len(scores) <= min_k:
+        return len(scores)
+    max_k = min(max_k, len(scores))
+    spread = float(scores[0] - scores[-1])
+    if spread <= 0:
+        return max_k
+    # gaps[i] is the drop between result i and i+1, so cutting there keeps i+1 results
+    gaps = scores[:-1] - scores[1:]
+    window = gaps[min_k - 1:max_k - 1] if max_k > min_k else gaps[:0]
+    if len(window) == 0:
+        return max_k
+    best = int(np.argmax(window))
+    if window[best] >= gap_ratio * spread:
+        return min_k + best
+    return max_k
+
+def mmr_select(query_vector, vectors, k, lambda_mult=None):
+    """
+    Maximal marginal relevance over a candidate matrix.
+    The pairwise similarity matrix is computed once; each step only updates the
+    running max-similarity-to-selected vector. Returns selected row indexes.
+    """
+    lambda_mult = MMR_LAMBDA if lambda_mult is None else lambda_mult
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if len(matrix) == 0 or k <= 0:
+        return []
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    relevance = matrix @ query
+    similarity = matrix @ matrix.T
+    max_similarity = np.full(len(matrix), -np.inf, dtype=np.float32)
+    available = np.ones(len(matrix), dtype=bool)
+    selected = []
+    for _ in range(min(k, len(matrix))):
+        redundancy = np.where(np.isinf(max_similarity), 0.0, max_similarity)
+        mmr_scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        mmr_scores[~available] = -np.inf
+        index = int(np.argmax(mmr_scores))
+        selected.append(index)
+        available[index] = False
+        max_similarity = np.maximum(max_similarity, similarity[:, index])
+    return selected
+
+def get_mmr_results(query_text, db, embeddings, filter=None, fetch_k=None, lambda_mult=None, query_vector=None):
+    """Fetches fetch_k candidates with their vectors, sizes k from score gaps, then diversifies with MMR."""
+    fetch_k = fetch_k or MMR_FETCH_K
+    if query_vector is None:
+        query_vector = embeddings.embed_query(query_text)
+    fetched = db._collection.query(
+        query_embeddings=[query_vector],
+        n_results=fetch_k,
+        where=filter,
+        include=["embeddings", "documents", "metadatas"]
+    )
+    ids = fetched["ids"][0]
+    if not ids:
+        return []
+    vectors = np.asarray(fetched["embeddings"][0], dtype=np.float32)
+    relevance = cosine_scores(query_vector, vectors)
+    k = adaptive_k(np.sort(relevance)[::-1])
+    selected = mmr_select(query_vector, vectors, k, lambda_mult)
+    print(f"MMR kept {len(selected)} of {len(ids)} candidates")
+    return [
+        Document(id=ids[i], page_content=fetched["documents"][0][i], metadata=fetched["metadatas"][0][i])
+        for i in selected
+    ]
+
+def search_collection(query_text, parser, embedding_model_name, filter=None, k=None, output_dimensionality=None):
+    """Top-k of one parser x embedding collection as (doc, score) with scores min-max normalized to [0, 1], 1 being closest."""
+    k = k or VECTOR_SEARCH_K
+    collection_name = get_collection_name(parser, embedding_model_name, output_dimensionality)
+    db = get_vector_store(collection_name, embedding_model_name, output_dimensionality, create_collection_if_not_exists=False)
+    embeddings = db.embeddings
+    with tracing.span("embed", model=embedding_model_name):
+        query_vector = embeddings.embed_query(query_text)
+    with tracing.span("vector_search", backend="chroma", collection=collection_name, mode="fanout"):
+        results = db.similarity_search_by_vector_with_relevance_scores(query_vector, k=k, filter=filter)
+    if not results:
+        return []
+    # raw distances (lower is closer); their scale depends on the embedding model
+    distances = np.asarray([distance for _, distance in results], dtype=np.float32)
+    spread = float(distances.max() - distances.min())
+    normalized = (distances.max() - distances) / spread if spread > 0 else np.ones_like(distances)
+    for (doc, _), score in zip(results, normalized):
+        doc.metadata["collection"] = collection_name
+    return [(doc, float(score)) for (doc, _), score in zip(results, normalized)]
+
+def get_fanout_results(query_text, section_list=[], targets=None, k=None, output_dimensionality=None):
+    """
+    Queries several collections (one per parser x embedding model) in parallel threads.
+    Scores are normalized per collection before merging so different embedding
+    models are comparable; the same candidate section found in several
+    collections is kept once with its best score.
+    A failed collection is left out of the merge; if every collection failed, the
+    first error is raised.
+    """
+    targets = targets or FANOUT_TARGETS
+    k = k or VECTOR_SEARCH_K
+    filter = build_section_filter(section_list)
+
+    def search(target):
+        parser, embedding_model_name = target
+        dims = output_dimensionality if "gemini" in embedding_model_name else None
+        # a failure marks this span (and rag_stage_errors_total{stage="fanout_target"})
+        with tracing.span("fanout_target", parser=parser, embedding_model=embedding_model_name):
+            return search_collection(query_text, parser, embedding_model_name, filter, k, dims)
+
+    with ThreadPoolExecutor(max_workers=min(FANOUT_MAX_WORKERS, len(targets))) as executor:
+        # bind: worker threads don't inherit the request's tracing context
+        futures = [executor.submit(tracing.bind(search), target) for target in targets]
+
+    per_collection = []
+    errors = []
+    for (parser, embedding_model_name), future in zip(targets, futures):
+        if future.exception() is None:
+            per_collection.append(future.result())
+        else:
+            logger.warning(f"Fan-out search failed for {parser}/{embedding_model_name}: {future.exception()}")
+            errors.append(future.exception())
+    if errors:
+        tracing.set_attribute("fanout_failed", len(errors))
+        if len(errors) == len(targets):
+            # nothing left to answer from: an error, not "No relevant documents found."
+            raise errors[0]
+
+    best = {}
+    for results in per_collection:
+        for doc, score in results:
+            key = (doc.metadata.get("email", doc.id), doc.metadata.get("section", doc.id))
+            if key not in best or score > best[key][1]:
+                best[key] = (doc, score)
+    merged = sorted(best.values(), key=lambda x: x[1], reverse=True)
+    return [doc for doc, _ in merged[:k]]
+
+def get_vector_results_gemini(query_text,section_list=[],chunk_ids=[], embedding_model_name=None,collection_name=None,output_dimensionality=None):
     """Retrieves documents using Gemini vector similarity."""
     target_embedding_model = embedding_model_name or EMBEDDING_MODEL_NAME
-    # embeddings = OllamaEmbeddings(model=target_embedding_model)
-    api_key = os.getenv("GEMINI_KEY")
-    embeddings = GoogleGenerativeAIEmbeddings(model=target_embedding_model, google_api_key=api_key)
-    # use NER to get the section
-    db = Chroma(persist_directory=DB_PATH, embedding_function=embeddings, collection_name=COLLECTION_NAME)
-    lst=[{"section": x} for x in section_list]
-    filter=None
-    if len(section_list)==1:
-        filter=lst[0]
-    elif len(section_list)>1:
-        filter={
-            "$or": lst
-        }
-    
-    results = []
-    if(len(chunk_ids)>0):
-        return db.get_by_ids(chunk_ids)
-    else:
-        results=db.similarity_search_with_score(
-            query_text,
-            k=10,
-            filter=filter
-        )  
-    return [doc for doc, score in results]
+    return get_vector_results(query_text,section_list,chunk_ids, embedding_model_name=target_embedding_model,collection_name=collection_name,output_dimensionality=output_dimensionality)
 
 
 def merge_and_deduplicate(bm25_docs, vector_docs):
@@ -118,18 +387,29 @@ def merge_and_deduplicate(bm25_docs, vector_docs):
             merged.append(doc)
     return merged
 
-def rerank_documents(query_text, docs):
-    """Reranks documents using CrossEncoder."""
+def get_reranker():
+    """The RERANKER_MODEL CrossEncoder, loaded once per process (or once in the server's parent before forking)."""
+    global _reranker
+    with _reranker_lock:
+        metrics.record_cache("reranker", _reranker is not None)
+        if _reranker is None:
+            # imported on first use: sentence_transformers imports torch
+            from sentence_transformers import CrossEncoder
+            _reranker = CrossEncoder(RERANKER_MODEL)
+        return _reranker
+
+def rerank_documents(query_text, docs, reranker=None, top_n=5):
+    """Reranks documents using CrossEncoder (or any object with a compatible predict(pairs))."""
     if not docs:
         return []
         
-    reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L6-v2')
+    reranker = reranker or get_reranker()
     pairs = [[query_text, doc.page_content] for doc in docs]
     scores = reranker.predict(pairs)
     
-    # Sort and take top 5
+    # Sort and take top_n
     ranked = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
-    return [doc for doc, _ in ranked[:5]]
+    return [doc for doc, _ in ranked[:top_n]]
 
 def merge_same_source(docs):
     """Merges documents with the same source."""
@@ -152,9 +432,9 @@ def get_genearl_context():
     return f"\n\nToday's date is {todays_date} in dd-mm-yyyy format \n\n"
 
 
-def generate_answer(query_text, context_docs,section_list, model_name=None,context=""):
+def generate_answer(query_text, context_docs,section_list, model_name=None,context="",deadline=None):
     """Generates answer using LLM."""
-    target_model_name = model_name or MODEL_NAME
+    target_model_name = pick_model(model_name or MODEL_NAME)
     context_index_dict={
         0:[]
     }
@@ -205,13 +485,13 @@ def generate_answer(query_text, context_docs,section_list, model_name=None,conte
     context_text += json.dumps(result, indent=4)
    
     if target_model_name=="gemini":
-        content=get_data_using_gemini(query_text,PROMPT_TEMPLATE,context_text,is_json=False)
+        content=get_data_using_gemini(query_text,PROMPT_TEMPLATE,context_text,is_json=False,deadline=deadline)
         return  content,context_text
-    template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+    template = get_prompt(PROMPT_TEMPLATE)
     prompt = template.format(context=context_text, question=query_text)
     
     print(f"\nGenerating answer using {target_model_name}...\n")
-    model = ChatOllama(model=target_model_name)
+    model = get_chat_model(target_model_name, timeout=timeout_of(deadline))
     response = model.invoke(prompt)
     content=response.content
      #  write to a log file
@@ -223,9 +503,7 @@ def generate_answer(query_text, context_docs,section_list, model_name=None,conte
     return content,context_text
 
 
-def get_section_using_llm(question, model_name=None):
-    target_model_name = model_name or MODEL_NAME
-    TEMPLATE = """
+SECTION_TEMPLATE = """
     You are an expert CV analyzer.
 
     Your task is to determine which CV section(s) are most relevant to answer a given user question.
@@ -261,25 +539,29 @@ def get_section_using_llm(question, model_name=None):
 
     before answering check this question do this question needs sections skills,experience,interest,projects,education,general information.
     """
-    if target_model_name=="gemini":
-        res_dict=get_data_using_gemini(question,TEMPLATE,"")
-        return  res_dict
-    prompt = ChatPromptTemplate.from_template(TEMPLATE)
-    model = ChatOllama(model=target_model_name, format="json")
-    chain = prompt | model
-    response = chain.invoke({"question": question})
-    content = response.content
-    cleaned_content = content.strip()
-    try:
-        json_data = json.loads(cleaned_content)
-        print(json_data)
-        return json_data
-    except json.JSONDecodeError as e:
-        print(f"Failed to decode JSON {e}")
-        return None
 
-def get_sql_using_llm(question,schema_text):
-    TEMPLATE = """
+def get_section_using_llm(question, model_name=None, deadline=None):
+    target_model_name = pick_model(model_name or MODEL_NAME)
+    def ask(model_name):
+        if model_name=="gemini":
+            res_dict=get_data_using_gemini(question,SECTION_TEMPLATE,"",deadline=deadline)
+            return  res_dict
+        prompt = get_prompt(SECTION_TEMPLATE)
+        model = get_chat_model(model_name, format="json", timeout=timeout_of(deadline))
+        chain = prompt | model
+        response = chain.invoke({"question": question})
+        content = response.content
+        cleaned_content = content.strip()
+        try:
+            json_data = json.loads(cleaned_content)
+            print(json_data)
+            return json_data
+        except json.JSONDecodeError as e:
+            print(f"Failed to decode JSON {e}")
+            return None
+    return hedged_call("section", ask, target_model_name, has_keys("sections"))
+
+SQL_TEMPLATE = """
     You are a Text-to-SQL assistant.
     Do NOT hallucinate or invent new tables or columns or try to answer if the question is not clear or not applicable to this context.
 
@@ -313,13 +595,16 @@ def get_sql_using_llm(question,schema_text):
     "format_result":"This data will have the name and email of the user who has worked at abc"
     }}
     """
-    if SQL_MODEL=="gemini":
-        res_dict=get_data_using_gemini(question,TEMPLATE,schema_text)
+
+def get_sql_using_llm(question,schema_text,deadline=None):
+    sql_model = pick_model(SQL_MODEL)
+    if sql_model=="gemini":
+        res_dict=get_data_using_gemini(question,SQL_TEMPLATE,schema_text,deadline=deadline)
         return  res_dict
-    prompt = ChatPromptTemplate.from_template(TEMPLATE)
-    model = ChatOllama(model=SQL_MODEL, format="json")
+    prompt = get_prompt(SQL_TEMPLATE)
+    model = get_chat_model(sql_model, format="json", timeout=timeout_of(deadline))
     chain = prompt | model
-    response = chain.invoke({"question": question,"schema_text":schema_text})
+    response = chain.invoke({"question": question,"context":schema_text})
     content = response.content
     cleaned_content = content.strip()
     try:
@@ -329,13 +614,13 @@ def get_sql_using_llm(question,schema_text):
     except json.JSONDecodeError as e:
         print(f"Failed to decode JSON {e}")
 
-def get_data_using_llm(question,TEMPLATE,context="", model_name=None):
-    target_model_name = model_name or MODEL_NAME
+def get_data_using_llm(question,TEMPLATE,context="", model_name=None, deadline=None):
+    target_model_name = pick_model(model_name or MODEL_NAME)
     if target_model_name=="gemini":
-        data=get_data_using_gemini(question,TEMPLATE,context)
+        data=get_data_using_gemini(question,TEMPLATE,context,deadline=deadline)
         return data
-    prompt = ChatPromptTemplate.from_template(TEMPLATE)
-    model = ChatOllama(model=target_model_name, format="json",temperature=0.0)
+    prompt = get_prompt(TEMPLATE)
+    model = get_chat_model(target_model_name, format="json",temperature=0.0, timeout=timeout_of(deadline))
     chain = prompt | model
     response = chain.invoke({"question": question,"context":context})
     content = response.content
@@ -350,9 +635,10 @@ def get_data_using_llm(question,TEMPLATE,context="", model_name=None):
 
 def get_data_using_gemini(question,TEMPLATE,context="",**args):
     is_json=args.get("is_json",True)
-    prompt = ChatPromptTemplate.from_template(TEMPLATE)
+    timeout=timeout_of(args.get("deadline"))
+    prompt = get_prompt(TEMPLATE)
     formatted_prompt = prompt.format(question=question,context=context)
-    content = get_gemini_json_response(formatted_prompt) if is_json else get_gemini_response(formatted_prompt)
+    content = get_gemini_json_response(formatted_prompt, timeout=timeout) if is_json else get_gemini_response(formatted_prompt, timeout=timeout)
     
     if not content:
         return None
@@ -369,9 +655,7 @@ def get_data_using_gemini(question,TEMPLATE,context="",**args):
         return None
 
 
-def polish_question(question, model_name=None):
-    target_model_name = model_name or MODEL_NAME
-    TEMPLATE="""
+POLISH_TEMPLATE = """
     ## context:
     - skills : programming languages, tools, technologies
     - experience : worked at, employed, job history
@@ -463,7 +747,12 @@ def polish_question(question, model_name=None):
     ##input question:
     {question}
     """
-    question_dict=get_data_using_llm(question,TEMPLATE,"", model_name=target_model_name)
+
+def polish_question(question, model_name=None, deadline=None):
+    target_model_name = model_name or MODEL_NAME
+    question_dict=hedged_call("polish",
+                              lambda model: get_data_using_llm(question,POLISH_TEMPLATE,"", model_name=model, deadline=deadline),
+                              target_model_name, has_keys("polished_question","names","emails"))
     names=question_dict["names"]
     emails=question_dict["emails"]
     polished_question=question_dict["polished_question"]
@@ -503,8 +792,7 @@ def polish_question(question, model_name=None):
     return question_dict
 
 
-def check_need_more_context_needed(question,context):
-    TEMPLATE = """
+NEED_MORE_CONTEXT_TEMPLATE = """
     You are a question analyzer.
     Your task is to determine if the question needs more context to be answered.
     ##context:
@@ -520,7 +808,11 @@ def check_need_more_context_needed(question,context):
     "need_more_context": "True | False"
     }}
     """
-    question_dict=get_data_using_llm(question,TEMPLATE,context, model_name=MODEL_NAME)
+
+def check_need_more_context_needed(question,context,deadline=None):
+    question_dict=hedged_call("need_more_context",
+                              lambda model: get_data_using_llm(question,NEED_MORE_CONTEXT_TEMPLATE,context, model_name=model, deadline=deadline),
+                              MODEL_NAME, has_keys("need_more_context"))
     return question_dict
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+"""
+Single-flight deduplication of identical concurrent questions.
+
+The first request for a key runs the pipeline; identical requests that arrive
+while it is still running wait for it and get the same result (or the same
+exception) instead of running the LLM calls again. Nothing is kept once the call
+returns, so this is not a cache: a question asked again later runs again.
+
+Import as `functions.single_flight` (see functions/tracing.py for why).
+"""
+import threading
+from functions import metrics
+from functions import tracing
+
+
+def question_key(question, *parts):
+    """Case and whitespace-insensitive question plus the options that change the answer."""
+    normalized = " ".join((question or "").lower().split()).rstrip("?!. ")
+    return (normalized,) + tuple("" if part is None else str(part) for part in parts)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name, logger=None):
+        """
+        :param name: label of the cache metric (rag_cache_requests_total{cache=name})
+        :param logger: where followers note that they joined a running call (optional)
+        """
+        self.name = name
+        self.logger = logger
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, max_wait_s=None, **kwargs):
+        """
+        Runs fn(*args, **kwargs) unless a call with the same key is in flight.
+        :param max_wait_s: a follower waits at most this long for the running call, then runs
+            fn itself (with a request budget as max_wait_s, that run finds the budget spent and
+            degrades at once)
+        :return: (result, shared), shared is True when the result came from another request's call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        metrics.record_cache(self.name, hit=not leader)
+
+        if not leader:
+            if self.logger:
+                self.logger.info("Identical question already in progress, waiting for its answer")
+            with tracing.span("single_flight_wait") as wait_span:
+                finished = call.done.wait(max_wait_s)
+                wait_span["attributes"]["gave_up"] = not finished
+            if not finished:
+                if self.logger:
+                    self.logger.warning(f"Identical question still in progress after {max_wait_s:.1f}s, answering without it")
+                return fn(*args, **kwargs), False
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            tracing.set_attribute("single_flight_waiters", call.waiters)
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,78 @@
+"""
+Compressed storage for the large TEXT columns of the QA log (questions.context and
+logs.log_entry).
+
+Compressed values are BLOBs starting with a 4-byte tag (QZS1 = zstd, QZL1 = zlib).
+Plain str values, from rows written before compression or short texts, are
+returned by decode_text unchanged, so reads work on old and new rows alike.
+"""
+import os
+import sys
+import zlib
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import QA_COMPRESSION, QA_COMPRESSION_MIN_CHARS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_TAG = b"QZS1"
+ZLIB_TAG = b"QZL1"
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+
+def resolve_codec(codec=None):
+    """The codec actually used: zstd falls back to zlib when zstandard is not installed."""
+    codec = codec or QA_COMPRESSION
+    if codec == "zstd" and zstandard is None:
+        return "zlib"
+    return codec
+
+
+def keep_head(text, max_chars):
+    """Keeps the first max_chars characters and notes how many were cut."""
+    if max_chars and len(text) > max_chars:
+        return text[:max_chars] + f"\n... [truncated {len(text) - max_chars} chars]"
+    return text
+
+
+def keep_tail(text, max_chars):
+    """Keeps the last max_chars characters and notes how many were cut (like log_capture's buffer)."""
+    if max_chars and len(text) > max_chars:
+        return f"[{len(text) - max_chars} earlier chars dropped]\n" + text[-max_chars:]
+    return text
+
+
+def encode_text(text, max_chars=None, codec=None, keep="head"):
+    """
+    Value to store for text: truncated to max_chars, then compressed unless it is short.
+    :param keep: "head" keeps the start (context: the best-ranked documents come first),
+                 "tail" keeps the end (logs: the latest lines, errors included)
+    :return: str (stored as TEXT) or bytes (stored as BLOB); None stays None
+    """
+    if text is None:
+        return None
+    text = (keep_tail if keep == "tail" else keep_head)(str(text), max_chars)
+    codec = resolve_codec(codec)
+    if codec == "none" or len(text) < QA_COMPRESSION_MIN_CHARS:
+        return text
+    data = text.encode("utf-8")
+    if codec == "zstd":
+        return ZSTD_TAG + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return ZLIB_TAG + zlib.compress(data, ZLIB_LEVEL)
+
+
+def decode_text(value):
+    """Inverse of encode_text; plain TEXT values pass through."""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value.startswith(ZSTD_TAG):
+        if zstandard is None:
+            raise ImportError("zstandard is not installed. Please install it with `pip install zstandard` to read zstd-compressed rows.")
+        return zstandard.ZstdDecompressor().decompress(value[len(ZSTD_TAG):]).decode("utf-8")
+    if value.startswith(ZLIB_TAG):
+        return zlib.decompress(value[len(ZLIB_TAG):]).decode("utf-8")
+    return value.decode("utf-8", errors="replace")
@@ -0,0 +1,171 @@
+"""
+Per-question timing spans.
+
+A trace is opened once per question (server/app.py) and every pipeline stage runs
+inside `span(name)`. Spans nest through a contextvar, so a helper deep in
+query_utils attaches to whichever stage called it, and the LLM helpers add the
+model name and token counts to the innermost open span. Without an open trace
+`span` does nothing, so CLI scripts and ingestion are unaffected. Finished spans
+and LLM calls are also fed into functions/metrics.py.
+
+Always import this module as `functions.tracing` so every caller shares one
+contextvar, whether it was itself imported as `functions.*` or `common.functions.*`.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from functions import metrics
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+_current_span = contextvars.ContextVar("rag_span", default=None)
+
+
+class Trace:
+    """Flat list of span records for one question; parent_id links the tree."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            record["span_id"] = len(self.spans) + 1
+            self.spans.append(record)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+
+@contextmanager
+def start_trace(name="request"):
+    """Opens a trace for the current context and yields it; the root span named `name` times the whole request."""
+    trace = Trace(name)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        with span(name):
+            yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, model=None, **attributes):
+    """
+    Times the enclosed block as a child of the innermost open span.
+    Yields the span record so callers can add attributes; exceptions mark
+    the span as failed and are re-raised.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield {"attributes": {}}
+        return
+
+    parent = _current_span.get()
+    record = {
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "start_ms": round(trace.elapsed_ms(), 3),
+        "duration_ms": None,
+        "status": "ok",
+        "model": model,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "llm_calls": 0,
+        "attributes": dict(attributes),
+    }
+    trace.add(record)
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["status"] = "error"
+        record["attributes"]["error"] = str(e)[:200]
+        raise
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        _current_span.reset(token)
+        metrics.observe_span(record)
+
+
+def set_attribute(key, value):
+    """Adds an attribute to the innermost open span, if any."""
+    record = _current_span.get()
+    if record is not None:
+        record["attributes"][key] = value
+
+
+def record_llm_usage(model, input_tokens=0, output_tokens=0):
+    """Adds one LLM call's token counts to the innermost open span and the per-model metrics."""
+    metrics.record_llm_call(model, input_tokens, output_tokens)
+    record = _current_span.get()
+    if record is None:
+        return
+    if not record["model"]:
+        record["model"] = model
+    elif model and model not in record["model"].split(","):
+        record["model"] += "," + model
+    record["input_tokens"] += input_tokens or 0
+    record["output_tokens"] += output_tokens or 0
+    record["llm_calls"] += 1
+
+
+def bind(fn):
+    """
+    Wraps fn so it runs in a copy of the caller's context.
+    Executor threads do not inherit contextvars; submit bind(fn) instead of fn
+    and spans opened in the worker attach to the caller's current span.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize_spans(spans):
+    """
+    Aggregates span rows (as returned by database_utils.get_spans) per stage name.
+    :return: list of dicts with count, error count, latency percentiles and mean token counts
+    """
+    by_name = {}
+    for record in spans:
+        by_name.setdefault(record["name"], []).append(record)
+
+    report = []
+    for name, records in by_name.items():
+        durations = [r["duration_ms"] for r in records if r["duration_ms"] is not None]
+        models = sorted({m for r in records if r.get("model") for m in r["model"].split(",")})
+        report.append({
+            "stage": name,
+            "count": len(records),
+            "errors": sum(1 for r in records if r.get("status") == "error"),
+            "p50_ms": round(percentile(durations, 50), 1),
+            "p90_ms": round(percentile(durations, 90), 1),
+            "p95_ms": round(percentile(durations, 95), 1),
+            "p99_ms": round(percentile(durations, 99), 1),
+            "mean_ms": round(sum(durations) / len(durations), 1) if durations else 0.0,
+            "mean_input_tokens": round(sum(r.get("input_tokens") or 0 for r in records) / len(records), 1),
+            "mean_output_tokens": round(sum(r.get("output_tokens") or 0 for r in records) / len(records), 1),
+            "models": ",".join(models),
+        })
+    report.sort(key=lambda row: row["p95_ms"], reverse=True)
+    return report
@@ -0,0 +1,120 @@
+"""
+Startup warm-up.
+
+The first /chat after a restart pays for Ollama loading the chat and embedding
+models, Chroma loading the collection's HNSW index and the prompt templates being
+parsed. `warmup.start()` does all of that once, in a background thread, when a server
+process starts (server/app.py, or post_fork of each worker in server/gunicorn.conf.py),
+and GET /ready answers 503 until it has finished. What is warmed comes from the
+WARMUP_* settings in config.py.
+
+A failed step is logged and listed by /ready but does not hold readiness back: the
+request path has its own timeouts and circuit breakers.
+
+Import as `functions.warmup` (see functions/tracing.py for why).
+"""
+import os
+import sys
+import time
+import logging
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (WARMUP_ENABLED, WARMUP_CHAT_MODELS, WARMUP_EMBEDDING_MODELS, WARMUP_COLLECTIONS, WARMUP_TIMEOUT_S,
+                    GEMINI_OUTPUT_DIMENSIONALITY, get_collection_name)
+from functions import metrics
+from functions.llm_utils import get_chat_model
+from functions.embedding_utils import get_embedding_function
+from functions.query_utils import (get_prompt, get_vector_store, PROMPT_TEMPLATE, SECTION_TEMPLATE, SQL_TEMPLATE,
+                                   POLISH_TEMPLATE, NEED_MORE_CONTEXT_TEMPLATE)
+
+logger = logging.getLogger('rag_logger')
+
+PROMPT_TEMPLATES = [PROMPT_TEMPLATE, SECTION_TEMPLATE, SQL_TEMPLATE, POLISH_TEMPLATE, NEED_MORE_CONTEXT_TEMPLATE]
+WARMUP_TEXT = "warm-up"
+
+
+class WarmUp:
+    def __init__(self, enabled=None):
+        self.enabled = WARMUP_ENABLED if enabled is None else enabled
+        self.state = "pending" if self.enabled else "disabled"
+        self.steps = []
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Runs the warm-up in a background thread (once per process)."""
+        with self._lock:
+            if self._thread is None and self.enabled:
+                self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+                self._thread.start()
+
+    def ready(self):
+        return self.state in ("done", "disabled")
+
+    def _step(self, name, fn, *args):
+        """Runs one step; returns its result, None if it failed."""
+        start = time.perf_counter()
+        result = error = None
+        try:
+            result = fn(*args)
+        except Exception as e:
+            error = str(e)
+            logger.warning(f"Warm-up step {name} failed: {e}")
+        seconds = time.perf_counter() - start
+        metrics.WARMUP_STEP_SECONDS.set(seconds, step=name)
+        self.steps.append({"step": name, "seconds": round(seconds, 3), "ok": error is None, "error": error})
+        return result
+
+    def run(self):
+        self.state = "running"
+        self.started_at = time.time()
+        self._step("prompts", compile_prompts)
+        vectors = {}
+        for model in WARMUP_EMBEDDING_MODELS:
+            vectors[model] = self._step(f"embed:{model}", warm_embedding, model)
+        for model in WARMUP_CHAT_MODELS:
+            self._step(f"chat:{model}", warm_chat, model)
+        for parser, model in WARMUP_COLLECTIONS:
+            self._step(f"collection:{get_collection_name(parser, model, GEMINI_OUTPUT_DIMENSIONALITY)}",
+                       warm_collection, parser, model, vectors.get(model))
+        self.finished_at = time.time()
+        self.state = "done"
+        failed = [step["step"] for step in self.steps if not step["ok"]]
+        logger.info(f"Warm-up finished in {self.finished_at - self.started_at:.1f}s" + (f", failed: {failed}" if failed else ""))
+
+    def status(self):
+        return {
+            "ready": self.ready(),
+            "state": self.state,
+            "seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else 0.0,
+            "steps": list(self.steps),
+        }
+
+
+def compile_prompts():
+    for template in PROMPT_TEMPLATES:
+        get_prompt(template)
+
+
+def warm_embedding(model):
+    """One embedding call, so Ollama loads the model (kept for OLLAMA_KEEP_ALIVE_S); returns the vector."""
+    return get_embedding_function(model, output_dimensionality=GEMINI_OUTPUT_DIMENSIONALITY, timeout=WARMUP_TIMEOUT_S).embed_query(WARMUP_TEXT)
+
+
+def warm_chat(model):
+    """A one-token chat call, so Ollama loads the model (kept for OLLAMA_KEEP_ALIVE_S)."""
+    get_chat_model(model, timeout=WARMUP_TIMEOUT_S, num_predict=1).invoke(WARMUP_TEXT)
+
+
+def warm_collection(parser, model, vector=None):
+    """Opens the collection's cached handle (query_utils.get_vector_store) and queries it once to load its index."""
+    collection_name = get_collection_name(parser, model, GEMINI_OUTPUT_DIMENSIONALITY)
+    db = get_vector_store(collection_name, model, GEMINI_OUTPUT_DIMENSIONALITY)
+    if vector is None:
+        vector = warm_embedding(model)
+    db.similarity_search_by_vector(vector, k=1)
+
+
+warmup = WarmUp()
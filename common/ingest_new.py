@@ -1,10 +1,11 @@
-from config import MODEL_NAME,PARSER,DB_NAME,DB_PATH,EMBEDDING_MODEL_NAME, COLLECTION_NAME,PROJECT
+from config import MODEL_NAME,PARSER,DB_NAME,DB_PATH,EMBEDDING_MODEL_NAME, COLLECTION_NAME,PROJECT,GEMINI_OUTPUT_DIMENSIONALITY,get_summary_collection_name
 import os
 import json
 import functions.database_utils as db_utils
 from langchain_core.documents import Document
 from functions.ingestion_utils import (
     create_and_persist_db,
+    create_and_persist_summary,
     reset_vector_db
 )
 
@@ -18,8 +19,15 @@ def create_tables():
         db_utils.create_resume_tables(conn)
 
 
-def insert_data():
-    path=os.path.join("processed",PROJECT,"json",PARSER,MODEL_NAME)
+def get_processed_json_path(parser=None, model_name=None):
+    return os.path.join("processed",PROJECT,"json",parser or PARSER,model_name or MODEL_NAME)
+
+
+def load_section_chunks(path):
+    """
+    Reads the parsed CV json files and yields (structured_data, chunks, chunk_ids) per CV.
+    Every section except "structured_data" becomes one chunk with id email_section.
+    """
     for filename in os.listdir(path):
         if filename.endswith(".json"):
             with open(os.path.join(path, filename), "r", encoding="utf-8") as f:
@@ -39,18 +47,37 @@ def insert_data():
                                 "email":email
                             }
                         )
-                        
+
                         chunk_ids.append(id)
                         chunks.append(chunk)
-                with get_connection() as conn:
-                    db_utils.insert_resume_data(conn,data["structured_data"])
-                create_and_persist_db(
-                    chunks=chunks,
-                    db_path=DB_PATH,
-                    collection_name=COLLECTION_NAME,
-                    model_name=EMBEDDING_MODEL_NAME,
-                    ids=chunk_ids
-                )
+                yield data["structured_data"],chunks,chunk_ids
+
+
+def insert_data():
+    path=get_processed_json_path()
+    for structured_data,chunks,chunk_ids in load_section_chunks(path):
+        with get_connection() as conn:
+            db_utils.insert_resume_data(conn,structured_data)
+        create_and_persist_db(
+            chunks=chunks,
+            db_path=DB_PATH,
+            collection_name=COLLECTION_NAME,
+            model_name=EMBEDDING_MODEL_NAME,
+            ids=chunk_ids,
+            output_dimensionality=GEMINI_OUTPUT_DIMENSIONALITY
+        )
+        general=structured_data["general"]
+        create_and_persist_summary(
+            db_path=DB_PATH,
+            collection_name=COLLECTION_NAME,
+            summary_collection_name=get_summary_collection_name(COLLECTION_NAME),
+            ids=chunk_ids,
+            metadata={
+                "email":general["email"],
+                "name":general.get("name") or "",
+                "source":chunks[0].metadata["source"] if chunks else ""
+            }
+        )
 
     # with get_connection() as conn:
     #     db_utils.insert_resume(conn,resume)
@@ -63,4 +90,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
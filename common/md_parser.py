@@ -1,9 +1,10 @@
 import os
 import json
-from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
 from functions.make_section import extract_sections
 from functions.query_utils import get_data_using_llm
+from functions.llm_utils import get_chat_model
+from functions.llm_scheduler import llm_scheduler, priority
 import re
 from config import MODEL_NAME,PARSER,PROJECT
 
@@ -66,7 +67,7 @@ prompts_template = {
 }
 def parser_with_llm_full(data,cv_text):
     prompt = ChatPromptTemplate.from_template(FULL_TEMPLATE)
-    model = ChatOllama(model=MODEL_NAME, format="json")
+    model = get_chat_model(MODEL_NAME, format="json")
     chain = prompt | model
     response = chain.invoke({"cv_text": cv_text})
     content = response.content
@@ -118,6 +119,8 @@ def parser_with_llm(data,cv_data):
             raise e
     return structured_data
     
+# extraction runs yield to /chat and the cv agent on the shared models
+@priority("batch")
 def parser_md_to_json(data_path):
     if not os.path.exists(data_path):
         print(f"Directory '{data_path}' does not exist.")
@@ -162,7 +165,8 @@ def parser_md_to_json(data_path):
 
 if __name__ == "__main__":
     # Example usage
-
+    # also wait for the running server's chat traffic, not just this process's
+    llm_scheduler.defer_to_server()
     parser_md_to_json(os.path.join("processed",PROJECT,"md",PARSER))
     # output = parser_with_llm("processed/json/marker")
     
@@ -0,0 +1,36 @@
+"""
+One-off migration: compress questions.context and logs.log_entry of existing rows.
+
+New rows are compressed on write (functions/text_codec.py); this rewrites the rows
+saved before that, then VACUUMs so the file actually shrinks.
+
+usage: python common/migrate_qa_storage.py [--db db.db] [--codec zstd|zlib] [--no-vacuum]
+"""
+import os
+import argparse
+from config import DB_NAME
+import functions.database_utils as db_utils
+from functions.text_codec import resolve_codec
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--codec", choices=["zstd", "zlib"])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args()
+
+    before = os.path.getsize(args.db)
+    print(f"Compressing QA rows of {args.db} with {resolve_codec(args.codec)}...")
+    with db_utils.get_db_connection(args.db) as conn:
+        rewritten = db_utils.compress_qa_rows(conn, args.batch_size, args.codec)
+        if not args.no_vacuum:
+            conn.execute("VACUUM")
+    after = os.path.getsize(args.db)
+    print(f"Rewritten rows: {rewritten}")
+    print(f"Size: {before / 1024:.1f} KB -> {after / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,9 +13,15 @@ from functions.query_utils import (
 from functions.make_section import CV_HEADING_PATTERNS
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_ollama import ChatOllama
-from config import MODEL_NAME,DB_NAME,PARSER,EMBEDDING_MODEL_NAME
+from config import MODEL_NAME,DB_NAME,PARSER,EMBEDDING_MODEL_NAME,GEMINI_OUTPUT_DIMENSIONALITY,get_collection_name,RETRIEVAL_MODE
+from config import DEADLINE_ANSWER_RESERVE_S,DEADLINE_MIN_ANSWER_S
 import json
 import functions.database_utils as db_utils
+from functions import tracing
+from functions.deadline import run_stage, Deadline
+from functions.batch import BatchCache, shared_step, normalize_question, run_parallel
+from functions.embedding_utils import get_embedding_function
+from functions.llm_scheduler import LLMOverloaded
 import logging
 
 # Configure logger
@@ -25,18 +31,76 @@ def get_connection(db_name=None):
     return db_utils.get_db_connection(db_name or DB_NAME)
 
 
-def query_rag(query_text, model_name=None, embedding_model=None, parser=None, db_name=None):
-    """Main RAG pipeline."""
+def partial_answer(top_docs, db_results):
+    """Answer without the LLM when the budget ran out: the candidates found so far."""
+    candidates=[f"{data['name']} ({data['email']})" for data in db_results]
+    known_emails={data["email"] for data in db_results}
+    candidates+=sorted({doc.metadata.get("email") for doc in top_docs if doc.metadata.get("email")}-known_emails)
+    if not candidates:
+        return "Could not generate an answer within the time budget. Please try again."
+    return "Could not generate a full answer within the time budget. Matching candidates:\n"+"\n".join(f"- {c}" for c in candidates)
+
+
+def polish(query_text, model_name, deadline=None, shared=None):
+    """polish_question within the budget; out of time, search with the raw question."""
+    return shared_step(shared, "polish", (model_name, normalize_question(query_text)),
+                       lambda: run_stage(deadline, "polish",
+                                         lambda: polish_question(query_text, model_name=model_name, deadline=deadline),
+                                         {"polished_question": query_text, "names": [], "emails": []}))
+
+def prepare_batch(questions, model_name=None, embedding_model=None, budget_s=None, max_parallel=None):
+    """
+    First pass of a /chat/batch: polishes every question (at most max_parallel at once),
+    then embeds all polished questions in one call.
+    :return: BatchCache (functions/batch.py) to pass to query_rag for each question
+    """
+    shared = BatchCache()
+    current_model = model_name or MODEL_NAME
+    current_embedding = embedding_model or EMBEDDING_MODEL_NAME
+    with tracing.span("batch_polish", questions=len(questions)):
+        polished = run_parallel(questions, lambda index, question: polish(question, current_model, Deadline(budget_s), shared),
+                                max_parallel=max_parallel)
+    texts = list(dict.fromkeys(
+        result["polished_question"] for result, error in polished
+        if result and result["polished_question"].lower() != "not related"
+    ))
+    if texts:
+        try:
+            with tracing.span("embed", model=current_embedding, texts=len(texts)):
+                embeddings = get_embedding_function(current_embedding, output_dimensionality=GEMINI_OUTPUT_DIMENSIONALITY)
+                vectors = embeddings.embed_queries(texts)
+            for text, vector in zip(texts, vectors):
+                shared.put("embed", (current_embedding, text), vector)
+        except LLMOverloaded:
+            raise
+        except Exception as e:
+            # each question embeds its own query in retrieval instead
+            logger.warning(f"Batch embedding failed: {e}")
+    return shared
+
+def query_rag(query_text, model_name=None, embedding_model=None, parser=None, db_name=None, retrieval_mode=None, deadline=None, shared=None):
+    """
+    Main RAG pipeline.
+    With a deadline (functions/deadline.py) optional stages are skipped or cut short to stay within the budget.
+    Within a /chat/batch, shared (functions/batch.py) holds the polish, section and schema results and query
+    embeddings that the batch's questions have in common.
+    """
     current_model = model_name or MODEL_NAME
     current_parser = parser or PARSER
     current_embedding = embedding_model or EMBEDDING_MODEL_NAME
     current_db = db_name or DB_NAME
+    current_collection = get_collection_name(current_parser, current_embedding, GEMINI_OUTPUT_DIMENSIONALITY)
+    current_retrieval_mode = retrieval_mode or RETRIEVAL_MODE
 
     logger.info(f"Starting RAG query for: {query_text}")
     logger.info(f"LLM Model: {current_model}")
     logger.info(f"Used PARSER: {current_parser}")
     logger.info(f"Embedding Model: {current_embedding}")
     logger.info(f"DB Name: {current_db}")
+    logger.info(f"Collection: {current_collection}")
+    logger.info(f"Retrieval mode: {current_retrieval_mode}")
+    if deadline is not None:
+        logger.info(f"Time budget: {deadline.budget_s:.0f}s")
 
     # 1. BM25 Retrieval
     # chunks = load_bm25_chunks()
@@ -45,7 +109,8 @@ def query_rag(query_text, model_name=None, embedding_model=None, parser=None, db
     # bm25_docs = []
     
    
-    question_dict=polish_question(query_text, model_name=current_model)
+    with tracing.span("polish"):
+        question_dict=polish(query_text, current_model, deadline, shared)
     
     names=question_dict["names"]
     emails=question_dict["emails"]
@@ -80,7 +145,12 @@ def query_rag(query_text, model_name=None, embedding_model=None, parser=None, db
 
     top_docs = []
     section_names = []
-    section=get_section_using_llm(polished_question, model_name=current_model)
+    with tracing.span("section"):
+        # out of time: no section filter, no SQL
+        section=shared_step(shared, "section", (current_model, normalize_question(polished_question)),
+                            lambda: run_stage(deadline, "section",
+                                              lambda: get_section_using_llm(polished_question, model_name=current_model, deadline=deadline),
+                                              {"sections": []}, reserve_s=DEADLINE_ANSWER_RESERVE_S))
     # 2. Vector Retrieval
     section_names=section["sections"]
     logger.info(f"Identified sections: {section_names}")
@@ -89,15 +159,22 @@ def query_rag(query_text, model_name=None, embedding_model=None, parser=None, db
         if any(section in ["general", "skills", "experience"] for section in section_names):
                 # get sql query and data from db
             with get_connection(current_db) as conn:
-                schema=db_utils.get_schema(conn)
-                schema_text=db_utils.schema_to_text(schema)
-                section=get_sql_using_llm(polished_question,schema_text)
-                sql_query=section["query"]
-                logger.info(f"Sql result is based on: {section["format_result"]}")
+                with tracing.span("schema", backend="sqlite"):
+                    schema_text=shared_step(shared, "schema", current_db,
+                                            lambda: db_utils.schema_to_text(db_utils.get_schema(conn)))
+                with tracing.span("sql_gen"):
+                    # out of time: skip SQL, answer from vector retrieval
+                    section=run_stage(deadline, "sql_gen",
+                                      lambda: get_sql_using_llm(polished_question,schema_text,deadline=deadline),
+                                      None, reserve_s=DEADLINE_ANSWER_RESERVE_S)
+                sql_query=section["query"] if section else None
+                if section:
+                    logger.info(f"Sql result is based on: {section["format_result"]}")
                 logger.info(f"SQL Query: {sql_query}")
                 if(sql_query):
-                    with get_connection(current_db) as conn:
+                    with get_connection(current_db) as conn, tracing.span("sql_exec", backend="sqlite") as sql_span:
                         sql_data=db_utils.get_data_by_sql(conn,sql_query)
+                        sql_span["attributes"]["rows"]=len(sql_data) if sql_data else 0
                         logger.info(f"SQL Data: {sql_data}")
                         if sql_data:
                             sql_data_str+="\n\n# start of SQL Data"
@@ -115,7 +192,11 @@ def query_rag(query_text, model_name=None, embedding_model=None, parser=None, db
                             )
                             sql_data_str+="\n# end of SQL Data\n"
             if(len(section_names)==1 and sql_data_str is not None and sql_data_str!=""):
-                need_more_context_dict=check_need_more_context_needed(polished_question,sql_data_str)
+                with tracing.span("need_more_context"):
+                    # out of time: answer from the SQL data we already have
+                    need_more_context_dict=run_stage(deadline, "need_more_context",
+                                                     lambda: check_need_more_context_needed(polished_question,sql_data_str,deadline=deadline),
+                                                     {"need_more_context": "False"}, reserve_s=DEADLINE_ANSWER_RESERVE_S)
                 need_more_context=need_more_context_dict["need_more_context"]=="True"
 
     if(need_more_context):
@@ -128,7 +209,15 @@ def query_rag(query_text, model_name=None, embedding_model=None, parser=None, db
         
 
         logger.info(f"Need more context: {need_more_context}")
-        vector_docs = get_vector_results(polished_question,section_names,chunk_ids, embedding_model_name=current_embedding)
+        query_vector = shared.get("embed", (current_embedding, polished_question)) if shared else None
+        with tracing.span("retrieval", mode=current_retrieval_mode) as retrieval_span:
+            vector_docs = run_stage(deadline, "retrieval",
+                                    lambda: get_vector_results(polished_question,section_names,chunk_ids, embedding_model_name=current_embedding, collection_name=current_collection, retrieval_mode=current_retrieval_mode, deadline=deadline, query_vector=query_vector),
+                                    None)
+            # out of time: go straight to the answer with what we have
+            retrieval_skipped = vector_docs is None
+            vector_docs = vector_docs or []
+            retrieval_span["attributes"]["docs"]=len(vector_docs)
         
         vector_ids=[]
         for doc in vector_docs:
@@ -139,7 +228,7 @@ def query_rag(query_text, model_name=None, embedding_model=None, parser=None, db
         # merged_docs = merge_and_deduplicate(bm25_docs, vector_docs)
         merged_docs = vector_docs
         
-        if not merged_docs:
+        if not merged_docs and not retrieval_skipped:
             logger.info("No relevant documents found.")
             return "No relevant documents found.","no context"
 
@@ -151,9 +240,16 @@ def query_rag(query_text, model_name=None, embedding_model=None, parser=None, db
         logger.info("No need for more context.")
         
     # 5. Generate Answer
-    answer,context_text = generate_answer(query_text, top_docs,section_names, model_name=current_model,context=sql_data_str)
-    
-    logger.info("Answer generated successfully.")
+    with tracing.span("answer", docs=len(top_docs)):
+        answered = run_stage(deadline, "answer",
+                             lambda: generate_answer(query_text, top_docs,section_names, model_name=current_model,context=sql_data_str,deadline=deadline),
+                             None, reserve_s=DEADLINE_MIN_ANSWER_S)
+    if answered is None or answered[0] is None:
+        answer,context_text = partial_answer(top_docs, db_results),sql_data_str
+        logger.warning("Answered without the LLM (time budget).")
+    else:
+        answer,context_text = answered
+        logger.info("Answer generated successfully.")
     
     result = answer + "\n\nSources:\n"
     for doc in top_docs:
@@ -0,0 +1,344 @@
+"""
+Stand-in LLM / embedding server that speaks the Ollama HTTP API.
+
+Lets query_rag, cv_agent_query and the ingestion scripts run without a live Ollama
+or Gemini so the throughput of our own code can be measured. Start it, then set
+RAG_STAND_IN_LLM=1 (see config.USE_STAND_IN_LLM) for the process under test:
+
+    python common/stand_in_server.py --latency-ms 300 --latency-jitter-ms 100 --error-rate 0.02
+    RAG_STAND_IN_LLM=1 python server/app.py
+
+Endpoints: /api/chat, /api/generate, /api/embed, /api/embeddings, /api/tags,
+/api/version, plus /_stand_in/stats with request / error counters.
+
+Replies are picked by the first rule whose regex matches the prompt. Built-in rules
+recognize the pipeline's own prompts (polish, section, SQL, need-more-context, NER,
+planner, CV parser) and return valid JSON for them; --script adds rules in front:
+
+    {"rules": [{"match": "Text-to-SQL", "reply": {"query": "SELECT * FROM users", "headers": ["email"], "format_result": "all users"}}],
+     "default": "scripted answer"}
+
+"{question}" inside a reply is replaced with the question found in the prompt.
+Embeddings are DeterministicHashEmbeddings seeded with the model name, of the model's
+real size (config.STAND_IN_EMBEDDING_DIMENSIONS) so the server can query collections
+ingested with the real model, or of the request's "dimensions" (Gemini Matryoshka sizes).
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from config import STAND_IN_HOST, STAND_IN_PORT, STAND_IN_EMBEDDING_DIMENSIONS
+from functions.embedding_utils import DeterministicHashEmbeddings
+
+QUESTION_PATTERNS = [
+    re.compile(r"##\s*input question:\s*(.+?)\s*(?:\n\s*\n|$)", re.IGNORECASE | re.DOTALL),
+    re.compile(r"Input question:\s*(.+?)\s*(?:\n\s*\n|$)", re.IGNORECASE | re.DOTALL),
+    re.compile(r"Question:\s*\"?(.+?)\"?\s*(?:\n|$)"),
+]
+
+DEFAULT_RULES = [
+    {"match": r"Search Query Optimizer", "reply": {
+        "polished_question": "{question}", "names": [], "emails": [],
+        "short_description": "{question}", "intents": []}},
+    {"match": r"which CV section", "reply": {
+        "sections": ["skills"], "confidence": "high", "reason": "stand-in", "filter_query": "skills"}},
+    {"match": r"Text-to-SQL", "reply": {
+        "query": "SELECT name, email FROM users", "headers": ["name", "email"],
+        "format_result": "name and email of every candidate"}},
+    {"match": r"question analyzer", "reply": {"need_more_context": "True"}},
+    {"match": r"Named Entity Recognition", "reply": {
+        "entities": [],
+        "intent": {"action": "list", "target_attribute": "skills", "comparison_type": "none", "entity_count": "multiple"},
+        "query_type": "simple_retrieval"}},
+    {"match": r"PLANNER AGENT", "reply": {
+        "plan": [],
+        "answer_synthesis": {"format": "list", "state_keys_needed": [], "template": ""}}},
+    {"match": r"key general", "reply": {"general": {"name": "Stand In", "email": "stand.in@example.com", "position": ""}}},
+    {"match": r"key skills", "reply": {"skills": []}},
+    {"match": r"key experience", "reply": {"experience": []}},
+]
+DEFAULT_TEXT_REPLY = "Stand-in answer for: {question}"
+
+
+class StandInConfig:
+    """Reply rules plus latency and error injection; shared by all handler threads."""
+
+    def __init__(self, rules=None, default_reply=None, latency_ms=0.0, latency_jitter_ms=0.0,
+                 latency_distribution="uniform", embed_latency_ms=None, error_rate=0.0,
+                 error_status=500, seed=None):
+        self.rules = [(re.compile(rule["match"], re.IGNORECASE), rule["reply"]) for rule in (rules or []) + DEFAULT_RULES]
+        self.default_reply = default_reply or DEFAULT_TEXT_REPLY
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_distribution = latency_distribution
+        self.embed_latency_ms = latency_ms if embed_latency_ms is None else embed_latency_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.embeddings = {}
+
+    @classmethod
+    def from_script(cls, path, **kwargs):
+        with open(path, "r", encoding="utf-8") as f:
+            script = json.load(f)
+        return cls(rules=script.get("rules", []), default_reply=script.get("default"), **kwargs)
+
+    def sample_latency(self, base_ms):
+        """Seconds to sleep for one request."""
+        with self.lock:
+            if self.latency_distribution == "lognormal" and base_ms > 0:
+                # jitter is used as the standard deviation of the underlying normal, in ms
+                sigma = max(self.latency_jitter_ms, 1.0) / base_ms
+                value = self.random.lognormvariate(0, sigma) * base_ms
+            elif self.latency_distribution == "exponential" and base_ms > 0:
+                value = self.random.expovariate(1.0 / base_ms)
+            else:
+                value = base_ms + self.random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+        return max(value, 0.0) / 1000
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def record(self, endpoint, status):
+        with self.lock:
+            entry = self.stats.setdefault(endpoint, {"requests": 0, "errors": 0})
+            entry["requests"] += 1
+            if status >= 400:
+                entry["errors"] += 1
+
+    def get_embeddings(self, model, dimensions=None):
+        dimensions = dimensions or STAND_IN_EMBEDDING_DIMENSIONS.get(model)
+        with self.lock:
+            if (model, dimensions) not in self.embeddings:
+                self.embeddings[(model, dimensions)] = DeterministicHashEmbeddings(seed=model, **({"dimensions": dimensions} if dimensions else {}))
+            return self.embeddings[(model, dimensions)]
+
+    def reply_for(self, prompt, is_json):
+        question = extract_question(prompt)
+        for pattern, reply in self.rules:
+            if pattern.search(prompt):
+                return render_reply(reply, question)
+        if is_json:
+            return json.dumps({"answer": render_reply(self.default_reply, question)})
+        return render_reply(self.default_reply, question)
+
+
+def extract_question(prompt):
+    for pattern in QUESTION_PATTERNS:
+        match = pattern.search(prompt)
+        if match:
+            return match.group(1).strip()
+    return prompt.strip().splitlines()[-1] if prompt.strip() else ""
+
+
+def fill_question(value, question):
+    """Replaces {question} in every string of a reply template (dicts and lists included)."""
+    if isinstance(value, str):
+        return value.replace("{question}", question)
+    if isinstance(value, dict):
+        return {key: fill_question(item, question) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill_question(item, question) for item in value]
+    return value
+
+
+def render_reply(reply, question):
+    if isinstance(reply, str):
+        return fill_question(reply, question)
+    # filled before json.dumps so quotes, backslashes and newlines in the question are escaped
+    return json.dumps(fill_question(reply, question))
+
+
+def count_tokens(text):
+    """Rough whitespace token count, good enough for the eval_count fields."""
+    return len(text.split())
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StandInConfig = None
+
+    def log_message(self, format, *args):
+        pass  # keep the load test output clean
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_ndjson(self, chunks):
+        data = "".join(json.dumps(chunk) + "\n" for chunk in chunks).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            models = sorted({"gemini", "gemma3:1b", "gemma3:4b", "llama3.2:3b", "bge-m3", "nomic-embed-text"})
+            self.send_json(200, {"models": [{"name": m, "model": m} for m in models]})
+        elif self.path == "/api/version":
+            self.send_json(200, {"version": "stand-in"})
+        elif self.path == "/_stand_in/stats":
+            with self.config.lock:
+                self.send_json(200, dict(self.config.stats))
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        endpoint = self.path.split("?")[0]
+        handlers = {
+            "/api/chat": self.handle_chat,
+            "/api/generate": self.handle_generate,
+            "/api/embed": self.handle_embed,
+            "/api/embeddings": self.handle_embeddings,
+        }
+        handler = handlers.get(endpoint)
+        if handler is None:
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            body = self.read_json()
+        except json.JSONDecodeError:
+            self.config.record(endpoint, 400)
+            self.send_json(400, {"error": "invalid json"})
+            return
+
+        is_embedding = endpoint in ("/api/embed", "/api/embeddings")
+        time.sleep(self.config.sample_latency(self.config.embed_latency_ms if is_embedding else self.config.latency_ms))
+        if self.config.should_fail():
+            self.config.record(endpoint, self.config.error_status)
+            self.send_json(self.config.error_status, {"error": "stand-in injected error"})
+            return
+        handler(body)
+        self.config.record(endpoint, 200)
+
+    def completion_fields(self, prompt, content, started):
+        elapsed_ns = int((time.perf_counter() - started) * 1e9)
+        return {
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": elapsed_ns,
+            "load_duration": 0,
+            "prompt_eval_count": count_tokens(prompt),
+            "prompt_eval_duration": 0,
+            "eval_count": count_tokens(content),
+            "eval_duration": elapsed_ns,
+        }
+
+    def handle_chat(self, body):
+        started = time.perf_counter()
+        model = body.get("model", "")
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        content = self.config.reply_for(prompt, bool(body.get("format")))
+        message = {"role": "assistant", "content": content}
+        final = {"model": model, "created_at": now_iso(), "message": message, **self.completion_fields(prompt, content, started)}
+        if body.get("stream", True):
+            first = {"model": model, "created_at": now_iso(), "message": message, "done": False}
+            final["message"] = {"role": "assistant", "content": ""}
+            self.send_ndjson([first, final])
+        else:
+            self.send_json(200, final)
+
+    def handle_generate(self, body):
+        started = time.perf_counter()
+        model = body.get("model", "")
+        prompt = body.get("prompt", "")
+        content = self.config.reply_for(prompt, bool(body.get("format")))
+        final = {"model": model, "created_at": now_iso(), "response": content, **self.completion_fields(prompt, content, started)}
+        if body.get("stream", True):
+            first = {"model": model, "created_at": now_iso(), "response": content, "done": False}
+            final["response"] = ""
+            self.send_ndjson([first, final])
+        else:
+            self.send_json(200, final)
+
+    def handle_embed(self, body):
+        model = body.get("model", "")
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        vectors = self.config.get_embeddings(model, body.get("dimensions")).embed_documents(inputs)
+        self.send_json(200, {"model": model, "embeddings": vectors,
+                             "prompt_eval_count": sum(count_tokens(t) for t in inputs)})
+
+    def handle_embeddings(self, body):
+        model = body.get("model", "")
+        vector = self.config.get_embeddings(model).embed_query(body.get("prompt", ""))
+        self.send_json(200, {"embedding": vector})
+
+
+class StandInHTTPServer(ThreadingHTTPServer):
+    # listen backlog: the default of 5 drops connections when hundreds of calls arrive at once
+    request_queue_size = 1024
+
+
+def start_stand_in_server(config=None, host=None, port=None):
+    """Starts the server on a daemon thread and returns it; call server.shutdown() to stop."""
+    handler = type("ConfiguredStandInHandler", (StandInHandler,), {"config": config or StandInConfig()})
+    server = StandInHTTPServer((host or STAND_IN_HOST, STAND_IN_PORT if port is None else port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="stand-in-server", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=STAND_IN_HOST)
+    parser.add_argument("--port", type=int, default=STAND_IN_PORT)
+    parser.add_argument("--script", help="json file with extra reply rules")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="mean chat/generate latency")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--latency-distribution", choices=["uniform", "lognormal", "exponential"], default="uniform")
+    parser.add_argument("--embed-latency-ms", type=float, default=None, help="defaults to --latency-ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    options = dict(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        latency_distribution=args.latency_distribution,
+        embed_latency_ms=args.embed_latency_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+    config = StandInConfig.from_script(args.script, **options) if args.script else StandInConfig(**options)
+    server = start_stand_in_server(config, args.host, args.port)
+    print(f"Stand-in Ollama server listening on http://{args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from langchain.tools import tool
 from common.functions.planner_utils import get_tool_schema, ToolsGroup, to_llm_json
 from common.functions.query_utils import get_data_using_llm
+# plain `functions.tracing` (common/ is on sys.path now) so spans share query_utils' context
+from functions import tracing
 import json
 from typing import Dict, List, Any
 from cv_agent.tools.specific_tools import cv_specific_tools
@@ -44,12 +46,15 @@ class NERPlannerOrchestrator:
         
         # Stage 1: NER
         logger.info("\n[STAGE 1: NER]")
-        ner_output = self.ner_agent.extract_entities(question)
+        with tracing.span("ner"):
+            ner_output = self.ner_agent.extract_entities(question)
         logger.info(json.dumps(ner_output, indent=2))
         
         # Stage 2: Planning
         logger.info("\n[STAGE 2: PLANNING]")
-        plan = self.planner_agent.create_plan(question, ner_output)
+        with tracing.span("plan") as plan_span:
+            plan = self.planner_agent.create_plan(question, ner_output)
+            plan_span["attributes"]["steps"] = len(plan.get("plan", []))
         i=1
         for tool in plan["plan"]:
             logger.info(f"tool no: {i}")
@@ -60,11 +65,13 @@ class NERPlannerOrchestrator:
         
         # Stage 3: Execution
         logger.info("\n[STAGE 3: EXECUTION]")
-        state = self.execution_engine.execute(plan, ner_output)
+        with tracing.span("execution"):
+            state = self.execution_engine.execute(plan, ner_output)
         
         # Stage 4: Answer Synthesis
         logger.info("\n[STAGE 4: SYNTHESIS]")
-        final_answer = self.answer_synthesizer.synthesize(plan, state, ner_output, question)
+        with tracing.span("synthesis"):
+            final_answer = self.answer_synthesizer.synthesize(plan, state, ner_output, question)
         
         return {
             "question": question,
@@ -85,7 +92,8 @@ def cv_agent_query(query, model_name=None, embedding_model=None, parser=None, db
     orchestrator = NERPlannerOrchestrator(cv_specific_tools)
     
     result = orchestrator.process_query(query)
-    answer,context_text = generate_answer(query, [],[], model_name=model_name,context=json.dumps(result["answer"]))
+    with tracing.span("answer"):
+        answer,context_text = generate_answer(query, [],[], model_name=model_name,context=json.dumps(result["answer"]))
     return answer,context_text
 
 
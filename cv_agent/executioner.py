@@ -7,8 +7,12 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from langchain.tools import tool
 from common.functions.planner_utils import get_tool_schema, ToolsGroup, to_llm_json
 from common.functions.query_utils import get_data_using_llm
+from functions import tracing
+from functions.llm_scheduler import LLMOverloaded
 import json
+import logging
 from typing import Dict, List, Any
+logger = logging.getLogger('rag_logger')
 
 
 # ============================================================================
@@ -80,37 +84,43 @@ class ExecutionEngine:
         
         sorted_plan = sorted(plan["plan"], key=lambda x: x.get("step", 0))
         
-        print("\n" + "="*80)
-        print("EXECUTION TRACE")
-        print("="*80)
+        logger.info("\n" + "="*80)
+        logger.info("EXECUTION TRACE")
+        logger.info("="*80)
         
         for step in sorted_plan:
-            try:
-                tool_name = step.get("tool")
-                inputs = step.get("input", {})
-                output_key = step.get("output_key", f"step_{step.get('step', 'unknown')}")
-                entity_binding = step.get("entity_binding", "N/A")
-                
-                if tool_name not in self.tool_map:
-                    raise ValueError(f"Unknown tool: {tool_name}")
-                
-                # Resolve inputs from state and NER
-                resolved_inputs = self.resolve_inputs(inputs, state, ner_output)
-                
-                # Execute tool
-                result = self.tool_map[tool_name].invoke(resolved_inputs)
-                state[output_key] = result
-                
-                print(f"\n✓ Step {step.get('step')}")
-                print(f"  Entity: {entity_binding}")
-                print(f"  Thought: {step.get('thought', 'N/A')}")
-                print(f"  Tool: {tool_name}")
-                print(f"  Inputs: {resolved_inputs}")
-                print(f"  Result: {result}")
-                
-            except Exception as e:
-                print(f"\n✗ Step {step.get('step')} FAILED: {str(e)}")
-                state[output_key] = f"ERROR: {str(e)}"
+            tool_name = step.get("tool")
+            output_key = step.get("output_key", f"step_{step.get('step', 'unknown')}")
+            with tracing.span(f"tool:{tool_name}", step=step.get("step")) as step_span:
+                try:
+                    inputs = step.get("input", {})
+                    entity_binding = step.get("entity_binding", "N/A")
+                    
+                    if tool_name not in self.tool_map:
+                        raise ValueError(f"Unknown tool: {tool_name}")
+                    
+                    # Resolve inputs from state and NER
+                    resolved_inputs = self.resolve_inputs(inputs, state, ner_output)
+                    
+                    # Execute tool
+                    result = self.tool_map[tool_name].invoke(resolved_inputs)
+                    state[output_key] = result
+                    
+                    logger.info(f"\n✓ Step {step.get('step')}")
+                    logger.info(f"  Entity: {entity_binding}")
+                    logger.info(f"  Thought: {step.get('thought', 'N/A')}")
+                    logger.info(f"  Tool: {tool_name}")
+                    logger.info(f"  Inputs: {resolved_inputs}")
+                    logger.info(f"  Result: {result}")
+                    
+                except LLMOverloaded:
+                    # shed load: fail the whole request (503) rather than answer from a partial plan
+                    raise
+                except Exception as e:
+                    logger.error(f"\n✗ Step {step.get('step')} FAILED: {str(e)}")
+                    state[output_key] = f"ERROR: {str(e)}"
+                    step_span["status"] = "error"
+                    step_span["attributes"]["error"] = str(e)[:200]
         
         return state
 
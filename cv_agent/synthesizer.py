@@ -1,6 +1,8 @@
 
 from typing import Dict, List, Any
 import json
+import logging
+logger = logging.getLogger('rag_logger')
 
 
 # ============================================================================
@@ -20,12 +22,12 @@ class AnswerSynthesizer:
         # Collect relevant results
         results = {key: state.get(key, "N/A") for key in state_keys}
         
-        print("\n" + "="*80)
-        print("ANSWER SYNTHESIS")
-        print("="*80)
-        print(f"Format: {format_type}")
-        print(f"Using state keys: {state_keys}")
-        print(f"Results: {json.dumps(results, indent=2)}")
+        logger.info("\n" + "="*80)
+        logger.info("ANSWER SYNTHESIS")
+        logger.info("="*80)
+        logger.info(f"Format: {format_type}")
+        logger.info(f"Using state keys: {state_keys}")
+        logger.info(f"Results: {json.dumps(results, indent=2)}")
         
         # Format based on type
         if format_type == "single_value":
@@ -1,21 +1,36 @@
 import sys
 import os
+import time
+import importlib
+import uuid
 import logging
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, Response
 from flask_socketio import SocketIO, emit
-import io
 # Ensure we can import from common
 # Assuming server directory is at project_root/server
 # We need to add project_root to sys.path
 # AND common directory to sys.path because query.py uses 'from functions...' and 'from config...'
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-# common_dir = os.path.join(project_root, 'common')
+common_dir = os.path.join(project_root, 'common')
 sys.path.append(project_root)
-# sys.path.append(common_dir)
+sys.path.append(common_dir)
 
 import common.functions.database_utils as db_utils
-from common.config import DB_NAME,EMBEDDING_MODELS,MODEL_COLLECTIONS,PARSER_LIST
-from cv_agent.cv_agent_main import cv_agent_query
+from common.config import DB_NAME,EMBEDDING_MODELS,MODEL_COLLECTIONS,PARSER_LIST,RETRIEVAL_MODES,HISTORY_PAGE_SIZE,HISTORY_MAX_PAGE_SIZE
+from common.config import SERVER_HOST,SERVER_PORT,SOCKETIO_MESSAGE_QUEUE,BATCH_MAX_QUESTIONS,CHAT_BUDGET_S
+# same module object query.py and query_utils use, so their spans land in our trace
+from functions import tracing
+from functions import metrics
+from functions import log_capture
+from functions import log_stream
+from functions.qa_writer import qa_writer
+from functions.single_flight import SingleFlight, question_key
+from functions.llm_scheduler import llm_scheduler, LLMOverloaded, priority
+from functions import hedging
+from functions import circuit_breaker
+from functions.deadline import Deadline
+from functions.warmup import warmup
+from functions.batch import normalize_question, run_parallel
 
 
 
@@ -23,58 +38,119 @@ try:
     # We use common.query if we want to be explicit, but since common is in path, 
     # query.py's internal imports work. 
     # However, to import query_rag, we can do it from common.query
-    from common.query import query_rag
+    from common.query import query_rag, prepare_batch
 except ImportError as e:
     # Try importing directly if common is in path but project_root isn't the package root
     try:
-        from query import query_rag
+        from query import query_rag, prepare_batch
     except ImportError as e2:
         print(f"Error importing common.query: {e}")
         print(f"Error importing query: {e2}")
         print("Make sure you are running from the correct directory or PYTHONPATH is set.")
         # Fallback to prevent immediate crash if just testing app framework
-        def query_rag(q): return f"Mock response for: {q}. Error importing query_rag: {e}"
+        import_error = str(e)
+        def query_rag(q, **kwargs): return f"Mock response for: {q}. Error importing query_rag: {import_error}", "no context"
+        def prepare_batch(questions, **kwargs): return None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
-# Allow all origins for dev simplicity
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-# Custom WebSocket Logging Handler
-class WebSocketHandler(logging.Handler):
-    def emit(self, record):
-        try:
-            log_entry = self.format(record)
-            socketio.emit('log_message', {'data': log_entry})
-        except Exception:
-            pass # Handle errors if socket not ready
+# Allow all origins for dev simplicity. With a message queue, emits from any worker
+# (server/gunicorn.conf.py) reach clients connected to the others
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)
+
+# WebSocket logs: batched per session by a background emitter (functions/log_stream.py)
+log_emitter = log_stream.BatchedLogEmitter(
+    lambda event, payload, room: socketio.emit(event, payload, to=room),
+    start_background_task=socketio.start_background_task,
+    sleep=socketio.sleep
+)
 
 # Configure Logger for RAG
 # We attach to the logger name 'rag_logger' which is used in common/query.py
 rag_logger = logging.getLogger('rag_logger')
 rag_logger.setLevel(logging.INFO)
 
-ws_handler = WebSocketHandler()
+ws_handler = log_stream.SessionLogHandler(log_emitter)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%H:%M:%S')
 ws_handler.setFormatter(formatter)
 rag_logger.addHandler(ws_handler)
+# per-request capture for the QA log; installed once, see functions/log_capture.py
+log_capture.install(rag_logger)
+
+# identical questions asked at the same time share one pipeline run (functions/single_flight.py)
+chat_flight = SingleFlight("single_flight", logger=rag_logger)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    g.metrics_start = time.perf_counter()
+    metrics.HTTP_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = g.get("metrics_endpoint", "unmatched")
+    metrics.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if "metrics_start" in g:
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - g.metrics_start, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc):
+    # teardown runs even when a view raised, so the gauge can't leak
+    if "metrics_endpoint" in g:
+        metrics.HTTP_IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
 
 # Also attach to root logger or app logger if we want more logs?
 # For now, just 'rag_logger' as requested: "add this log call in the query.py page"
 
+@app.route('/ready', methods=['GET'])
+def get_ready():
+    """200 once this process has finished its startup warm-up (functions/warmup.py), 503 before."""
+    status = warmup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
 @app.route('/config', methods=['GET'])
 def get_config():
     return jsonify({
         "DB_NAME": DB_NAME,
         "EMBEDDING_MODELS": EMBEDDING_MODELS,
         "MODEL_COLLECTIONS": MODEL_COLLECTIONS,
-        "PARSER_LIST": PARSER_LIST
+        "PARSER_LIST": PARSER_LIST,
+        "RETRIEVAL_MODES": RETRIEVAL_MODES
     })
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def overloaded_response(e):
+    """503 for a request shed by the LLM admission control or an open circuit breaker."""
+    rag_logger.warning(f"Request shed: {e}")
+    response = jsonify({'error': str(e), 'model': e.model, 'reason': e.reason})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+def parse_budget(value):
+    """
+    A client's "budget_s", capped at CHAT_BUDGET_S; None when not sent.
+    :raises ValueError: not a positive number
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("budget_s must be a positive number of seconds")
+    try:
+        budget_s = float(value)
+    except ValueError:
+        raise ValueError("budget_s must be a positive number of seconds")
+    if not budget_s > 0:
+        raise ValueError("budget_s must be a positive number of seconds")
+    return min(budget_s, CHAT_BUDGET_S)
+
 @app.route('/chat', methods=['POST'])
 def chat():
     data = request.json
@@ -82,38 +158,125 @@ def chat():
     if not question:
         return jsonify({'error': 'No question provided'}), 400
     
-    # We call query_rag. It logs to 'rag_logger', which emits to websocket.
+    # We call query_rag. It logs to 'rag_logger', which streams to the caller's websocket.
     # It returns the string result.
     
-    # Capture logs
-    log_capture_string = io.StringIO()
-    ch = logging.StreamHandler(log_capture_string)
-    ch.setLevel(logging.INFO)
-    rag_logger.addHandler(ch)
-    
     db_name = data.get('db_name')
     embedding_model = data.get('embedding_model')
     model = data.get('model')
     parser = data.get('parser')
+    # Socket.IO session of the asking tab; its room is the only one that gets the logs
+    sid = data.get('sid')
+    retrieval_mode = data.get('retrieval_mode')
+    # latency budget for the whole pipeline (CHAT_BUDGET_S unless the client sends a smaller budget_s)
+    try:
+        deadline = Deadline(parse_budget(data.get('budget_s')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:
-        answer, context_str = query_rag(question, model_name=model, embedding_model=embedding_model, parser=parser, db_name=db_name)
+        # only this request's lines, even with concurrent requests
+        with log_stream.stream_to(sid), log_capture.capture_logs() as log_buffer, tracing.start_trace("chat") as trace:
+            key = question_key(question, "chat", db_name, model, embedding_model, parser, retrieval_mode)
+            # waits for an identical running question at most until this request's own budget is spent
+            (answer, context_str), _ = chat_flight.do(key, query_rag, question, model_name=model, embedding_model=embedding_model, parser=parser, db_name=db_name, retrieval_mode=retrieval_mode, deadline=deadline,
+                                                      max_wait_s=deadline.remaining())
         
-        # Save to DB
-        captured_logs = log_capture_string.getvalue()
-        try:
-            with db_utils.get_db_connection(DB_NAME) as conn:
-                db_utils.save_qa_log(conn, question, answer, captured_logs, context_str)
-        except Exception as db_e:
-            rag_logger.error(f"Error saving to DB: {db_e}")
+        # Save to DB in the background writer; never blocks the response
+        qa_writer.submit(question, answer, log_buffer.getvalue(), context_str, trace.spans)
 
         return jsonify({'response': answer})
+    except LLMOverloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         rag_logger.error(f"Error in query_rag: {e}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        rag_logger.removeHandler(ch)
-        log_capture_string.close()
+def run_batch(batch_id, questions, options, budget_s=None, sid=None):
+    """
+    Answers the questions of one /chat/batch, identical questions once, in the batch priority
+    class. Each result is emitted to sid ("batch_result") as soon as it is ready.
+    :return: one {"index", "question", "response" or "error"} per question, in order
+    """
+    positions = {}
+    for index, question in enumerate(questions):
+        positions.setdefault(normalize_question(question), []).append(index)
+    unique = [questions[indexes[0]] for indexes in positions.values()]
+    results = [None] * len(questions)
+    completed = 0
+
+    def answer(index, question):
+        # each question gets its own budget, trace and QA log row; no log streaming, results only
+        with log_capture.capture_logs() as log_buffer, tracing.start_trace("chat_batch") as trace:
+            answer, context_str = query_rag(question, model_name=options['model'], embedding_model=options['embedding_model'],
+                                            parser=options['parser'], db_name=options['db_name'], retrieval_mode=options['retrieval_mode'],
+                                            deadline=Deadline(budget_s), shared=shared)
+        qa_writer.submit(question, answer, log_buffer.getvalue(), context_str, trace.spans)
+        return answer
+
+    def on_result(unique_index, answer, error):
+        nonlocal completed
+        if error:
+            rag_logger.error(f"Error in batch {batch_id}: {error}")
+        for index in positions[normalize_question(unique[unique_index])]:
+            result = {'index': index, 'question': questions[index]}
+            if error:
+                result['error'] = str(error)
+            else:
+                result['response'] = answer
+            results[index] = result
+            completed += 1
+            if sid:
+                socketio.emit('batch_result', {'batch_id': batch_id, 'completed': completed, 'total': len(questions), **result}, to=sid)
+
+    with priority("batch"):
+        shared = prepare_batch(unique, model_name=options['model'], embedding_model=options['embedding_model'], budget_s=budget_s)
+        run_parallel(unique, answer, on_result)
+    return results
+
+def run_batch_in_background(batch_id, questions, options, budget_s, sid):
+    error = None
+    try:
+        run_batch(batch_id, questions, options, budget_s, sid)
+    except Exception as e:
+        rag_logger.error(f"Error in batch {batch_id}: {e}")
+        error = str(e)
+    socketio.emit('batch_done', {'batch_id': batch_id, 'total': len(questions), 'error': error}, to=sid)
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Answers up to BATCH_MAX_QUESTIONS questions (bulk screening) sharing polish, section
+    classification, schema fetch and query embeddings (common/query.prepare_batch).
+    With a "sid" the batch runs in the background: 202 with the batch_id, then one
+    "batch_result" per question to that Socket.IO session as it completes and "batch_done".
+    Without one the response waits for all answers.
+    """
+    data = request.json
+    questions = [q for q in (data.get('questions') or []) if isinstance(q, str) and q.strip()]
+    if not questions:
+        return jsonify({'error': 'No questions provided'}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({'error': f'At most {BATCH_MAX_QUESTIONS} questions per batch'}), 400
+
+    options = {key: data.get(key) for key in ('model', 'embedding_model', 'parser', 'db_name', 'retrieval_mode')}
+    try:
+        budget_s = parse_budget(data.get('budget_s'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sid = data.get('sid')
+    batch_id = uuid.uuid4().hex
+    if sid:
+        socketio.start_background_task(run_batch_in_background, batch_id, questions, options, budget_s, sid)
+        return jsonify({'batch_id': batch_id, 'total': len(questions)}), 202
+    try:
+        results = run_batch(batch_id, questions, options, budget_s)
+        return jsonify({'batch_id': batch_id, 'results': results})
+    except LLMOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        rag_logger.error(f"Error in batch {batch_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/chat/cv_agent', methods=['POST'])
 def chat_v2():
     data = request.json
@@ -121,52 +284,53 @@ def chat_v2():
     if not question:
         return jsonify({'error': 'No question provided'}), 400
     
-    # We call query_rag. It logs to 'rag_logger', which emits to websocket.
+    # We call query_rag. It logs to 'rag_logger', which streams to the caller's websocket.
     # It returns the string result.
     
-    # Capture logs
-    log_capture_string = io.StringIO()
-    ch = logging.StreamHandler(log_capture_string)
-    ch.setLevel(logging.INFO)
-    rag_logger.addHandler(ch)
-    
     db_name = data.get('db_name')
     embedding_model = data.get('embedding_model')
     model = data.get('model')
     parser = data.get('parser')
+    # Socket.IO session of the asking tab; its room is the only one that gets the logs
+    sid = data.get('sid')
 
     try:
-        answer, context_str = cv_agent_query(question, model_name=model, embedding_model=embedding_model, parser=parser, db_name=db_name)
+        # imported on first use: the cv_agent stack (langchain tools, pandas) is only needed here
+        from cv_agent.cv_agent_main import cv_agent_query
+        # only this request's lines, even with concurrent requests
+        with log_stream.stream_to(sid), log_capture.capture_logs() as log_buffer, tracing.start_trace("cv_agent") as trace, priority("agent"):
+            key = question_key(question, "cv_agent", db_name, model, embedding_model, parser)
+            (answer, context_str), _ = chat_flight.do(key, cv_agent_query, question, model_name=model, embedding_model=embedding_model, parser=parser, db_name=db_name)
         
-        # Save to DB
-        captured_logs = log_capture_string.getvalue()
-        try:
-            with db_utils.get_db_connection(DB_NAME) as conn:
-                db_utils.save_qa_log(conn, question, answer, captured_logs, context_str)
-        except Exception as db_e:
-            rag_logger.error(f"Error saving to DB: {db_e}")
+        # Save to DB in the background writer; never blocks the response
+        qa_writer.submit(question, answer, log_buffer.getvalue(), context_str, trace.spans)
 
         return jsonify({'response': answer})
+    except LLMOverloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         rag_logger.error(f"Error in query_rag: {e}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        rag_logger.removeHandler(ch)
-        log_capture_string.close()
 
 @app.route('/history', methods=['GET'])
 def get_history():
+    """One page of questions, newest first: ?limit=&cursor=<next_cursor>&q=<search words>"""
+    limit = min(max(request.args.get('limit', default=HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    search = request.args.get('q')
     try:
-        with db_utils.get_db_connection(DB_NAME) as conn:
-            history = db_utils.get_qa_history(conn)
+        with db_utils.get_db_connection(DB_NAME) as conn, metrics.time_backend("sqlite", "get_qa_history"):
+            history = db_utils.get_qa_history(conn, limit=limit, cursor=cursor, search=search)
         return jsonify(history)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/history/<int:id>', methods=['GET'])
 def get_history_details(id):
     try:
-        with db_utils.get_db_connection(DB_NAME) as conn:
+        with db_utils.get_db_connection(DB_NAME) as conn, metrics.time_backend("sqlite", "get_qa_details"):
             details = db_utils.get_qa_details(conn, id)
         if details:
             return jsonify(details)
@@ -175,11 +339,66 @@ def get_history_details(id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/stats/qa_writer', methods=['GET'])
+def get_qa_writer_stats():
+    """Background QA writer queue depth and written / dropped row counts."""
+    return jsonify(qa_writer.stats())
+
+@app.route('/stats/llm', methods=['GET'])
+def get_llm_stats():
+    """Per-model limit, running and waiting LLM calls by priority class, and per-class throughput and wait times."""
+    return jsonify(llm_scheduler.stats())
+
+@app.route('/stats/hedging', methods=['GET'])
+def get_hedging_stats():
+    """Per hedged stage: hedge rate, winners and p99 of the primary alone vs. the hedged result."""
+    return jsonify(hedging.stats())
+
+@app.route('/stats/breakers', methods=['GET'])
+def get_breaker_stats():
+    """Circuit breaker state and recent error counts per LLM / embedding backend."""
+    return jsonify(circuit_breaker.stats())
+
+@app.route('/stats/spans', methods=['GET'])
+def get_span_stats():
+    """Latency percentiles and mean token counts per pipeline stage, over the last N questions (?last=N)."""
+    last = request.args.get('last', default=200, type=int)
+    try:
+        with db_utils.get_db_connection(DB_NAME) as conn:
+            spans = db_utils.get_spans(conn, last_questions=last)
+        return jsonify(tracing.summarize_spans(spans))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@socketio.on('connect')
+def on_connect():
+    # normally already running (__main__ / gunicorn post_fork); start() is idempotent
+    log_emitter.start()
+
+# imported on first use by the routes and the pipeline, so the dev server and the CLIs
+# start faster; the production parent imports them before forking so workers share them
+LAZY_IMPORTS = ["cv_agent.cv_agent_main", "langchain_chroma", "google.genai"]
+
+def preload_lazy_imports():
+    for name in LAZY_IMPORTS:
+        importlib.import_module(name)
+
+def init_db():
+    """Creates the QA tables. Run once per start, by the dev server below or the production parent process."""
+    with db_utils.get_db_connection(DB_NAME) as conn:
+        db_utils.create_qa_tables(conn)
+
 if __name__ == '__main__':
+    # dev server, one process; see server/gunicorn.conf.py for the multi-worker production mode
     print("Starting Flask SocketIO Server...")
     # Initialize DB tables
-    with db_utils.get_db_connection(DB_NAME) as conn:
-        db_utils.create_qa_tables(conn)
+    init_db()
+    # flushes its queue at exit (atexit), so answered questions aren't lost on Ctrl+C
+    qa_writer.start()
+    # loads models and indexes in the background; /ready answers 200 once done
+    warmup.start()
+    # before any request: a request's logs are queued whether or not a client is connected yet
+    log_emitter.start()
         
     # Use allow_unsafe_werkzeug=True if needed for dev environment with socketio
-    socketio.run(app, debug=True, port=5000, allow_unsafe_werkzeug=True, use_reloader=False)
+    socketio.run(app, debug=True, host=SERVER_HOST, port=SERVER_PORT, allow_unsafe_werkzeug=True, use_reloader=False)
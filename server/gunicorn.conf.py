@@ -0,0 +1,70 @@
+"""
+Production launch mode for server/app.py: one parent process imports the app once
+and forks SERVER_WORKERS workers that share the parent's pages copy-on-write.
+
+    RAG_WORKERS=4 RAG_SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 gunicorn -c server/gunicorn.conf.py
+
+The parent (preload_app) imports app.py and with it query / query_utils and langchain,
+plus the modules the app otherwise imports on first use (app.LAZY_IMPORTS: chromadb,
+the Gemini SDK, the cv_agent stack), creates the QA tables, loads the reranker if
+SERVER_PRELOAD_RERANKER, and freezes the garbage collector so those
+objects are not copied into each worker by the GC touching them. It opens no Chroma
+handles or SQLite connections and starts no threads: those don't survive fork(), so
+each worker opens its own (query_utils.get_vector_store) and starts its QA writer, log
+emitter (functions/log_stream.py) and warm-up (functions/warmup.py) in post_fork.
+GET /ready answers 200 once the worker handling it has warmed up.
+
+Workers are gthread workers (SERVER_THREADS threads each), the threading async mode
+Flask-SocketIO picks when eventlet / gevent are not installed. Requests are not
+sticky, so the browser connects over WebSocket only (no long-polling), and with more
+than one worker SOCKETIO_MESSAGE_QUEUE has to be set for log events to reach clients
+connected to another worker.
+"""
+import os
+import gc
+import sys
+
+server_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(server_dir), 'common'))
+from config import SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_THREADS, SERVER_PRELOAD_RERANKER, SOCKETIO_MESSAGE_QUEUE
+
+chdir = server_dir
+wsgi_app = "app:app"
+bind = f"{SERVER_HOST}:{SERVER_PORT}"
+workers = SERVER_WORKERS
+worker_class = "gthread"
+threads = SERVER_THREADS
+preload_app = True
+# gthread workers heartbeat from their main loop, so this does not cut off long /chat requests
+timeout = 120
+graceful_timeout = 30
+accesslog = "-"
+
+
+def when_ready(server):
+    """Runs in the parent after the app is imported, before the first fork."""
+    import app as server_app
+    server_app.init_db()
+    server_app.preload_lazy_imports()
+    if SERVER_PRELOAD_RERANKER:
+        from functions.query_utils import get_reranker
+        get_reranker()
+    if workers > 1 and not SOCKETIO_MESSAGE_QUEUE:
+        server.log.warning("RAG_SOCKETIO_MESSAGE_QUEUE is not set: log events only reach clients connected to the worker answering the request")
+    # everything allocated so far is left alone by the collector, so its pages stay shared
+    gc.freeze()
+    server.log.info(f"Preloaded app, {gc.get_freeze_count()} objects frozen, forking {workers} workers")
+
+
+def post_fork(server, worker):
+    """Runs in each worker right after fork()."""
+    import app as server_app
+    from functions.qa_writer import qa_writer
+    from functions.warmup import warmup
+    qa_writer.start()
+    # per worker: Chroma handles are per process (Ollama only loads each model once)
+    warmup.start()
+    # here, not on a Socket.IO connect: without sticky sessions the worker answering a
+    # request often has no connection of its own, and its queued log records must still
+    # be emitted (through the message queue)
+    server_app.log_emitter.start()
@@ -1,6 +1,7 @@
 document.addEventListener('DOMContentLoaded', () => {
-    // Connect to Socket.IO
-    const socket = io();
+    // Connect to Socket.IO. WebSocket only: with several server workers, long-polling
+    // requests could land on a worker that does not know the session
+    const socket = io({ transports: ['websocket'] });
     const logContainer = document.getElementById('log-container');
     const chatForm = document.getElementById('chat-form');
     const userInput = document.getElementById('user-input');
@@ -132,14 +133,22 @@ document.addEventListener('DOMContentLoaded', () => {
         historyContainer.classList.add('hidden');
     });
 
-    async function loadHistory() {
-        historyContainer.innerHTML = '<div class="log-entry system">Loading history...</div>';
+    async function loadHistory(cursor = null) {
+        if (!cursor) {
+            historyContainer.innerHTML = '<div class="log-entry system">Loading history...</div>';
+        }
         try {
-            const res = await fetch('/history');
-            const history = await res.json();
+            // paginated: each page carries the cursor of the next one
+            const res = await fetch(cursor ? `/history?cursor=${encodeURIComponent(cursor)}` : '/history');
+            const page = await res.json();
+            const history = page.items;
 
-            historyContainer.innerHTML = '';
-            if (history.length === 0) {
+            if (!cursor) {
+                historyContainer.innerHTML = '';
+            }
+            const loadMore = historyContainer.querySelector('.history-load-more');
+            if (loadMore) loadMore.remove();
+            if (history.length === 0 && !cursor) {
                 historyContainer.innerHTML = '<div class="log-entry system">No history found.</div>';
                 return;
             }
@@ -164,6 +173,14 @@ document.addEventListener('DOMContentLoaded', () => {
 
                 historyContainer.appendChild(itemDiv);
             });
+
+            if (page.next_cursor) {
+                const moreBtn = document.createElement('button');
+                moreBtn.className = 'history-load-more';
+                moreBtn.textContent = 'Load more';
+                moreBtn.addEventListener('click', () => loadHistory(page.next_cursor));
+                historyContainer.appendChild(moreBtn);
+            }
         } catch (e) {
             historyContainer.innerHTML = `<div class="log-entry ERROR">Error loading history: ${e.message}</div>`;
         }
@@ -250,17 +267,25 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // Handle WebSocket Logs
-    socket.on('log_message', (msg) => {
+    function appendLogEntry(text) {
         const entry = document.createElement('div');
         entry.className = 'log-entry';
 
         // Simple heuristic for log level styling
-        if (msg.data.includes('ERROR')) entry.classList.add('ERROR');
-        else if (msg.data.includes('WARNING')) entry.classList.add('WARNING');
+        if (text.includes('ERROR')) entry.classList.add('ERROR');
+        else if (text.includes('WARNING')) entry.classList.add('WARNING');
         else entry.classList.add('INFO');
 
-        entry.textContent = msg.data;
+        entry.textContent = text;
         logContainer.appendChild(entry);
+    }
+
+    // The server batches this tab's log records (only the questions it asked)
+    socket.on('log_batch', (msg) => {
+        msg.records.forEach(appendLogEntry);
+        if (msg.dropped) {
+            appendLogEntry(`WARNING - ${msg.dropped} log lines dropped by the server`);
+        }
 
         // Auto-scroll
         logContainer.scrollTop = logContainer.scrollHeight;
@@ -303,7 +328,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     db_name: dbNameDisplay.textContent,
                     embedding_model: embeddingSelect.value,
                     model: llmSelect.value,
-                    parser: parserSelect.value
+                    parser: parserSelect.value,
+                    sid: socket.id
                 }),
                 signal: controller.signal
             });